@@ -1,115 +1,139 @@
-from PyQt5.QtWidgets import QDesktopWidget, QMainWindow, QPushButton, QFileDialog, QLabel, QScrollArea, QWidget, QVBoxLayout, QRadioButton, QGroupBox, QProgressBar, QTextEdit, QDialog, QHBoxLayout, QApplication
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QMutex, QWaitCondition
+from PyQt5.QtWidgets import QDesktopWidget, QMainWindow, QPushButton, QFileDialog, QLabel, QScrollArea, QWidget, QVBoxLayout, QRadioButton, QGroupBox, QCheckBox, QProgressBar, QTextEdit, QDialog, QHBoxLayout, QApplication
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QPixmap, QFont, QIcon
 import img_cropper
 import time
 import os
 import sys
 import ctypes
+import threading
 
 class ProcessorThread(QThread):
     progress_updated = pyqtSignal(int)
+    progress_busy = pyqtSignal()
     update_info = pyqtSignal(str)
+    metrics_updated = pyqtSignal(dict)
     finished = pyqtSignal()
 
-    def __init__(self, input_file_paths, input_folder_path, output_folder_path, is_alpha, is_chinese):
+    def __init__(self, input_file_paths, input_folder_path, output_folder_path, is_alpha, is_chinese, workers=1, max_in_flight=None, ordered=False, total=None, incremental=False, metrics_path=None, pipeline=None, output_options=None):
         super().__init__()
 
-        self.is_running = True
-        self.is_paused = False
-        self.is_alpha = is_alpha
         self.is_chinese = is_chinese
-        self.mutex = QMutex()
-        self.condition = QWaitCondition()
 
+        # input_file_paths 可以是逐个产出路径的生成器，此时总数未知，除非另外给出 total
         self.input_file_paths = input_file_paths
+        if total is None and hasattr(input_file_paths, '__len__'):
+            total = len(input_file_paths)
+        self.total = total
         self.input_folder_path = input_folder_path
-        self.output_folder_path = output_folder_path
+
+        # 批量处理由 img_cropper.BatchRunner 完成，此处只负责把结果转为界面信息
+        # workers 为并行处理的进程数，incremental 为是否跳过上次运行后未改动的图片，pipeline 为空时不分阶段处理
+        # output_options 为空时输出 PNG，其中的 derived 可在同一次处理中生成缩略图等派生输出
+        job = img_cropper.CropJob(input_folder_path, output_folder_path, is_alpha, output_options, workers=workers, max_in_flight=max_in_flight,
+                                  ordered=ordered, pipeline=pipeline, incremental=incremental)
+        self.runner = img_cropper.BatchRunner(job, total=self.total)
+        self.metrics = self.runner.metrics
+        # 逐张记录各阶段耗时的文件，为空则不记录
+        self.metrics_path = metrics_path
+
+
+    # 总数未知时在后台单独统计图片数量，以便显示百分比和剩余时间
+    def count_total(self):
+        self.total = self.metrics.total = sum(1 for _ in img_cropper.scan_images(self.input_folder_path))
 
 
     def run(self):
         t1 = time.time()
-        outpath = self.input_folder_path + '/output'
-        if (self.output_folder_path == ''):
-            if os.path.exists(outpath):
-                pass
-            else:
-                os.mkdir(outpath)
+
+        # 总数未知时进度条先显示为忙碌状态
+        if not self.total:
+            self.progress_busy.emit()
+            threading.Thread(target=self.count_total, daemon=True).start()
+        metrics_log = img_cropper.MetricsLog(self.metrics_path) if self.metrics_path else None
+        last_emit = 0
+
+        processed = 0
+        for result in self.runner.run(self.input_file_paths):
+            processed += 1
+            if self.total:
+                self.progress_updated.emit(100 * processed // self.total)
+            self.report(result)
+
+            if metrics_log:
+                metrics_log.write_result(result)
+            # 每秒最多更新一次统计信息
+            if time.time() - last_emit >= 1:
+                last_emit = time.time()
+                self.metrics_updated.emit(self.metrics.snapshot())
+        
+        snapshot = self.metrics.snapshot()
+        if metrics_log:
+            metrics_log.write_snapshot(snapshot)
+            metrics_log.close()
+        self.progress_updated.emit(100)
+        self.finished.emit()
+        if self.is_chinese:
+            self.update_info.emit(f'- 文件夹 [{self.input_folder_path}] 处理完毕, 耗时 {time.time() - t1} 秒')
         else:
-            outpath = self.output_folder_path
+            self.update_info.emit(f'- Processing of folder [{self.input_folder_path}] completed, took {time.time() - t1} seconds')
+        if snapshot['busiest_stage']:
+            mb_in = snapshot['bytes_in'] / 2 ** 20
+            if self.is_chinese:
+                self.update_info.emit(f'- 共读取 {mb_in:.1f} MB, 平均 {processed / snapshot["elapsed"]:.1f} 张/秒, 耗时最多的阶段为 {snapshot["busiest_stage"]}')
+            else:
+                self.update_info.emit(f'- Read {mb_in:.1f} MB, {processed / snapshot["elapsed"]:.1f} images/s on average, busiest stage: {snapshot["busiest_stage"]}')
 
-        for file_path in self.input_file_paths:
-            
-            if not self.is_running:
-                break
 
-            self.mutex.lock()
-            if self.is_paused:
-                self.condition.wait(self.mutex)
-            self.mutex.unlock()
+    def report(self, result):
+        temp_name = result.name
+        ini_size, cropped_size = result.ini_size, result.cropped_size
 
-            if self.is_alpha:
-                cropped_img, ini_size, cropped_size = img_cropper.crop_by_alpha(file_path)
+        # 上次运行后未改动
+        if result.cached:
+            if self.is_chinese:
+                self.update_info.emit(f'- 图像 [{temp_name}] 自上次处理后未改动，已跳过')
             else:
-                cropped_img, ini_size, cropped_size = img_cropper.crop_by_white(file_path)
+                self.update_info.emit(f'- Image [{temp_name}] is unchanged since the last run, skipped')
 
-            temp_name = file_path.split('.')[-2].split('/')[-1]
+        # 找不到图像
+        elif result.status == img_cropper.STATUS_NOT_FOUND:
+            if self.is_chinese:
+                self.update_info.emit(f'- 找不到图像 [{temp_name}]')
+            else:
+                self.update_info.emit(f'- Cannot find image [{temp_name}]')
 
-            # 找不到图像
-            if len(cropped_img) == 0:
-                if self.is_chinese:
-                    self.update_info.emit(f'- 找不到图像 [{temp_name}]')
-                else:
-                    self.update_info.emit(f'- Cannot find image [{temp_name}]')
-                continue
+        # 图像未被处理
+        elif result.status == img_cropper.STATUS_NOT_CROPPED:
+            if self.is_chinese:
+                self.update_info.emit(f'- 图像 [{temp_name}] 未被裁剪')
+            else:
+                self.update_info.emit(f'- Image [{temp_name}] is not cropped')
 
-            # 图像未被处理
-            if cropped_size == ini_size:
-                if self.is_chinese:
-                    self.update_info.emit(f'- 图像 [{temp_name}] 未被裁剪')
-                else:
-                    self.update_info.emit(f'- Image [{temp_name}] is not cropped')
-                continue
-            
-            img_cropper.file_save(cropped_img, outpath, temp_name)
-            self.progress_updated.emit(100 * (self.input_file_paths.index(file_path) + 1) // len(self.input_file_paths))
+        # 处理出错
+        elif result.status == img_cropper.STATUS_ERROR:
+            if self.is_chinese:
+                self.update_info.emit(f'- 处理图像 [{temp_name}] 时出错: {result.error}')
+            else:
+                self.update_info.emit(f'- Error while processing image [{temp_name}]: {result.error}')
 
+        else:
             if self.is_chinese:
                 self.update_info.emit(f'- 处理完成 [{temp_name}], 尺寸从 ({ini_size[0]}, {ini_size[1]}) 缩小至 ({cropped_size[0]}, {cropped_size[1]})')
             else:
                 self.update_info.emit(f'- Processing of image [{temp_name}] completed, with dimensions reduced from ({ini_size[0]}, {ini_size[1]}) to ({cropped_size[0]}, {cropped_size[1]})')
-        
-        self.progress_updated.emit(100)
-        self.finished.emit()
-        if self.is_chinese:
-            self.update_info.emit(f'- 文件夹 [{self.input_folder_path}] 处理完毕, 耗时 {time.time() - t1} 秒')
-        else:
-            self.update_info.emit(f'- Processing of folder [{self.input_folder_path}] completed, took {time.time() - t1} seconds')
-        
-        self.is_running = False
-        self.is_paused = False
 
 
     def pause(self):
-        self.mutex.lock()
-        self.is_paused = True
-        self.mutex.unlock()
-        
+        self.runner.token.pause()
+
 
     def resume(self):
-        self.mutex.lock()
-        self.is_paused = False
-        self.condition.wakeAll()
-        self.mutex.unlock()
+        self.runner.token.resume()
 
 
     def cease(self):
-        self.mutex.lock()
-        self.is_running = False
-        if self.is_paused:
-            self.is_paused = False
-            self.condition.wakeAll()
-        self.mutex.unlock()
+        self.runner.cancel()
 
     def change_lang(self):
         self.is_chinese = not self.is_chinese
@@ -182,14 +206,16 @@ class CustomMessageBox(QDialog):
 class MainWindow(QMainWindow):
 
     myappid = "ImageEdgesCropper"
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    # 仅在 Windows 下设置任务栏图标分组
+    if sys.platform == 'win32':
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
     is_chinese = True
 
     window_title = ["图片透明/白色边缘批量裁剪工具", "Image Transparent/White Edges Batch Cropper"]
     input_button_text = ["选择输入文件夹", "Input Folder"]
     output_button_text = ["选择输出文件夹", "Output Folder"]
-    input_path_text = ["仅处理文件夹直接包含的图片，后缀支持 .png .jpg .jpeg", "Only Handle Images Directly In Input Folder, With Extensions .png .jpg .jpeg"]
+    input_path_text = ["仅处理文件夹直接包含的图片，后缀支持 .png .jpg .jpeg .gif .tif .tiff", "Only Handle Images Directly In Input Folder, With Extensions .png .jpg .jpeg .gif .tif .tiff"]
     output_path_text = ["若为空，则自动在输入文件夹下创建 output 文件夹以储存", "If Empty, Automatically Create An 'output' Folder In Input Folder For Storage"]
     group_box_text = ["裁剪模式", "Cropping Mode"]
     alpha_button_text = ["透明边缘", "Transparent"]
@@ -198,6 +224,7 @@ class MainWindow(QMainWindow):
     pause_button_text = ["暂停", "Pause"]
     continue_button_text = ["继续", "Continue"]
     cease_button_text = ["终止", "Cease"]
+    incremental_box_text = ["跳过上次处理后未改动的图片", "Skip Images Unchanged Since Last Run"]
     info_box_text = ["处理信息：", "Process Information:"]
     select_input_folder_text = ["选择输入文件夹", "Select Input Folder"]
     select_output_folder_text = ["选择输出文件夹", "Select Output Folder"]
@@ -243,8 +270,12 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle(self.window_title[0])
+        # 并行处理图片的进程数
+        self.workers = os.cpu_count() or 1
         # 初始化UI
         self.init_UI()
+        # img_cropper 按需导入 NumPy 与 OpenCV，窗口显示后在后台线程中预先导入，第一次处理时不必等待
+        QTimer.singleShot(0, lambda: threading.Thread(target=img_cropper.preload, daemon=True).start())
 
 
     def init_UI(self):
@@ -312,6 +343,10 @@ class MainWindow(QMainWindow):
         self.is_paused = False
         self.cease_button.clicked.connect(self.on_cease_button_clicked)
 
+        # 创建增量处理选项，默认关闭，每次启动都重新处理全部图片
+        self.incremental_box = QCheckBox(self.incremental_box_text[0], self)
+        self.incremental_box.setGeometry(40, 250, 300, 30)
+
         # 创建处理进度条
         self.progress_value = 0
         self.progress_bar = QProgressBar(self)
@@ -387,11 +422,16 @@ class MainWindow(QMainWindow):
                 self.select_output_button.setEnabled(False)
                 self.alpha_button.setEnabled(False)
                 self.white_button.setEnabled(False)
-                self.input_file_paths = img_cropper.file_read(self.input_folder)
+                self.incremental_box.setEnabled(False)
+                # 在处理线程中边扫描边处理，避免大文件夹下界面卡顿
+                self.input_file_paths = img_cropper.scan_images(self.input_folder)
 
                 # 启动处理线程
-                self.processor_thread = ProcessorThread(self.input_file_paths, self.input_folder, self.output_folder, self.is_alpha, self.is_chinese)
+                self.processor_thread = ProcessorThread(self.input_file_paths, self.input_folder, self.output_folder, self.is_alpha, self.is_chinese, self.workers,
+                                                        incremental=self.incremental_box.isChecked(), pipeline=img_cropper.PipelineOptions())
                 self.processor_thread.progress_updated.connect(self.update_progress)
+                self.processor_thread.progress_busy.connect(self.set_progress_busy)
+                self.processor_thread.metrics_updated.connect(self.update_metrics)
                 self.processor_thread.update_info.connect(self.update_info)
                 self.processor_thread.finished.connect(self.fin_ui_reset)
                 self.processor_thread.start()
@@ -458,6 +498,7 @@ class MainWindow(QMainWindow):
                 else:
                     self.start_pause_button.setText(self.continue_button_text[0])
             self.cease_button.setText(self.cease_button_text[0])
+            self.incremental_box.setText(self.incremental_box_text[0])
             if not self.is_running and not self.is_started:
                 self.info_box.setText(self.info_box_text[0])
             self.info_label.setText(self.click_info_label[0])
@@ -483,6 +524,7 @@ class MainWindow(QMainWindow):
                 else:
                     self.start_pause_button.setText(self.continue_button_text[1])
             self.cease_button.setText(self.cease_button_text[1])
+            self.incremental_box.setText(self.incremental_box_text[1])
             if not self.is_running and not self.is_started:
                 self.info_box.setText(self.info_box_text[1])
             self.info_label.setText(self.click_info_label[1])
@@ -493,9 +535,27 @@ class MainWindow(QMainWindow):
 
     def update_progress(self, value):
         if self.is_running:
+            self.progress_bar.setRange(0, 100)
             self.progress_bar.setValue(value)
 
 
+    def set_progress_busy(self):
+        if self.is_running:
+            self.progress_bar.setRange(0, 0)
+
+
+    # 在进度条上显示处理速度及剩余时间
+    def update_metrics(self, snapshot):
+        if not self.is_running:
+            return
+        if snapshot['eta'] is None:
+            self.progress_bar.setFormat('%p%')
+        elif self.is_chinese:
+            self.progress_bar.setFormat(f'%p%    {snapshot["images_per_s"]:.1f} 张/秒, 剩余约 {snapshot["eta"]:.0f} 秒')
+        else:
+            self.progress_bar.setFormat(f'%p%    {snapshot["images_per_s"]:.1f} images/s, about {snapshot["eta"]:.0f} s left')
+
+
     def update_info(self, info):
         self.info_box.append(info)
 
@@ -503,22 +563,27 @@ class MainWindow(QMainWindow):
     def cease_ui_reset(self):
         self.is_running = False
         self.is_paused = False
+        self.progress_bar.setFormat('%p%')
+        self.progress_bar.setRange(0, 100)
         self.progress_bar.reset()
         self.start_pause_button.setText(self.start_button_text[0] if self.is_chinese else self.start_button_text[1])
         self.select_input_button.setEnabled(True)
         self.select_output_button.setEnabled(True)
         self.alpha_button.setEnabled(True)
         self.white_button.setEnabled(True)
+        self.incremental_box.setEnabled(True)
 
 
     def fin_ui_reset(self):
         self.is_running = False
         self.is_paused = False
+        self.progress_bar.setFormat('%p%')
         self.start_pause_button.setText(self.start_button_text[0] if self.is_chinese else self.start_button_text[1])
         self.select_input_button.setEnabled(True)
         self.select_output_button.setEnabled(True)
         self.alpha_button.setEnabled(True)
         self.white_button.setEnabled(True)
+        self.incremental_box.setEnabled(True)
 
     def resource_path(self, relative_path):
         try:
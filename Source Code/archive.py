@@ -0,0 +1,242 @@
+import io
+import os
+import posixpath
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from time import perf_counter
+import img_cropper
+
+
+# 与 img_cropper 共用按需导入的 NumPy；命令行工具总会导入本模块，归档模块只在处理归档时才导入
+np = img_cropper.np
+tarfile = img_cropper.LazyModule('tarfile')
+zipfile = img_cropper.LazyModule('zipfile')
+
+
+# 直接读写 ZIP / TAR 归档中的图片，无需先解压到磁盘
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# 在途成员内容的总大小上限（字节），归档中的大文件较多时限制内存占用
+MAX_BYTES_IN_FLIGHT = 256 * 2 ** 20
+
+
+def is_archive(file_path):
+    return file_path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+# 未指定输出时在输入归档旁生成同类型的归档，如 a.zip -> a_cropped.zip
+def default_output(archive_path):
+    lower = archive_path.lower()
+    ext = next(ext for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True) if lower.endswith(ext))
+    return archive_path[:-len(ext)] + '_cropped' + archive_path[-len(ext):]
+
+
+# 逐个读出归档中的图片成员，产出 (成员名, 内容)
+# TAR 以流方式顺序读取，不需要随机访问，也可以是压缩的 TAR
+def read_members(archive_path, include=None, exclude=None):
+
+    def selected(name):
+        return name.lower().endswith(img_cropper.IMAGE_EXTENSIONS) and img_cropper.path_selected(name, include, exclude)
+
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and selected(info.filename):
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and selected(member.name):
+                    yield member.name, archive.extractfile(member).read()
+
+
+# 按输出路径写入 ZIP、TAR 或文件夹，成员名中的子文件夹保留
+# 归档以流方式读取，无法预先知道全部成员名；与已写出的成员重名（不区分大小写）时，在后缀前加上 ~2、~3 等
+class ArchiveWriter:
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.names = set()
+        self.zip = self.tar = None
+        lower = output_path.lower()
+        if lower.endswith('.zip'):
+            # 图片本身已压缩，直接存储
+            self.zip = zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED)
+        elif is_archive(output_path):
+            compression = {'.gz': 'gz', '.tgz': 'gz', '.bz2': 'bz2', '.tbz2': 'bz2', '.xz': 'xz', '.txz': 'xz'}
+            suffix = next((value for key, value in compression.items() if lower.endswith(key)), '')
+            self.tar = tarfile.open(output_path, 'w|' + suffix)
+        else:
+            os.makedirs(output_path, exist_ok=True)
+
+
+    def write(self, name, data):
+        name = self.unique_name(safe_name(name))
+        if self.zip:
+            self.zip.writestr(name, data)
+        elif self.tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self.tar.addfile(info, io.BytesIO(data))
+        else:
+            with img_cropper.AtomicFile(os.path.join(self.output_path, *name.split('/'))) as f:
+                f.write(data)
+        return name
+
+
+    def unique_name(self, name):
+        stem, ext = posixpath.splitext(name)
+        candidate, count = name, 1
+        while candidate.lower() in self.names:
+            count += 1
+            candidate = f'{stem}~{count}{ext}'
+        self.names.add(candidate.lower())
+        return candidate
+
+
+    def close(self):
+        if self.zip:
+            self.zip.close()
+        elif self.tar:
+            self.tar.close()
+
+
+# 去掉成员名中的盘符、开头的斜杠及 ..，防止写到输出位置之外
+def safe_name(name):
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if parts and parts[0].endswith(':'):
+        parts = parts[1:]
+    return '/'.join(parts)
+
+
+# 在工作进程中处理一个成员，返回 (CropResult, 输出内容)，输出内容为 None 时原样写出
+def crop_member(name, data, is_alpha, tolerance=None, output_options=None):
+
+    metrics = {'bytes_in': len(data)}
+    # 输出名由 process_archive 写出时确定，与已写出的成员重名时另加序号
+    result = img_cropper.CropResult(name, posixpath.splitext(posixpath.basename(name))[0], None, metrics=metrics)
+
+    # 仅凭文件头即可判断无需裁剪的成员不解码，有派生输出时仍要解码
+    t = perf_counter()
+    derived = img_cropper.has_derived(output_options)
+    croppable = derived or img_cropper.header_may_be_cropped(io.BytesIO(data), is_alpha)
+    metrics['precheck'] = perf_counter() - t
+    if not croppable:
+        return result._replace(status=img_cropper.STATUS_NOT_CROPPED), None
+    if is_multi_frame(name, data):
+        result = result._replace(status=img_cropper.STATUS_NOT_CROPPED)
+        if not derived:
+            return result, None
+        # 原样保留的多帧图片由第一帧生成派生输出
+        t = perf_counter()
+        img = img_cropper.cv2.imdecode(np.frombuffer(data, dtype=np.uint8), img_cropper.cv2.IMREAD_UNCHANGED)
+        metrics['decode'] = perf_counter() - t
+        if img is None:
+            raise img_cropper.DecodeError('cannot decode image')
+        t = perf_counter()
+        payload = None, None, img_cropper.collect_derived(img_cropper.submit_derived(img, output_options))
+        metrics['encode'] = perf_counter() - t
+        return result, payload
+    return img_cropper.compute_stage(result, np.frombuffer(data, dtype=np.uint8), is_alpha, tolerance, output_options)
+
+
+# 多帧图片（APNG、GIF、多页 TIFF）的输出为多个文件或整个动画，在归档中原样保留
+def is_multi_frame(name, data):
+    if name.lower().endswith(img_cropper.MULTI_FRAME_EXTENSIONS):
+        ok, animation = img_cropper.cv2.imdecodeanimation(np.frombuffer(data, dtype=np.uint8), 1, 1)
+        return ok and len(animation.frames) > 0
+    return data[:8] == img_cropper.PNG_SIGNATURE and img_cropper.png_is_animated(io.BytesIO(data[8:]))
+
+
+def crop_member_safely(name, data, is_alpha, tolerance=None, output_options=None):
+    try:
+        return crop_member(name, data, is_alpha, tolerance, output_options)
+    except Exception as e:
+        return img_cropper.error_result(name, e), None
+
+
+# 流式处理归档，逐个产出 (index, CropResult)，结果按完成顺序产出
+# 裁剪后的图片按输出格式改后缀写出；未裁剪或出错的成员原样写出，输出归档中的文件与输入一一对应
+# 在途成员数不超过 max_in_flight，内容总大小不超过 max_bytes（至少保留一个），内存占用与归档大小无关
+# output_options 只支持 png 与 keep 两种输出格式
+def process_archive(archive_path, output_path, is_alpha, workers=1, max_in_flight=None, output_options=None, tolerance=None,
+                    include=None, exclude=None, wait_if_paused=None, is_running=None, max_bytes=MAX_BYTES_IN_FLIGHT):
+
+    wait_if_paused = wait_if_paused or (lambda: None)
+    is_running = is_running or (lambda: True)
+    output_options = output_options or img_cropper.OutputOptions()
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    members = enumerate(read_members(archive_path, include, exclude))
+    writer = ArchiveWriter(output_path)
+    pending = {}
+    bytes_in_flight = 0
+    exhausted = False
+
+    def finish(index, name, data, result, payload):
+        metrics = result.metrics if result.metrics is not None else {}
+        t = perf_counter()
+        ext, encoded, derived = payload or (None, None, ())
+        # 没有裁剪后的图片时原样写出
+        if encoded is None:
+            output = writer.write(name, data)
+            size = len(data)
+        else:
+            output = writer.write(posixpath.splitext(name)[0] + ext, memoryview(encoded))
+            size = len(encoded)
+        # 派生输出的名称跟随实际写出的名称
+        stem = posixpath.splitext(output)[0]
+        # 派生输出与输出的图片写在同一位置
+        for suffix, derived_ext, derived_data in derived:
+            writer.write(stem + suffix + derived_ext, memoryview(derived_data))
+            size += len(derived_data)
+        metrics['write'] = perf_counter() - t
+        metrics['bytes_out'] = size
+        return index, result._replace(path=archive_path + '/' + name, name=posixpath.basename(stem), output=output, metrics=metrics)
+
+    try:
+        # 单进程时直接在当前线程中处理
+        if workers <= 1:
+            for index, (name, data) in members:
+                wait_if_paused()
+                if not is_running():
+                    break
+                result, payload = crop_member_safely(name, data, is_alpha, tolerance, output_options)
+                yield finish(index, name, data, result, payload)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                while not exhausted and len(pending) < max_in_flight and (not pending or bytes_in_flight < max_bytes):
+                    wait_if_paused()
+                    if not is_running():
+                        exhausted = True
+                        for future in pending:
+                            future.cancel()
+                        break
+                    try:
+                        index, (name, data) = next(members)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(crop_member_safely, name, data, is_alpha, tolerance, output_options)
+                    pending[future] = index, name, data
+                    bytes_in_flight += len(data)
+
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index, name, data = pending.pop(future)
+                        bytes_in_flight -= len(data)
+                        if future.cancelled():
+                            continue
+                        try:
+                            result, payload = future.result()
+                        except Exception as e:
+                            result, payload = img_cropper.error_result(name, e), None
+                        yield finish(index, name, data, result, payload)
+
+                if exhausted and not pending:
+                    break
+    finally:
+        writer.close()
@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import cv2
+import img_cropper
+
+
+# 合成图片的边长，从图标到超大扫描件
+CORPUS_SIZES = {'icon': 64, 'small': 512, 'medium': 2048, 'large': 8000, 'huge': 20000}
+DEFAULT_SIZES = ['icon', 'small', 'medium']
+# 边缘类型：透明边、白边、无边（内容铺满整张图）
+BORDERS = ('alpha', 'white', 'none')
+# 分阶段计时的各个阶段
+STAGES = ('read', 'decode', 'bbox', 'encode', 'write')
+# 冷启动计时的各项：在新的解释器中执行的代码，python 为空解释器的启动时间，其余各项减去它即为导入耗时
+# img_cropper.preload 包括按需导入的 NumPy 与 OpenCV，即处理第一张图片前的全部导入耗时
+STARTUP_TARGETS = {
+    'python': 'pass',
+    'img_cropper': 'import img_cropper',
+    'img_cropper.preload': 'import img_cropper; img_cropper.preload()',
+    'cli': 'import cli',
+    'gui': 'import main, GUI_window',
+}
+# 导入耗时增加不超过此值（秒）时视为计时误差，不报告为退化
+STARTUP_NOISE = 0.005
+
+
+# 解析命令行参数
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the cropping pipeline on a synthetic corpus.')
+    parser.add_argument('--corpus', default='', help='folder for the synthetic corpus, generated if missing; defaults to a temporary folder')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), help=f'comma separated sizes out of {", ".join(CORPUS_SIZES)}')
+    parser.add_argument('--count', type=int, default=2, help='images per size/border/channels/format combination')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per image for the stage timings, the fastest is kept')
+    parser.add_argument('--workers', default='1', help='comma separated worker counts for the end-to-end batch runs')
+    parser.add_argument('--backends', default='mask,edges,numba', help='comma separated scan backends to compare, unavailable ones are skipped')
+    parser.add_argument('--startup-repeat', type=int, default=10, help='cold starts per startup target, the fastest is kept')
+    parser.add_argument('--startup-only', action='store_true', help='only time the startup, without generating a corpus')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the corpus')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='file to save the results to')
+    parser.add_argument('--compare', default='', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative throughput drop reported as a regression')
+    return parser.parse_args(argv)
+
+
+# 生成一张合成图片：中间为带噪声的渐变内容，四周为指定类型的边缘
+def make_image(size, border, channels, rng):
+
+    # 用小块噪声平铺代替整图随机数，避免超大图生成过慢
+    tile = rng.integers(0, 64, (64, 64, channels), dtype=np.uint8)
+    reps = (size + 63) // 64
+    img = np.tile(tile, (reps, reps, 1))[:size, :size]
+    img += (np.arange(size, dtype=np.uint16) * 128 // size).astype(np.uint8)[:, np.newaxis, np.newaxis]
+    if channels == 4:
+        img[:, :, 3] = 255
+
+    if border == 'none':
+        return img
+    # 边缘宽度随机，各边不同
+    top, bottom, left, right = (int(rng.integers(size // 16, size // 4 + 1)) for _ in range(4))
+    frame = np.ones((size, size), dtype=bool)
+    frame[top:size - bottom, left:size - right] = False
+    if border == 'alpha':
+        img[frame] = 0
+    else:
+        img[frame] = 255
+    return img
+
+
+# 生成合成图片集，返回每张图片的路径及属性
+def generate_corpus(folder, sizes, count, seed):
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    corpus = []
+    for size_name in sizes:
+        size = CORPUS_SIZES[size_name]
+        for border in BORDERS:
+            for channels in (3, 4):
+                # 三通道图片没有透明边缘
+                if border == 'alpha' and channels == 3:
+                    continue
+                for ext in ('png', 'jpg'):
+                    # JPEG 不支持透明通道
+                    if ext == 'jpg' and channels == 4:
+                        continue
+                    for index in range(count):
+                        name = f'{size_name}_{border}_{channels}ch_{index}.{ext}'
+                        file_path = folder + '/' + name
+                        if not os.path.exists(file_path):
+                            img = make_image(size, border, channels, rng)
+                            cv2.imencode('.' + ext, img)[1].tofile(file_path)
+                        corpus.append({'file': name, 'path': file_path, 'size': size_name, 'border': border,
+                                       'channels': channels, 'format': ext, 'megapixels': size * size / 1e6})
+    return corpus
+
+
+# 对单张图片分阶段计时，重复 repeat 次取最快的一次
+def time_stages(file_path, is_alpha, output_path, repeat):
+
+    best = None
+    for _ in range(repeat):
+        timings = {}
+        t = time.perf_counter()
+        img_data = np.fromfile(file=file_path, dtype=np.uint8)
+        timings['read'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        img = cv2.imdecode(img_data, cv2.IMREAD_UNCHANGED)
+        timings['decode'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        top, bottom, left, right = img_cropper.find_crop_bbox(img, is_alpha)
+        timings['bbox'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        encoded = cv2.imencode('.png', img[top:bottom, left:right])[1]
+        timings['encode'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        encoded.tofile(output_path + '/' + os.path.basename(file_path) + '.png')
+        timings['write'] = time.perf_counter() - t
+
+        timings['total'] = sum(timings[stage] for stage in STAGES)
+        if best is None or timings['total'] < best['total']:
+            best = timings
+    return best
+
+
+# 汇总各阶段的吞吐量
+def summarize(records):
+
+    summary = {}
+    for mode in ('alpha', 'white'):
+        mode_records = [record for record in records if record['mode'] == mode]
+        if not mode_records:
+            continue
+        megapixels = sum(record['megapixels'] for record in mode_records)
+        for stage in STAGES + ('total',):
+            seconds = sum(record[stage] for record in mode_records)
+            summary[f'{mode}.{stage}'] = {
+                'seconds': seconds,
+                'images_per_s': len(mode_records) / seconds if seconds else None,
+                'mp_per_s': megapixels / seconds if seconds else None,
+            }
+    return summary
+
+
+# 比较各扫描后端计算边界框的耗时，每张图片重复 repeat 次取最快的一次
+def time_backends(corpus, backends, repeat):
+
+    images = [(cv2.imread(item['path'], cv2.IMREAD_UNCHANGED), item['megapixels']) for item in corpus]
+    results = {}
+    for backend in backends:
+        img_cropper.set_scan_backend(backend)
+        for mode in ('alpha', 'white'):
+            is_alpha = mode == 'alpha'
+            # 预热一次，numba 后端首次调用时需要编译
+            img_cropper.find_crop_bbox(images[0][0], is_alpha)
+            seconds = 0
+            for img, _ in images:
+                best = None
+                for _ in range(repeat):
+                    t = time.perf_counter()
+                    img_cropper.find_crop_bbox(img, is_alpha)
+                    elapsed = time.perf_counter() - t
+                    best = elapsed if best is None else min(best, elapsed)
+                seconds += best
+            megapixels = sum(megapixels for _, megapixels in images)
+            results[f'{backend}.{mode}'] = {'seconds': seconds, 'mp_per_s': megapixels / seconds if seconds else None}
+    img_cropper.set_scan_backend('auto')
+    return results
+
+
+# 端到端批量处理计时
+def time_batch(corpus, is_alpha, workers, output_path):
+
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+    paths = [item['path'] for item in corpus]
+    t = time.perf_counter()
+    for _ in img_cropper.process_batch(paths, output_path, is_alpha, workers=workers):
+        pass
+    seconds = time.perf_counter() - t
+    megapixels = sum(item['megapixels'] for item in corpus)
+    return {
+        'mode': 'alpha' if is_alpha else 'white',
+        'workers': workers,
+        'images': len(paths),
+        'seconds': seconds,
+        'images_per_s': len(paths) / seconds,
+        'mp_per_s': megapixels / seconds,
+    }
+
+
+# 冷启动计时：每项在新的解释器中执行 repeat 次取最快的一次，先执行一次使字节码缓存生效
+# 执行失败的项（如未安装 PyQt5 时的 gui）记为 None
+def time_startup(repeat):
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, code in STARTUP_TARGETS.items():
+        command = [sys.executable, '-c', code]
+        if subprocess.run(command, cwd=folder, capture_output=True).returncode != 0:
+            results[name] = None
+            continue
+        best = None
+        for _ in range(repeat):
+            t = time.perf_counter()
+            subprocess.run(command, cwd=folder, capture_output=True)
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {'seconds': best}
+    base = results['python']['seconds']
+    for name, value in results.items():
+        if value and name != 'python':
+            value['import_seconds'] = max(value['seconds'] - base, 0)
+    return results
+
+
+# 本进程及子进程的峰值内存（MB），不支持的平台返回 None
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 下单位为 KB，macOS 下为字节
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20,
+    }
+
+
+# 与之前的结果比较，返回吞吐量下降超过阈值的项
+def compare(results, baseline, threshold):
+
+    regressions = []
+    pairs = [(f'stages.{key}', value, baseline.get('summary', {}).get(key)) for key, value in results['summary'].items()]
+    pairs += [(f'backends.{key}', value, baseline.get('backends', {}).get(key)) for key, value in results['backends'].items()]
+    old_batches = {(batch['mode'], batch['workers']): batch for batch in baseline.get('batch', [])}
+    pairs += [(f'batch.{batch["mode"]}.{batch["workers"]}', batch, old_batches.get((batch['mode'], batch['workers'])))
+              for batch in results['batch']]
+    for key, new, old in pairs:
+        if not old or not old.get('mp_per_s') or not new.get('mp_per_s'):
+            continue
+        change = new['mp_per_s'] / old['mp_per_s'] - 1
+        if change < -threshold:
+            regressions.append({'key': key, 'old_mp_per_s': old['mp_per_s'], 'new_mp_per_s': new['mp_per_s'], 'change': change})
+
+    # 导入耗时越短越好，增加超过阈值即为退化
+    for key, new in results['startup'].items():
+        old = baseline.get('startup', {}).get(key)
+        if not new or 'import_seconds' not in new or not old or not old.get('import_seconds'):
+            continue
+        change = new['import_seconds'] / old['import_seconds'] - 1
+        if change > threshold and new['import_seconds'] - old['import_seconds'] > STARTUP_NOISE:
+            regressions.append({'key': f'startup.{key}', 'old_import_seconds': old['import_seconds'],
+                                'new_import_seconds': new['import_seconds'], 'change': change})
+    return regressions
+
+
+# 生成图片集并进行分阶段、扫描后端及端到端批量处理计时，返回 (records, backend_timings, batches)
+def time_corpus(args, sizes):
+
+    work_path = tempfile.mkdtemp(prefix='cropper_bench_')
+    try:
+        corpus_path = args.corpus or work_path + '/corpus'
+        t = time.perf_counter()
+        corpus = generate_corpus(corpus_path, sizes, args.count, args.seed)
+        print(f'- Corpus of {len(corpus)} images ready in {time.perf_counter() - t:.1f} seconds', file=sys.stderr)
+
+        output_path = work_path + '/output'
+        os.makedirs(output_path)
+        records = []
+        for item in corpus:
+            for mode in ('alpha', 'white'):
+                timings = time_stages(item['path'], mode == 'alpha', output_path, args.repeat)
+                record = {key: value for key, value in item.items() if key != 'path'}
+                record.update(timings, mode=mode)
+                records.append(record)
+
+        backends = [backend for backend in args.backends.split(',') if backend]
+        if 'numba' in backends and not img_cropper.numba_available():
+            print('- Skipping the numba backend, numba is not installed', file=sys.stderr)
+            backends.remove('numba')
+        backend_timings = time_backends(corpus, backends, args.repeat)
+        for key, value in backend_timings.items():
+            print(f'- Backend {key}: {value["mp_per_s"]:.1f} MP/s', file=sys.stderr)
+
+        batches = []
+        for workers in [int(value) for value in args.workers.split(',') if value]:
+            for is_alpha in (True, False):
+                batches.append(time_batch(corpus, is_alpha, workers, work_path + '/batch_output'))
+                print(f'- Batch {batches[-1]["mode"]} with {workers} workers: {batches[-1]["images_per_s"]:.1f} images/s', file=sys.stderr)
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return records, backend_timings, batches
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    sizes = [size for size in args.sizes.split(',') if size]
+    unknown = [size for size in sizes if size not in CORPUS_SIZES]
+    if unknown:
+        print(f'Unknown sizes {unknown}', file=sys.stderr)
+        return 2
+
+    startup = time_startup(args.startup_repeat)
+    for key, value in startup.items():
+        if value is None:
+            print(f'- Startup {key}: skipped, the import failed', file=sys.stderr)
+        elif key != 'python':
+            print(f'- Startup {key}: {value["import_seconds"] * 1000:.0f} ms', file=sys.stderr)
+    if args.startup_only:
+        records, backend_timings, batches = [], {}, []
+    else:
+        records, backend_timings, batches = time_corpus(args, sizes)
+
+    results = {
+        'env': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'args': {'sizes': sizes, 'count': args.count, 'repeat': args.repeat, 'seed': args.seed},
+        'records': records,
+        'summary': summarize(records),
+        'backends': backend_timings,
+        'batch': batches,
+        'startup': startup,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        # 图片集不同时吞吐量不具可比性
+        if baseline.get('args') != results['args']:
+            print(f'- Warning: corpus settings differ from [{args.compare}]', file=sys.stderr)
+        results['regressions'] = compare(results, baseline, args.threshold)
+        for regression in results['regressions']:
+            print(f'- Regression in {regression["key"]}: {regression["change"]:.1%}', file=sys.stderr)
+        status = 1 if results['regressions'] else 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    for key, value in results['summary'].items():
+        if key.endswith('.total'):
+            print(f'- {key}: {value["images_per_s"]:.1f} images/s, {value["mp_per_s"]:.1f} MP/s', file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import sys
+import time
+import img_cropper
+import archive
+
+
+# 解析命令行参数
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Crop transparent or white edges of batch images without the GUI.')
+    parser.add_argument('input', help='folder containing the images to process, or a ZIP/TAR archive of images')
+    parser.add_argument('-o', '--output', default='', help="output folder, defaults to an 'output' folder inside the input folder; "
+                                                           "for an archive input, an archive or folder defaulting to <name>_cropped.<ext>")
+    parser.add_argument('-r', '--recursive', action='store_true', help='also process images in subfolders')
+    parser.add_argument('--mirror', action='store_true', help='with --recursive, recreate the subfolders in the output folder instead of prefixing names with them')
+    parser.add_argument('--include', action='append', default=None, metavar='PATTERN', help='only process paths (relative to the input folder) matching this glob, can be repeated')
+    parser.add_argument('--exclude', action='append', default=None, metavar='PATTERN', help='skip paths (relative to the input folder) matching this glob, can be repeated')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='maximum number of images submitted at once, defaults to twice the workers')
+    parser.add_argument('-p', '--pipeline', action='store_true', help='overlap reading, cropping and writing in separate stages')
+    parser.add_argument('--readers', type=int, default=2, help='with --pipeline, number of reader threads')
+    parser.add_argument('--writers', type=int, default=2, help='with --pipeline, number of writer threads')
+    parser.add_argument('--read-ahead', type=int, default=8, help='with --pipeline, maximum number of images read ahead of cropping')
+    parser.add_argument('--write-behind', type=int, default=8, help='with --pipeline, maximum number of images being written at once')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB', help='maximum estimated memory of the images being processed at once')
+    parser.add_argument('--strip-above', type=float, default=None, metavar='MB',
+                        help='process PNGs whose estimated memory is at least this many MB strip by strip, defaults to --memory-budget')
+    parser.add_argument('--strip-rows', type=int, default=img_cropper.STRIP_ROWS, help='rows decoded at once in strip processing')
+    parser.add_argument('--ordered', action='store_true', help='report results in input order instead of completion order')
+    add_crop_arguments(parser)
+    parser.add_argument('--scan-backend', choices=img_cropper.SCAN_BACKENDS, default='auto', help='how the bounding box is found; numba falls back to mask when numba is not installed')
+    parser.add_argument('--fsync', choices=img_cropper.DURABILITY_MODES, default='none',
+                        help='make outputs durable: file syncs each output as it is written, batch syncs outputs in groups and at the end')
+    parser.add_argument('-i', '--incremental', action='store_true', help='skip images unchanged since the last run, using a manifest in the output folder')
+    parser.add_argument('--hash', action='store_true', help='with --incremental, compare file contents when the modification time changed')
+    parser.add_argument('--cache', default='', metavar='DIR', help='content-hash cache shared across runs; images identical to a cached one are copied instead of processed')
+    parser.add_argument('--cache-size', type=float, default=1024, metavar='MB', help='with --cache, maximum size of the cached outputs')
+    parser.add_argument('--cache-bbox-only', action='store_true', help='with --cache, only cache bounding boxes, not the encoded outputs')
+    parser.add_argument('--hardlink', action='store_true', help='with --cache, hard link outputs to the cache instead of copying them')
+    parser.add_argument('--metrics', default='', metavar='FILE', help='write per-image stage timings and a final snapshot as JSON lines')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print one line per image to stderr')
+    return parser.parse_args(argv)
+
+
+# 影响裁剪结果的参数，命令行工具与 shard.py init 共用
+def add_crop_arguments(parser):
+
+    parser.add_argument('-m', '--mode', choices=['alpha', 'white'], default='alpha', help='crop transparent (alpha) or white edges')
+    parser.add_argument('--alpha-threshold', type=int, default=0, help='in alpha mode, pixels with alpha <= this value are treated as border')
+    color_group = parser.add_mutually_exclusive_group()
+    color_group.add_argument('--white-threshold', type=int, default=None, help='in white mode, pixels with every channel >= this value are treated as border')
+    color_group.add_argument('--tolerance', type=int, default=0, help='in white mode, maximum per-channel difference from the background colour')
+    parser.add_argument('--background', type=parse_color, default=(255, 255, 255), metavar='R,G,B|#RRGGBB', help='in white mode, border colour to crop instead of white')
+    parser.add_argument('-f', '--format', choices=img_cropper.OUTPUT_FORMATS, default='png',
+                        help='png: re-encode as PNG; keep: keep JPEG inputs as JPEG; sidecar: write a bbox JSON per image; index: only write bbox_index.csv')
+    parser.add_argument('--frames', choices=img_cropper.FRAME_MODES, default='union',
+                        help='for animated PNG/GIF and multi-page TIFF: union crops every frame to one shared box, independent crops each frame to its own box and writes one PNG per frame')
+    parser.add_argument('--png-compression', type=int, choices=range(10), default=None, metavar='0-9', help='PNG compression level')
+    parser.add_argument('--png-strategy', choices=list(img_cropper.PNG_STRATEGIES), default=None, help='PNG compression strategy')
+    parser.add_argument('--jpeg-quality', type=int, default=95, help='JPEG quality for --format keep')
+    parser.add_argument('--derive', action='append', type=parse_derived, default=[], metavar='SUFFIX[:OPTIONS]',
+                        help='also write a derived image named <name><SUFFIX>.<format> from each output image (the original image when nothing '
+                             'is cropped, the first frame of animations), can be repeated; '
+                             'OPTIONS is a comma separated list of max=PIXELS, square, format=png|jpg|webp and quality=0-100, '
+                             'e.g. _thumb:max=256,square,format=jpg,quality=85')
+
+
+# 由命令行参数得到裁剪模式、输出选项与容差
+def crop_settings(args):
+    output_options = img_cropper.OutputOptions(args.format, args.png_compression, args.png_strategy, args.jpeg_quality, args.frames,
+                                               tuple(args.derive))
+    color_tolerance = 255 - args.white_threshold if args.white_threshold is not None else args.tolerance
+    tolerance = img_cropper.Tolerance(args.alpha_threshold, args.background, color_tolerance)
+    return args.mode == 'alpha', output_options, tolerance
+
+
+# 解析 R,G,B 或 #RRGGBB 格式的颜色，返回 OpenCV 使用的 (B, G, R)
+def parse_color(text):
+    try:
+        if text.startswith('#') and len(text) == 7:
+            rgb = [int(text[i:i + 2], 16) for i in (1, 3, 5)]
+        else:
+            rgb = [int(value) for value in text.split(',')]
+    except ValueError:
+        rgb = []
+    if len(rgb) != 3 or not all(0 <= value <= 255 for value in rgb):
+        raise argparse.ArgumentTypeError(f'invalid colour [{text}]')
+    return tuple(reversed(rgb))
+
+
+# 解析派生输出的说明，如 _thumb:max=256,square,format=jpg,quality=85
+def parse_derived(text):
+    suffix, _, options = text.partition(':')
+    if not suffix:
+        raise argparse.ArgumentTypeError(f'derived output [{text}] needs a file name suffix')
+    derived = img_cropper.DerivedOutput(suffix)
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        try:
+            if key == 'max':
+                derived = derived._replace(max_size=int(value))
+            elif key == 'square' and not value:
+                derived = derived._replace(square=True)
+            elif key == 'format' and value in img_cropper.DERIVED_FORMATS:
+                derived = derived._replace(format=value)
+            elif key == 'quality' and 0 <= int(value) <= 100:
+                derived = derived._replace(quality=int(value))
+            else:
+                raise ValueError
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid option [{option}] in derived output [{text}]')
+    return derived
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    t1 = time.time()
+
+    try:
+        img_cropper.set_scan_backend(args.scan_backend)
+        img_cropper.set_durability(args.fsync)
+        # 超过内存预算的单张大图逐条带处理
+        strip_above = args.strip_above if args.strip_above is not None else args.memory_budget
+        if strip_above:
+            img_cropper.set_strip_mode(strip_above * 2 ** 20, args.strip_rows)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    is_archive = os.path.isfile(args.input) and archive.is_archive(args.input)
+    if not is_archive and not os.path.isdir(args.input):
+        print(f'Input folder [{args.input}] does not exist', file=sys.stderr)
+        return 2
+    if is_archive and args.format not in ('png', 'keep'):
+        print('Archive input only supports --format png or keep', file=sys.stderr)
+        return 2
+
+    is_alpha, output_options, tolerance = crop_settings(args)
+    pipeline = img_cropper.PipelineOptions(args.readers, args.writers, args.read_ahead, args.write_behind) if args.pipeline else None
+    memory_budget = int(args.memory_budget * 2 ** 20) if args.memory_budget else None
+    dedup = img_cropper.DedupOptions(args.cache, int(args.cache_size * 2 ** 20), not args.cache_bbox_only, args.hardlink) if args.cache else None
+    # 与图形界面一致，未指定输出文件夹时在输入文件夹下创建 output 文件夹
+    if is_archive:
+        # 归档中的图片逐个读出处理，结果写入输出归档或文件夹，未裁剪的图片原样写出
+        outpath = args.output or archive.default_output(args.input)
+        metrics = img_cropper.BatchMetrics()
+        results = archive.process_archive(args.input, outpath, is_alpha, args.workers, args.max_in_flight, output_options,
+                                          tolerance, args.include, args.exclude)
+        results = (result for _, result in results)
+    else:
+        # 子文件夹中图片的输出名带上相对路径，不同子文件夹中的同名图片不会互相覆盖
+        img_cropper.set_output_layout(args.input, args.mirror)
+        job = img_cropper.CropJob(args.input, args.output, is_alpha, output_options, tolerance, args.workers, args.max_in_flight,
+                                  args.ordered, pipeline, memory_budget, args.incremental, args.hash, dedup)
+        runner = img_cropper.BatchRunner(job)
+        metrics = runner.metrics
+        outpath = runner.output_path
+        os.makedirs(outpath, exist_ok=True)
+        # 边扫描边处理，无需等待整个文件夹列举完毕
+        results = runner.run(img_cropper.scan_images(args.input, args.recursive, args.include, args.exclude, [outpath]))
+    total = 0
+    counts = {status: 0 for status in (img_cropper.STATUS_CROPPED, img_cropper.STATUS_NOT_CROPPED,
+                                       img_cropper.STATUS_NOT_FOUND, img_cropper.STATUS_ERROR)}
+    counts['unchanged'] = 0
+    errors = []
+    metrics_log = img_cropper.MetricsLog(args.metrics) if args.metrics else None
+
+    for result in results:
+        if is_archive:
+            metrics.add(result)
+        total += 1
+        status = 'unchanged' if result.cached else result.status
+        counts[status] += 1
+        if metrics_log:
+            metrics_log.write_result(result)
+        if result.status == img_cropper.STATUS_ERROR:
+            errors.append({'path': result.path, 'error': result.error})
+        if args.verbose:
+            print(f'- [{result.name}] {status} {list(result.ini_size)} -> {list(result.cropped_size)}', file=sys.stderr)
+
+    snapshot = metrics.snapshot()
+    if metrics_log:
+        metrics_log.write_snapshot(snapshot)
+        metrics_log.close()
+
+    # 以 JSON 格式输出汇总信息，便于其他程序读取
+    summary = {
+        'input': args.input,
+        'output': outpath,
+        'mode': args.mode,
+        'format': args.format,
+        'workers': args.workers,
+        'total': total,
+        'counts': counts,
+        'errors': errors,
+        'seconds': round(time.time() - t1, 3),
+        'metrics': {key: snapshot[key] for key in ('megapixels', 'bytes_in', 'bytes_out', 'stage_seconds', 'busiest_stage', 'deduplicated')},
+    }
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
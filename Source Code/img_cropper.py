@@ -1,146 +1,2171 @@
-import numpy as np
-from cv2 import imdecode, imencode, cvtColor, IMREAD_UNCHANGED, COLOR_BGR2BGRA
-from os import path, listdir
+from os import path, scandir, listdir, stat, fstat, fsync, replace, makedirs, remove, link, environ, getpid, O_RDONLY
+from os import open as os_open, close as os_close
+from functools import lru_cache
+from itertools import islice
+from importlib import import_module
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import namedtuple, deque, OrderedDict
+from threading import Condition
+from time import perf_counter, time
+from hashlib import blake2b
+import json
+import warnings
+import csv
+import mmap
+
+
+# 首次访问属性时才导入的模块，导入后属性缓存在对象上，之后的访问与直接导入相同
+class LazyModule:
+
+    def __init__(self, name):
+        self.module_name = name
+
+
+    def __getattr__(self, attr):
+        value = getattr(import_module(self.module_name), attr)
+        setattr(self, attr, value)
+        return value
+
+
+# NumPy 与 OpenCV 合计导入约 0.2 秒，占本模块导入时间的绝大部分，推迟到处理第一张图片时
+# 只列举或筛选文件（如 file_read、scan_images）的工具及多进程时的主进程可能完全不需要导入
+np = LazyModule('numpy')
+cv2 = LazyModule('cv2')
+
+
+# 立即导入按需导入的模块，如在图形界面空闲时预先导入，使第一次处理不必等待
+def preload():
+    for module in (np, cv2):
+        import_module(module.module_name)
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+
+# 支持的图片后缀，不区分大小写
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff')
+# 可能含有多帧的图片后缀，PNG 另由 acTL 块判断是否为动画
+MULTI_FRAME_EXTENSIONS = ('.gif', '.tif', '.tiff')
+
+# 单张图片的处理结果
+STATUS_CROPPED = 'cropped'
+STATUS_NOT_CROPPED = 'not_cropped'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_ERROR = 'error'
+
+
+# 文件内容无法解码为图片（损坏或不支持的格式）
+class DecodeError(ValueError):
+    pass
+
+# 像素数不少于 COARSE_MIN_PIXELS 的图片先按 COARSE_FACTOR 降采样求近似边界框
+COARSE_MIN_PIXELS = 16000000
+COARSE_FACTOR = 8
+
+# 边界框扫描后端：mask 计算整图（大图由粗到细）的内容掩码，edges 从四条边缘分块向内扫描、遇到内容即停止，
+# numba 为编译后的逐像素向内扫描（未安装 numba 时改用 mask），auto 为默认后端，目前为 mask
+# 在 benchmark.py --backends 的测量结果表明其他后端更快之前，auto 不切换到它们
+# 通过环境变量 CROPPER_SCAN_BACKEND 传给工作进程
+SCAN_BACKENDS = ('auto', 'mask', 'edges', 'numba')
+scan_backend = environ.get('CROPPER_SCAN_BACKEND', 'auto')
+numba_fallback_warned = False
+# edges 后端首次扫描的行（列）数，之后每次翻倍
+EDGE_BLOCK = 16
+
+# 不小于 MMAP_MIN_BYTES 的文件以内存映射方式读取
+MMAP_MIN_BYTES = 1 << 20
+
+# 多帧图片（APNG、GIF、多页 TIFF）的裁剪方式：
+# union 所有帧共用一个包含各帧内容的边界框，输出与输入格式相同的动画或多页文件，各帧仍然对齐；
+# independent 每帧按各自的边界框裁剪，分别输出为 <名称>_<帧序号>.png
+FRAME_MODES = ('union', 'independent')
+# 每批解码的帧数按帧的大小确定，一批帧的总大小不超过 FRAME_CHUNK_BYTES
+FRAME_CHUNK_BYTES = 256 * 2 ** 20
+
+# 输出文件均先写入临时文件再改名，中途终止不会留下不完整的输出
+# 持久化方式：none 不调用 fsync，file 每个文件写完即 fsync，batch 由主进程每写出 FSYNC_BATCH 个文件及结束时统一 fsync，见 OutputSync
+DURABILITY_MODES = ('none', 'batch', 'file')
+durability = environ.get('CROPPER_FSYNC', 'none')
+FSYNC_BATCH = 256
+# 设置了输入文件夹时，其子文件夹中图片的输出名带上相对路径：output_mirror 为 True 时在输出文件夹中重建相同的子文件夹，否则以 _ 连接
+input_root = environ.get('CROPPER_INPUT_ROOT', '')
+output_mirror = environ.get('CROPPER_MIRROR', '') == '1'
+
+# 估计内存不小于 strip_min_bytes 的 PNG 逐条带处理，每个条带 strip_rows 行，见 process_strips；strip_min_bytes 为 0 时不启用
+# 通过环境变量 CROPPER_STRIP_MIN_BYTES 与 CROPPER_STRIP_ROWS 传给工作进程
+STRIP_ROWS = 256
+strip_min_bytes = int(environ.get('CROPPER_STRIP_MIN_BYTES', 0))
+strip_rows = int(environ.get('CROPPER_STRIP_ROWS', STRIP_ROWS))
+
+# 判定边缘像素的容差，数值均按 8 位计
+# alpha：透明模式下 α 不超过该值的像素视为透明边缘
+# background / color：白色模式下与背景色 (B, G, R) 各通道相差不超过 color、且 α 不低于 255 - color 的像素视为边缘，
+# 即各通道 >= 255 - color 视为白色
+Tolerance = namedtuple('Tolerance', ['alpha', 'background', 'color'], defaults=[0, (255, 255, 255), 0])
+
+# 输出方式：png 重新编码为 PNG，keep 保持输入格式（JPEG 仍输出 JPEG），
+# sidecar 不输出图片而是为每张图写一个记录边界框的 JSON 文件，index 只把边界框汇总到一个索引文件中
+OUTPUT_FORMATS = ('png', 'keep', 'sidecar', 'index')
+# PNG 压缩策略，对应 OpenCV 的 IMWRITE_PNG_STRATEGY 取值
+PNG_STRATEGIES = {'default': 0, 'filtered': 1, 'huffman': 2, 'rle': 3, 'fixed': 4}
+
+# png_compression 为 0-9，None 时使用 OpenCV 默认值；frames 为多帧图片的裁剪方式，见 FRAME_MODES
+# derived 为由输出的图片派生的附加输出（DerivedOutput），仅在输出图片（png、keep）时生成，
+# 未裁剪的图片由原图生成，多帧图片由输出的第一帧生成
+OutputOptions = namedtuple('OutputOptions', ['format', 'png_compression', 'png_strategy', 'jpeg_quality', 'frames', 'derived'],
+                           defaults=['png', None, None, 95, 'union', ()])
+
+# 派生输出：suffix 加在输出文件名（不含后缀）之后，max_size 为最长边的上限（只缩小不放大，None 为不缩放），
+# square 为是否补边成正方形（透明图补透明像素，否则补白色），format 为 png、jpg 或 webp，quality 为 JPEG / WebP 的质量
+# 派生输出与主输出由同一个已解码、已裁剪的数组并行编码，无需重新读取输出文件
+DerivedOutput = namedtuple('DerivedOutput', ['suffix', 'max_size', 'square', 'format', 'quality'], defaults=[None, False, 'png', 90])
+DERIVED_FORMATS = ('png', 'jpg', 'webp')
+# 每个进程中并行编码派生输出的线程数，线程池及创建它的进程号见 encode_pool
+ENCODE_THREADS = 4
+# 去重时在后台计算文件哈希值的线程数
+HASH_THREADS = 4
+encode_executor = None
+encode_executor_pid = None
+
+# 流水线处理的参数：readers / writers 为读取和写出线程数，
+# read_ahead 为预读（含已读入待计算）的图片数上限，write_behind 为同时写出的图片数上限
+PipelineOptions = namedtuple('PipelineOptions', ['readers', 'writers', 'read_ahead', 'write_behind'], defaults=[2, 2, 8, 8])
+
+# metrics 记录各阶段耗时（秒）及像素数、读入与写出的字节数
+# cached 为上次运行后未改动而跳过，deduplicated 为内容与已处理的图片相同，结果取自去重缓存
+# frames 为多帧图片各帧的边界框，此时 bbox 为包含各帧内容的边界框，单帧图片为 None
+# derived 为派生输出的文件路径列表，没有派生输出时为 None
+CropResult = namedtuple('CropResult', ['path', 'name', 'status', 'ini_size', 'cropped_size', 'error', 'bbox', 'output', 'cached', 'metrics',
+                                       'deduplicated', 'frames', 'derived'],
+                        defaults=[[], [], '', None, None, False, None, False, None, None])
+
+# 去重缓存的参数：path 为缓存文件夹（可供多次运行共用），max_bytes 为缓存输出文件的总大小上限，
+# store_outputs 为是否缓存编码后的输出（否则只缓存边界框），hardlink 为是否以硬链接代替复制
+DedupOptions = namedtuple('DedupOptions', ['path', 'max_bytes', 'store_outputs', 'hardlink'], defaults=['', 1 << 30, True, False])
+
+# 单张图片处理的各个阶段
+METRIC_STAGES = ('precheck', 'read', 'decode', 'bbox', 'encode', 'write')
+
+# crop_bytes 的结果：data 为编码后的内容（memoryview，未裁剪时即输入本身），ext 为对应的后缀
+CroppedBuffer = namedtuple('CroppedBuffer', ['data', 'ext', 'bbox', 'ini_size', 'cropped_size'])
 
 
 def crop_by_alpha(img_path):
-    
-    # 检查文件是否存在
-    img = file_exist(img_path)
-    # 不存在则跳过
-    if len(img) == 0:
-        return np.zeros((0, 0, 3), dtype=np.uint8), [], []
-    # 若文件无透明通道，则添加一个全部都为不透明的透明通道
-    if img.shape[2] == 3:
-        img = cvtColor(img, COLOR_BGR2BGRA)
-        alpha_channel = 255 * np.ones_like(img[:, :, 0], dtype=np.uint8)
-        img[:, :, 3] = alpha_channel
-
-    ini_size = img.shape
-    bottom = 0
-    top = row = ini_size[0]
-    left = 0
-    right = col = ini_size[1]
-
-    for i in np.arange(0, row, 1):
-        if img[i, :, 3].sum() != 0:
-            bottom = max(bottom, i)
-            break
-    for i in np.arange(row - 1, -1, -1):
-        if img[i, :, 3].sum() != 0:
-            top = min(top, i)
-            break
-    for j in np.arange(0, col, 1):
-        if img[:, j, 3].sum() != 0:
-            left = max(left, j)
-            break
-    for j in np.arange(col - 1, -1, -1):
-        if img[:, j, 3].sum() != 0:
-            right = min(right, j)
-            break
-
-    cropped_img = img[bottom:top+1, left:right+1]
-    return cropped_img, ini_size, cropped_img.shape
+    cropped_img, ini_size, cropped_size, _ = crop_image(img_path, True)
+    return cropped_img, ini_size, cropped_size
 
 
 def crop_by_white(img_path):
-    
+    cropped_img, ini_size, cropped_size, _ = crop_image(img_path, False)
+    return cropped_img, ini_size, cropped_size
+
+
+# 裁剪图片，返回裁剪后的图片、原尺寸、裁剪后尺寸及边界框 (top, bottom, left, right)
+# 给出 metrics 字典时记录读取、解码、计算边界框的耗时
+def crop_image(img_path, is_alpha, tolerance=None, metrics=None):
+
+    metrics = {} if metrics is None else metrics
+
     # 检查文件是否存在
-    img = file_exist(img_path)
+    t = perf_counter()
+    img_data = file_bytes(img_path)
+    metrics['read'] = perf_counter() - t
     # 不存在则跳过
-    if len(img) == 0:
-        return np.zeros((0, 0, 3), dtype=np.uint8), [], []
-    # 若文件无透明通道，则添加一个全部都为不透明的透明通道
-    if img.shape[2] == 3:
-        img = cvtColor(img, COLOR_BGR2BGRA)
-        alpha_channel = 255 * np.ones_like(img[:, :, 0], dtype=np.uint8)
-        img[:, :, 3] = alpha_channel
-    # 将完全透明的像素的 rgb 改为黑色，防止在白色模式下透明边界被裁剪
-    img[np.where(img[:, :, 3] == 0)] = [0, 0, 0, 0]
-
-    ini_size = img.shape
-    bottom = 0
-    top = row = ini_size[0]
-    left = 0
-    right = col = ini_size[1]
-
-    # for channel in range(img.shape[2]):
-    #     for i in np.arange(0, row, 1):
-    #         if img[i, :, channel].sum() != img.shape[1] * 255:
-    #             bottom = max(bottom, i)
-    #             break
-    #     for i in np.arange(row - 1, -1, -1):
-    #         if img[i, :, channel].sum() != img.shape[1] * 255:
-    #             top = min(top, i)
-    #             break
-    #     for j in np.arange(0, col, 1):
-    #         if img[:, j, channel].sum() != img.shape[0] * 255:
-    #             left = max(left, j)
-    #             break
-    #     for j in np.arange(col - 1, -1, -1):
-    #         if img[:, j, channel].sum() != img.shape[0] * 255:
-    #             right = min(right, j)
-    #             break
-
-    for i in np.arange(0, row, 1):
-        if img[i, :, 0].sum() != img.shape[1] * 255 or \
-        img[i, :, 1].sum() != img.shape[1] * 255 or \
-        img[i, :, 2].sum() != img.shape[1] * 255 or \
-        img[i, :, 3].sum() != img.shape[1] * 255:
-            bottom = max(bottom, i)
-            break
-
-    for i in np.arange(row - 1, -1, -1):
-        if img[i, :, 0].sum() != img.shape[1] * 255 or \
-        img[i, :, 1].sum() != img.shape[1] * 255 or \
-        img[i, :, 2].sum() != img.shape[1] * 255 or \
-        img[i, :, 3].sum() != img.shape[1] * 255:
-            top = min(top, i)
-            break
-
-    for j in np.arange(0, col, 1):
-        if img[:, j, 0].sum() != img.shape[0] * 255 or \
-        img[:, j, 1].sum() != img.shape[0] * 255 or \
-        img[:, j, 2].sum() != img.shape[0] * 255 or \
-        img[:, j, 3].sum() != img.shape[0] * 255:
-            left = max(left, j)
-            break
-
-    for j in np.arange(col - 1, -1, -1):
-        if img[:, j, 0].sum() != img.shape[0] * 255 or \
-        img[:, j, 1].sum() != img.shape[0] * 255 or \
-        img[:, j, 2].sum() != img.shape[0] * 255 or \
-        img[:, j, 3].sum() != img.shape[0] * 255:
-            right = min(right, j)
-            break
-    
+    if img_data is None:
+        return np.zeros((0, 0, 3), dtype=np.uint8), [], [], None
+    return crop_data(img_data, is_alpha, tolerance, metrics)
+
+
+# 从已读入的文件内容解码并裁剪，返回值同 crop_image
+def crop_data(img_data, is_alpha, tolerance=None, metrics=None):
+
+    metrics = {} if metrics is None else metrics
+    metrics['bytes_in'] = img_data.size
+    # imdecode 对空内容抛出 cv2.error 而不是返回 None
+    if img_data.size == 0:
+        raise DecodeError('empty file')
+
+    t = perf_counter()
+    img = cv2.imdecode(img_data, cv2.IMREAD_UNCHANGED)
+    metrics['decode'] = perf_counter() - t
+    if img is None:
+        raise DecodeError('cannot decode image')
+    metrics['pixels'] = img.shape[0] * img.shape[1]
+
+    t = perf_counter()
+    top, bottom, left, right = bbox = find_crop_bbox(img, is_alpha, tolerance)
+    metrics['bbox'] = perf_counter() - t
+    cropped_img = img[top:bottom, left:right]
+    return cropped_img, img.shape, cropped_img.shape, bbox
+
+
+# 裁剪内存中的图片，不读写文件，返回值同 crop_image，裁剪后的图片为原数组的视图
+# source 可以是文件内容（bytes、bytearray、memoryview 或一维 uint8 数组），也可以是已解码的图片数组
+def crop_buffer(source, is_alpha, tolerance=None, metrics=None):
+
+    if isinstance(source, np.ndarray) and source.ndim > 1:
+        top, bottom, left, right = bbox = find_crop_bbox(source, is_alpha, tolerance)
+        cropped_img = source[top:bottom, left:right]
+        return cropped_img, source.shape, cropped_img.shape, bbox
+    # frombuffer 直接引用输入的内存，不复制
+    return crop_data(np.frombuffer(source, dtype=np.uint8), is_alpha, tolerance, metrics)
+
+
+# 裁剪内存中的图片并编码，返回 CroppedBuffer
+# 输入为 PNG（或 keep 格式下的 JPEG）文件内容且无需裁剪时直接返回输入本身，不重新编码，其他格式（如 TIFF）总是重新编码
+# output_options 的 keep 格式下 JPEG 输入仍输出 JPEG
+def crop_bytes(source, is_alpha, output_options=None, tolerance=None, metrics=None):
+
+    output_options = output_options or OutputOptions()
+    cropped_img, ini_size, cropped_size, bbox = crop_buffer(source, is_alpha, tolerance, metrics)
+    is_encoded = not (isinstance(source, np.ndarray) and source.ndim > 1)
+    head = bytes(memoryview(source)[:len(PNG_SIGNATURE)]) if is_encoded else b''
+    is_jpeg = head.startswith(JPEG_SIGNATURE)
+    ext = '.jpg' if is_jpeg and output_options.format == 'keep' else '.png'
+
+    if cropped_size == ini_size and (ext == '.jpg' or head == PNG_SIGNATURE):
+        return CroppedBuffer(memoryview(source), ext, bbox, ini_size, cropped_size)
+    data = encode_image(cropped_img, ext, output_options, metrics)
+    return CroppedBuffer(memoryview(data), ext, bbox, ini_size, cropped_size)
+
+
+# 计算解码后图片的裁剪边界框，不修改图片本身
+def find_crop_bbox(img, is_alpha, tolerance=None):
+
+    tolerance = tolerance or Tolerance()
+    full_bbox = (0, img.shape[0], 0, img.shape[1])
+    # 灰度图解码为二维数组，补上通道维，与彩色图一样按最后一维区分通道
+    if img.ndim == 2:
+        img = img[..., np.newaxis]
+
+    # 透明模式下，若文件无透明通道，则整张图完全不透明，无需裁剪
+    if is_alpha and img.shape[2] != 4:
+        return full_bbox
+
+    backend = resolve_scan_backend()
+    if backend == 'numba':
+        import numba_scan
+        return numba_scan.find_bbox(img, *content_range(img, is_alpha, tolerance))
+
+    def is_content(pixels):
+        return content_mask(pixels, is_alpha, tolerance)
+
+    # 四条边缘均含有内容时无需扫描整张图
+    if edges_have_content(img, is_content):
+        return full_bbox
+    if backend == 'edges':
+        return find_bbox_from_edges(img, is_content, EDGE_BLOCK)
+    # 大图先在降采样视图上求近似边界框，再在全分辨率下只扫描边框区域
+    if img.shape[0] * img.shape[1] >= COARSE_MIN_PIXELS:
+        return find_bbox_coarse_to_fine(img, is_content, COARSE_FACTOR)
+    return find_bbox(is_content(img))
+
+
+# 选择扫描后端，numba 未安装时由 resolve_scan_backend 改用 mask
+def set_scan_backend(name):
+    global scan_backend
+    if name not in SCAN_BACKENDS:
+        raise ValueError(f'unknown scan backend {name}, expected one of {SCAN_BACKENDS}')
+    scan_backend = name
+    resolve_scan_backend()
+    environ['CROPPER_SCAN_BACKEND'] = name
+
+
+# 设置逐条带处理的阈值（字节）与条带行数
+def set_strip_mode(min_bytes, rows=STRIP_ROWS):
+    global strip_min_bytes, strip_rows
+    if rows < 1:
+        raise ValueError('strip rows must be at least 1')
+    strip_min_bytes, strip_rows = int(min_bytes), int(rows)
+    environ['CROPPER_STRIP_MIN_BYTES'] = str(strip_min_bytes)
+    environ['CROPPER_STRIP_ROWS'] = str(strip_rows)
+
+
+def set_durability(mode):
+    global durability
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f'unknown durability {mode}, expected one of {DURABILITY_MODES}')
+    durability = mode
+    environ['CROPPER_FSYNC'] = mode
+
+
+# 设置输入文件夹及是否重建其子文件夹结构，见 get_temp_name
+def set_output_layout(root, mirror=False):
+    global input_root, output_mirror
+    input_root, output_mirror = root, mirror
+    environ['CROPPER_INPUT_ROOT'] = root
+    environ['CROPPER_MIRROR'] = '1' if mirror else ''
+
+
+# 环境变量与 set_scan_backend 都可能选中 numba，未安装时退回 NumPy 的 mask 后端，每个进程只提示一次
+def resolve_scan_backend():
+    global numba_fallback_warned
+    if scan_backend == 'auto':
+        return 'mask'
+    if scan_backend == 'numba' and not numba_available():
+        if not numba_fallback_warned:
+            numba_fallback_warned = True
+            warnings.warn('numba is not installed, using the mask scan backend instead', RuntimeWarning, stacklevel=2)
+        return 'mask'
+    return scan_backend
+
+
+# 首次调用时才导入 numba，未使用该后端时不增加启动时间，结果缓存以免逐张图重复检查
+@lru_cache(maxsize=None)
+def numba_available():
+    try:
+        import numba_scan
+    except ImportError:
+        return False
+    return numba_scan.available()
+
+
+# 各通道的内容判定范围 (lower, upper)，任一通道超出范围的像素即为内容，与 content_mask 的判定一致
+def content_range(img, is_alpha, tolerance):
+
+    max_value = int(np.iinfo(img.dtype).max)
+    scale = max_value / 255
+    channels = img.shape[2]
+    if is_alpha:
+        # α 大于阈值即为内容
+        return [0] * channels, [max_value] * 3 + [int(np.floor(tolerance.alpha * scale))]
+    color = [value * scale for value in tolerance.background] + [max_value]
+    lower = [int(np.ceil(max(value - tolerance.color * scale, 0))) for value in color[:channels]]
+    upper = [int(np.floor(min(value + tolerance.color * scale, max_value))) for value in color[:channels]]
+    return lower, upper
+
+
+# 计算内容掩码，pixels 的最后一维为通道（灰度图也须带有通道维），一次计算完成，不产生整图大小的中间结果
+# 透明模式：α 大于阈值的像素即为内容
+# 白色模式：与背景色（含 α = 255）任一通道相差超过容差的像素即为内容，因此完全透明的像素不会被当作白色边缘
+def content_mask(pixels, is_alpha, tolerance):
+
+    # 16 位图片的阈值按比例放大
+    max_value = np.iinfo(pixels.dtype).max
+    scale = max_value / 255
+
+    if is_alpha:
+        return pixels[..., 3] > tolerance.alpha * scale
+
+    # inRange 不接受空区域
+    if pixels.size == 0:
+        return np.zeros(pixels.shape[:-1], dtype=bool)
+    channels = pixels.shape[-1]
+    color = [value * scale for value in tolerance.background] + [max_value]
+    lower = tuple(max(value - tolerance.color * scale, 0) for value in color[:channels])
+    upper = tuple(min(value + tolerance.color * scale, max_value) for value in color[:channels])
+    # inRange 只接受图片形状，单独一行或一列（形状为 (长度, 通道)）时补上一维
+    if pixels.ndim == 2:
+        return cv2.inRange(np.ascontiguousarray(pixels)[np.newaxis], lower, upper)[0] == 0
+    return cv2.inRange(pixels, lower, upper) == 0
+
+
+# 仅检查首尾行列，若四条边缘都含有内容则说明边界框就是整张图
+def edges_have_content(img, is_content):
+    for line in (img[0], img[-1], img[:, 0], img[:, -1]):
+        if not is_content(line).any():
+            return False
+    return True
+
+
+# 只读取文件头判断图片是否可能被裁剪，无需完整解码
+def may_be_cropped(img_path, is_alpha):
+    try:
+        with open(img_path, 'rb') as f:
+            return header_may_be_cropped(f, is_alpha)
+    except OSError:
+        # 交给后续流程报告找不到图像
+        return True
+
+
+# 同 may_be_cropped，从文件开头已打开的文件对象（或 BytesIO）读取
+def header_may_be_cropped(f, is_alpha):
+    signature = f.read(8)
+    if signature == PNG_SIGNATURE:
+        # 白色模式需要看像素，透明模式只需知道是否带透明信息
+        return not is_alpha or png_has_alpha(f)
+    if signature[:3] == JPEG_SIGNATURE:
+        # JPEG 没有透明通道，透明模式下整张图都不透明
+        return not is_alpha
+    return True
+
+
+# 只读取文件头得到图片尺寸，返回 (高, 宽, 解码后的通道数, 每通道字节数)，无法识别时返回 None
+def image_header(img_path):
+    try:
+        with open(img_path, 'rb') as f:
+            signature = f.read(8)
+            if signature == PNG_SIGNATURE:
+                chunk = f.read(21)
+                if len(chunk) < 21 or chunk[4:8] != b'IHDR':
+                    return None
+                width = int.from_bytes(chunk[8:12], 'big')
+                height = int.from_bytes(chunk[12:16], 'big')
+                bit_depth, color_type = chunk[16], chunk[17]
+                # 调色板图可能带 tRNS 透明信息，按 4 通道估计
+                channels = {0: 1, 2: 3}.get(color_type, 4)
+                return height, width, channels, 2 if bit_depth == 16 else 1
+            if signature[:3] == JPEG_SIGNATURE:
+                return jpeg_header(f)
+    except OSError:
+        pass
+    return None
+
+
+# 逐个跳过 JPEG 的标记段，直到帧头（SOF）读出尺寸
+def jpeg_header(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        # 填充字节
+        if code == 0xFF:
+            f.seek(-1, 1)
+            continue
+        # 没有长度字段的标记
+        if code == 0x01 or 0xD0 <= code <= 0xD8:
+            continue
+        length = int.from_bytes(f.read(2), 'big')
+        # SOF0 - SOF15，不含 DHT、JPG 与 DAC
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            data = f.read(6)
+            if len(data) < 6:
+                return None
+            height = int.from_bytes(data[1:3], 'big')
+            width = int.from_bytes(data[3:5], 'big')
+            return height, width, 1 if data[5] == 1 else 3, 2 if data[0] > 8 else 1
+        if code == 0xDA or length < 2:
+            return None
+        f.seek(length - 2, 1)
+
+
+# 估计处理一张图片的峰值内存（字节）：解码后的图片、内容掩码、读入的文件内容及编码后的输出
+def estimate_memory(img_path):
+    try:
+        size = path.getsize(img_path)
+    except OSError:
+        return 0
+    header = image_header(img_path)
+    # 无法读取尺寸时粗略按压缩率估计
+    if header is None:
+        return size * 8
+    height, width, channels, depth = header
+    pixels = height * width
+    # 大图由粗到细扫描，掩码只有降采样后的大小
+    mask = 2 * pixels if pixels < COARSE_MIN_PIXELS else 2 * pixels // COARSE_FACTOR ** 2
+    return pixels * channels * depth + mask + 2 * size
+
+
+# 批量处理的内存预算：在途图片的估计内存之和不超过 limit（字节），但总允许至少一张图片在处理中
+class MemoryBudget:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.reserved = {}
+
+
+    def fits(self, size):
+        return not self.reserved or self.used + size <= self.limit
+
+
+    def acquire(self, index, size):
+        self.reserved[index] = size
+        self.used += size
+
+
+    def release(self, index):
+        self.used -= self.reserved.pop(index, 0)
+
+
+# 读取 PNG 的 IHDR 及 IDAT 之前的数据块，判断是否带有透明信息
+def png_has_alpha(f):
+    while True:
+        chunk_head = f.read(8)
+        if len(chunk_head) < 8:
+            return True
+        length = int.from_bytes(chunk_head[:4], 'big')
+        chunk_type = chunk_head[4:]
+        if chunk_type == b'IHDR':
+            # 颜色类型 4 为灰度 + α，6 为 RGBA
+            color_type = f.read(13)[9]
+            if color_type in (4, 6):
+                return True
+            f.seek(4, 1)
+            continue
+        # 调色板或灰度图可通过 tRNS 块带有透明信息
+        if chunk_type == b'tRNS':
+            return True
+        if chunk_type in (b'IDAT', b'IEND'):
+            return False
+        f.seek(length + 4, 1)
+
+
+# 计算内容掩码的边界框，返回 (top, bottom, left, right)，bottom 与 right 不包含在内
+def find_bbox(mask):
+
+    row, col = mask.shape
+    # 按行投影，找出首尾含有内容的行
+    rows = np.flatnonzero(mask.any(axis=1))
+    # 整张图都没有内容时不裁剪
+    if rows.size == 0:
+        return 0, row, 0, col
+    top, bottom = rows[0], rows[-1] + 1
+    # 只需在内容行范围内按列投影
+    cols = np.flatnonzero(mask[top:bottom].any(axis=0))
+    return int(top), int(bottom), int(cols[0]), int(cols[-1] + 1)
+
+
+# 由粗到细计算边界框，结果与逐像素扫描完全一致
+# 降采样视图中含有内容的首尾行列在原图中同样含有内容，因此真实边界框必然包含粗略边界框，
+# 只需在原图中扫描粗略边界框以外的区域即可确定精确边界，不必为整张图计算掩码
+def find_bbox_coarse_to_fine(img, is_content, factor):
+
+    row, col = img.shape[:2]
+    coarse_mask = is_content(img[::factor, ::factor])
+    # 内容过细未被采样到时退回整图扫描
+    if not coarse_mask.any():
+        return find_bbox(is_content(img))
+    coarse_top, coarse_bottom, coarse_left, coarse_right = find_bbox(coarse_mask)
+    inner_top = coarse_top * factor
+    inner_bottom = (coarse_bottom - 1) * factor + 1
+    inner_left = coarse_left * factor
+    inner_right = (coarse_right - 1) * factor + 1
+
+    # 上下边框区域逐行扫描整行
+    rows = np.flatnonzero(is_content(img[:inner_top]).any(axis=1))
+    top = int(rows[0]) if rows.size else inner_top
+    rows = np.flatnonzero(is_content(img[inner_bottom:]).any(axis=1))
+    bottom = inner_bottom + int(rows[-1]) + 1 if rows.size else inner_bottom
+    # 左右边框区域只需扫描内容行范围
+    cols = np.flatnonzero(is_content(img[top:bottom, :inner_left]).any(axis=0))
+    left = int(cols[0]) if cols.size else inner_left
+    cols = np.flatnonzero(is_content(img[top:bottom, inner_right:]).any(axis=0))
+    right = inner_right + int(cols[-1]) + 1 if cols.size else inner_right
+    return top, bottom, left, right
+
+
+# 从四条边缘分块向内扫描，只为边框区域及内容的首尾行列计算掩码，边框窄时远少于整图
+# 每次扫描的块大小翻倍，边框宽时扫描次数也只随宽度对数增长；结果与 find_bbox 完全一致
+def find_bbox_from_edges(img, is_content, block):
+
+    row, col = img.shape[:2]
+
+    def first_index(length, region, axis):
+        start, size = 0, block
+        while start < length:
+            found = np.flatnonzero(is_content(region(start, min(start + size, length))).any(axis=axis))
+            if found.size:
+                return start + int(found[0])
+            start, size = start + size, size * 2
+        return None
+
+    def last_index(length, low, region, axis):
+        end, size = length, block
+        while end > low:
+            start = max(end - size, low)
+            found = np.flatnonzero(is_content(region(start, end)).any(axis=axis))
+            if found.size:
+                return start + int(found[-1]) + 1
+            end, size = start, size * 2
+        return low
+
+    top = first_index(row, lambda a, b: img[a:b], 1)
+    # 整张图都没有内容时不裁剪
+    if top is None:
+        return 0, row, 0, col
+    bottom = last_index(row, top, lambda a, b: img[a:b], 1)
+    left = first_index(col, lambda a, b: img[top:bottom, a:b], 0)
+    right = last_index(col, left, lambda a, b: img[top:bottom, a:b], 0)
+    return top, bottom, left, right
+
+
+# 处理单张图片并保存，返回 CropResult
+def process_file(file_path, output_path, is_alpha, output_options=None, tolerance=None):
+
+    # 多帧图片逐批解码所有帧，只有一帧时按普通图片处理
+    if may_have_frames(file_path):
+        result = process_frames(file_path, output_path, is_alpha, output_options, tolerance)
+        if result is not None:
+            return result
+
+    # 解码后占用内存过大的 PNG 逐条带处理，不支持的 PNG 格式仍整图解码
+    if use_strips(file_path, output_options):
+        import png_stream
+        try:
+            return process_strips(file_path, output_path, is_alpha, output_options, tolerance, strip_rows)
+        except png_stream.UnsupportedPng:
+            pass
+
+    result, img_data = read_stage(file_path, is_alpha, output_options=output_options)
+    if img_data is None:
+        return result
+    result, payload = compute_stage(result, img_data, is_alpha, tolerance, output_options)
+    # 写出前释放输入文件的映射，输出文件夹与输入文件夹相同时才能覆盖原文件
+    img_data = None
+    return write_stage(result, payload, output_path)
+
+
+# 派生输出需要整张裁剪后的图片，此时不逐条带处理
+def use_strips(file_path, output_options=None):
+    return (strip_min_bytes and not has_derived(output_options) and file_path.lower().endswith('.png')
+            and estimate_memory(file_path) >= strip_min_bytes)
+
+
+# 逐条带处理一张 PNG，返回 CropResult
+# 第一遍逐条带解码并累计边界框，第二遍解码到边界框底部为止，把裁剪区域逐条带编码写出
+# 两遍都只在内存中保留一个条带（rows 行），峰值内存与条带大小成正比，与图片大小无关
+def process_strips(file_path, output_path, is_alpha, output_options=None, tolerance=None, rows=STRIP_ROWS):
+
+    import png_stream
+    output_options = output_options or OutputOptions()
+    tolerance = tolerance or Tolerance()
+    metrics = {}
+    result = CropResult(file_path, get_temp_name(file_path), None, metrics=metrics)
+
+    t = perf_counter()
+    croppable = may_be_cropped(file_path, is_alpha)
+    metrics['precheck'] = perf_counter() - t
+    if not croppable:
+        return result._replace(status=STATUS_NOT_CROPPED)
+
+    try:
+        f = open(file_path, 'rb')
+    except FileNotFoundError:
+        return result._replace(status=STATUS_NOT_FOUND)
+    with f:
+        reader = png_stream.PngStripReader(f)
+        height, width, channels = reader.shape
+        metrics['bytes_in'] = fstat(f.fileno()).st_size
+        metrics['pixels'] = height * width
+        top, bottom, left, right = height, 0, width, 0
+        metrics['decode'] = metrics['bbox'] = 0
+        # 透明模式下，若图片无透明通道，则整张图完全不透明，无需裁剪
+        if not (is_alpha and channels != 4):
+            t = perf_counter()
+            for y, strip in reader.strips(rows):
+                t_bbox = perf_counter()
+                metrics['decode'] += t_bbox - t
+                mask = content_mask(strip, is_alpha, tolerance)
+                content_rows = np.flatnonzero(mask.any(axis=1))
+                if content_rows.size:
+                    top = min(top, y + int(content_rows[0]))
+                    bottom = y + int(content_rows[-1]) + 1
+                    content_cols = np.flatnonzero(mask.any(axis=0))
+                    left = min(left, int(content_cols[0]))
+                    right = max(right, int(content_cols[-1]) + 1)
+                t = perf_counter()
+                metrics['bbox'] += t - t_bbox
+
+    # 整张图都没有内容时不裁剪
+    if bottom == 0:
+        top, bottom, left, right = 0, height, 0, width
+    bbox = top, bottom, left, right
+    # 尺寸的形式与 imdecode 解码后的图片形状一致
+    ini_size = (height, width, channels) if channels > 1 else (height, width)
+    cropped_size = (bottom - top, right - left, channels) if channels > 1 else (bottom - top, right - left)
+    result = result._replace(ini_size=ini_size, cropped_size=cropped_size, bbox=bbox)
+    if cropped_size == ini_size:
+        return result._replace(status=STATUS_NOT_CROPPED)
+    result = result._replace(status=STATUS_CROPPED)
+
+    # 只输出边界框时无需第二遍解码
+    if output_options.format in ('sidecar', 'index'):
+        return write_stage(result, encode_output(file_path, None, bbox, ini_size, output_options, metrics), output_path)
+
+    output_file = output_path + '/' + result.name + '.png'
+    t = perf_counter()
+    with open(file_path, 'rb') as f, AtomicFile(output_file) as out:
+        reader = png_stream.PngStripReader(f)
+        writer = png_stream.PngStripWriter(out, right - left, bottom - top, channels, reader.dtype,
+                                           output_options.png_compression, PNG_STRATEGIES.get(output_options.png_strategy))
+        for y, strip in reader.strips(rows, bottom):
+            strip = strip[max(top - y, 0):, left:right]
+            if strip.shape[0]:
+                writer.write_strip(strip)
+        writer.close()
+    # 第二遍的解码与编码交替进行，合计为编码耗时
+    metrics['encode'] = perf_counter() - t
+    metrics['bytes_out'] = writer.bytes_out + len(png_stream.PNG_SIGNATURE)
+    return result._replace(output=output_file)
+
+
+# 仅由后缀、页数及 PNG 的 acTL 块判断图片是否可能含有多帧
+# GIF、TIFF 的页数只需读取文件结构，无需解码；只有一页的图片直接按普通图片处理
+def may_have_frames(file_path):
+    lower = file_path.lower()
+    if lower.endswith(MULTI_FRAME_EXTENSIONS):
+        return frame_count(file_path) != 1
+    if not lower.endswith('.png'):
+        return False
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(8) == PNG_SIGNATURE and png_is_animated(f)
+    except OSError:
+        return False
+
+
+# 返回图片的页数（帧数），无法由路径读取时（如 Windows 上的非 ASCII 路径）返回 0
+def frame_count(file_path):
+    try:
+        return cv2.imcount(file_path, cv2.IMREAD_UNCHANGED)
+    except cv2.error:
+        return 0
+
+
+# 读取 IDAT 之前的数据块，APNG 的 acTL 块必须位于 IDAT 之前
+def png_is_animated(f):
+    while True:
+        chunk_head = f.read(8)
+        if len(chunk_head) < 8:
+            return False
+        chunk_type = chunk_head[4:]
+        if chunk_type == b'acTL':
+            return True
+        if chunk_type in (b'IDAT', b'IEND'):
+            return False
+        f.seek(int.from_bytes(chunk_head[:4], 'big') + 4, 1)
+
+
+# 分批解码多帧图片，产出 (起始帧序号, 帧列表, Animation)，每批帧的总大小不超过 FRAME_CHUNK_BYTES
+# OpenCV 每次都从第一帧开始解码（动画的帧依赖之前的帧），只保留所需范围内的帧，
+# 因此内存有界，但帧数超过一批时需要重复解码前面的帧
+# 为确定每批的帧数先解码的第一帧并入第一批，不再重复解码
+def frame_chunks(img_data):
+    ok, animation = cv2.imdecodeanimation(img_data, 0, 1)
+    if not ok or not animation.frames:
+        return
+    first = animation.frames[0]
+    chunk = max(FRAME_CHUNK_BYTES // first.nbytes, 1)
+    if chunk > 1:
+        ok, rest = cv2.imdecodeanimation(img_data, 1, chunk - 1)
+        if ok and rest.frames:
+            rest.frames = [first] + list(rest.frames)
+            rest.durations = list(animation.durations) + list(rest.durations)
+            animation = rest
+    frames = list(animation.frames)
+    yield 0, frames, animation
+    if len(frames) < chunk:
+        return
+    start = chunk
+    while True:
+        ok, animation = cv2.imdecodeanimation(img_data, start, chunk)
+        frames = list(animation.frames) if ok else []
+        if not frames:
+            return
+        yield start, frames, animation
+        if len(frames) < chunk:
+            return
+        start += chunk
+
+
+# 一次计算一批帧各自的边界框，没有内容的帧为 None
+# 尺寸相同的帧叠成 (帧数, 高, 宽, 通道) 的数组，一次计算掩码并分别按行列投影
+def find_frame_bboxes(frames, is_alpha, tolerance=None):
+
+    tolerance = tolerance or Tolerance()
+    if len({frame.shape for frame in frames}) > 1:
+        return [bbox for frame in frames for bbox in find_frame_bboxes([frame], is_alpha, tolerance)]
+    stack = np.stack(frames)
+    if stack.ndim == 3:
+        stack = stack[..., np.newaxis]
+    count, row, col, channels = stack.shape
+    # 透明模式下，若图片无透明通道，则整张图完全不透明，无需裁剪
+    if is_alpha and channels != 4:
+        return [(0, row, 0, col)] * count
+
+    mask = content_mask(stack.reshape(count * row, col, channels), is_alpha, tolerance).reshape(count, row, col)
+    rows = mask.any(axis=2)
+    cols = mask.any(axis=1)
+    tops = rows.argmax(axis=1)
+    bottoms = row - rows[:, ::-1].argmax(axis=1)
+    lefts = cols.argmax(axis=1)
+    rights = col - cols[:, ::-1].argmax(axis=1)
+    return [(int(tops[i]), int(bottoms[i]), int(lefts[i]), int(rights[i])) if rows[i].any() else None for i in range(count)]
+
+
+# 处理多帧图片并保存，返回 CropResult；只有一帧时返回 None，交由普通流程处理
+# 第一遍分批解码并计算各帧的边界框，第二遍重新解码并输出裁剪后的帧；全部帧能放进一批时不重复解码
+# union 方式的输出需要一次编码所有帧，裁剪后的帧会同时留在内存中
+def process_frames(file_path, output_path, is_alpha, output_options=None, tolerance=None):
+
+    output_options = output_options or OutputOptions()
+    metrics = {}
+    result = CropResult(file_path, get_temp_name(file_path), None, metrics=metrics)
+
+    t = perf_counter()
+    img_data = file_bytes(file_path)
+    metrics['read'] = perf_counter() - t
+    if img_data is None:
+        return result._replace(status=STATUS_NOT_FOUND)
+    metrics['bytes_in'] = img_data.size
+
+    bboxes, shapes, durations = [], [], []
+    animation = kept = first = None
+    metrics['decode'] = metrics['bbox'] = 0
+    metrics['pixels'] = 0
+    t = perf_counter()
+    for start, frames, chunk_animation in frame_chunks(img_data):
+        t_bbox = perf_counter()
+        metrics['decode'] += t_bbox - t
+        bboxes += find_frame_bboxes(frames, is_alpha, tolerance)
+        shapes += [frame.shape for frame in frames]
+        durations += list(chunk_animation.durations)
+        metrics['pixels'] += sum(frame.shape[0] * frame.shape[1] for frame in frames)
+        # 只有第一批时保留下来，第二遍无需重新解码
+        kept = frames if start == 0 else None
+        first = frames[0] if start == 0 else first
+        animation = animation or chunk_animation
+        t = perf_counter()
+        metrics['bbox'] += t - t_bbox
+    if len(bboxes) <= 1:
+        return None
+
+    row, col = shapes[0][:2]
+    # 没有内容的帧不裁剪，在 union 方式中不影响共用的边界框
+    frame_bboxes = [bbox or (0, shape[0], 0, shape[1]) for bbox, shape in zip(bboxes, shapes)]
+    found = [bbox for bbox in bboxes if bbox] or [(0, row, 0, col)]
+    top, bottom, left, right = bbox = (min(b[0] for b in found), max(b[1] for b in found),
+                                       min(b[2] for b in found), max(b[3] for b in found))
+    ini_size = shapes[0]
+    cropped_size = (bottom - top, right - left) + tuple(ini_size[2:])
+    if output_options.frames == 'independent':
+        cropped = any(frame_bbox != (0, shape[0], 0, shape[1]) for frame_bbox, shape in zip(frame_bboxes, shapes))
+    else:
+        cropped = cropped_size != ini_size
+        frame_bboxes = [bbox] * len(bboxes)
+    result = result._replace(ini_size=ini_size, cropped_size=cropped_size, bbox=bbox, frames=frame_bboxes)
+    if not cropped:
+        result = result._replace(status=STATUS_NOT_CROPPED)
+        if not has_derived(output_options):
+            return result
+        t = perf_counter()
+        derived = collect_derived(submit_derived(first, output_options))
+        metrics['encode'] = perf_counter() - t
+        return write_stage(result, (None, None, derived), output_path)
+    result = result._replace(status=STATUS_CROPPED)
+
+    if output_options.format == 'index':
+        return result
+    if output_options.format == 'sidecar':
+        t = perf_counter()
+        data = json.dumps({'source': file_path, 'bbox': list(bbox), 'ini_size': list(ini_size), 'mode': output_options.frames,
+                           'frames': [list(frame_bbox) for frame_bbox in frame_bboxes]}, ensure_ascii=False).encode('utf-8')
+        metrics['encode'] = perf_counter() - t
+        return result._replace(output=write_output(data, output_path, result.name, '.json', metrics))
+
+    # 派生输出由裁剪后的第一帧生成，与各帧同时编码
+    frame_top, frame_bottom, frame_left, frame_right = frame_bboxes[0]
+    futures = submit_derived(first[frame_top:frame_bottom, frame_left:frame_right], output_options)
+    first = None
+
+    def cropped_frames():
+        chunks = [(0, kept, None)] if kept is not None else frame_chunks(img_data)
+        for start, frames, _ in chunks:
+            for index, frame in enumerate(frames, start):
+                frame_top, frame_bottom, frame_left, frame_right = frame_bboxes[index]
+                yield index, frame[frame_top:frame_bottom, frame_left:frame_right]
+
+    t = perf_counter()
+    if output_options.frames == 'independent':
+        # 逐帧编码写出，不在内存中积累，写出的耗时计入编码
+        output = None
+        bytes_out = 0
+        for index, frame in cropped_frames():
+            data = encode_image(frame, '.png', output_options)
+            frame_output = write_output(data, output_path, f'{result.name}_{index:04d}', '.png')
+            output = output or frame_output
+            bytes_out += data.size
+        metrics['encode'] = perf_counter() - t
+        metrics['bytes_out'] = bytes_out
+    else:
+        # 第二遍重新解码时复制出裁剪区域，释放整帧
+        frames = [np.ascontiguousarray(frame) if kept is None else frame for _, frame in cropped_frames()]
+        ext = '.tif' if file_path.lower().endswith(('.tif', '.tiff')) else path.splitext(file_path)[1].lower()
+        if ext == '.tif':
+            ok, data = cv2.imencodemulti(ext, frames)
+        else:
+            cropped_animation = cv2.Animation()
+            cropped_animation.frames = frames
+            cropped_animation.durations = durations
+            cropped_animation.loop_count = animation.loop_count
+            cropped_animation.bgcolor = animation.bgcolor
+            ok, data = cv2.imencodeanimation(ext, cropped_animation)
+        if not ok:
+            raise ValueError(f'failed to encode {len(frames)} frames as {ext}')
+        metrics['encode'] = perf_counter() - t
+        output = write_output(data, output_path, result.name, ext, metrics)
+    return write_stage(result._replace(output=output), (None, None, collect_derived(futures)), output_path)
+
+
+# 读取阶段：预检查并读取文件内容，返回 (CropResult, 文件内容)
+# 已能确定结果（无需裁剪或找不到图像）时文件内容为 None，否则 CropResult 的 status 为 None，留待后续阶段填写
+# prefetch 为 True 时提示系统提前把映射的文件读入内存；有派生输出时总要解码，不做预检查
+def read_stage(file_path, is_alpha, prefetch=False, output_options=None):
+
+    temp_name = get_temp_name(file_path)
+    metrics = {}
+
+    # 仅读取文件头即可判断无需裁剪的图像，跳过完整解码
+    t = perf_counter()
+    croppable = has_derived(output_options) or may_be_cropped(file_path, is_alpha)
+    metrics['precheck'] = perf_counter() - t
+    if not croppable:
+        return CropResult(file_path, temp_name, STATUS_NOT_CROPPED, metrics=metrics), None
+
+    t = perf_counter()
+    img_data = file_bytes(file_path, prefetch)
+    metrics['read'] = perf_counter() - t
+    # 找不到图像
+    if img_data is None:
+        return CropResult(file_path, temp_name, STATUS_NOT_FOUND, metrics=metrics), None
+    return CropResult(file_path, temp_name, None, metrics=metrics), img_data
+
+
+# 计算阶段：解码、计算边界框并编码输出内容，返回 (CropResult, 输出内容)
+# 输出内容为 (后缀, 数据, 派生输出)，图像未被裁剪且没有派生输出或只写索引时为 None
+# 未被裁剪的图像没有主输出（后缀与数据为 None），派生输出由原图生成
+def compute_stage(result, img_data, is_alpha, tolerance=None, output_options=None):
+
+    metrics = result.metrics
+    cropped_img, ini_size, cropped_size, bbox = crop_data(img_data, is_alpha, tolerance, metrics)
+    result = result._replace(ini_size=ini_size, cropped_size=cropped_size, bbox=bbox)
+
+    # 图像未被处理
+    if cropped_size == ini_size:
+        payload = None
+        if has_derived(output_options):
+            t = perf_counter()
+            payload = None, None, collect_derived(submit_derived(cropped_img, output_options))
+            metrics['encode'] = perf_counter() - t
+        return result._replace(status=STATUS_NOT_CROPPED), payload
+
+    payload = encode_output(result.path, cropped_img, bbox, ini_size, output_options or OutputOptions(), metrics)
+    return result._replace(status=STATUS_CROPPED), payload
+
+
+# 在计算进程中按路径重新读取文件后执行计算阶段，文件内容不经序列化传给进程池
+# 读取阶段已把文件预读到系统缓存，此处映射文件不再等待磁盘
+def compute_file_stage(result, is_alpha, tolerance=None, output_options=None):
+
+    metrics = result.metrics
+    t = perf_counter()
+    img_data = file_bytes(result.path)
+    metrics['read'] = metrics.get('read', 0) + perf_counter() - t
+    if img_data is None:
+        return result._replace(status=STATUS_NOT_FOUND), None
+    return compute_stage(result, img_data, is_alpha, tolerance, output_options)
+
+
+# 写出阶段：把编码好的内容写入输出文件夹，返回填好输出路径的 CropResult
+def write_stage(result, payload, output_path):
+
+    if payload is None:
+        return result
+    ext, data, derived = payload
+    output = result.output if data is None else write_output(data, output_path, result.name, ext, result.metrics)
+    if not derived:
+        return result._replace(output=output)
+    metrics = result.metrics
+    t = perf_counter()
+    outputs = [write_output(derived_data, output_path, result.name + suffix, derived_ext) for suffix, derived_ext, derived_data in derived]
+    metrics['write'] = metrics.get('write', 0) + perf_counter() - t
+    metrics['bytes_out'] = metrics.get('bytes_out', 0) + sum(len(derived_data) for _, _, derived_data in derived)
+    return result._replace(output=output, derived=outputs)
+
+
+# 由输入路径得到输出文件名（不含后缀），只取决于输入文件夹的内容，与处理顺序无关
+# 只去掉最后一个后缀，文件名中的其他点号保留；同一文件夹中有同名不同后缀的图片（如 a.png 与 a.jpg）时以 + 加上原后缀，如 a+jpg
+# 设置了输入文件夹（见 set_output_layout）时，子文件夹中图片的名称带上相对路径，如 sub/a 或 sub~a
+# 文件名与文件夹名中的 %、~、+ 先转义（见 escape_name），不同的输入总是得到不同的输出名
+def get_temp_name(file_path):
+
+    folder, file_name = path.split(file_path)
+    stem, ext = path.splitext(file_name)
+    siblings = sibling_stems(folder).get(stem.lower(), 0)
+    stem = escape_name(stem)
+    if siblings > 1:
+        stem += '+' + escape_name(ext[1:])
+    if not input_root:
+        return stem
+
+    try:
+        relative = path.relpath(folder or '.', input_root)
+    except ValueError:
+        # Windows 下位于不同磁盘
+        return stem
+    # 不在输入文件夹中的图片只用文件名
+    if relative == '.' or relative.startswith('..'):
+        return stem
+    parts = relative.replace('\\', '/').split('/')
+    return '/'.join(parts + [stem]) if output_mirror else '~'.join([escape_name(part) for part in parts] + [stem])
+
+
+# 转义名称中用作分隔符的 ~、+ 及转义符 % 本身，转义后可以还原，拼接出的输出名不会与其他输入的相同
+def escape_name(name):
+    return name.replace('%', '%25').replace('~', '%7E').replace('+', '%2B')
+
+
+# 文件夹中各图片文件名（不含后缀，小写）出现的次数
+# 每次批量处理开始时清空（见 BatchRunner.run），之后每个进程中每个文件夹只列举一次，
+# 输出文件夹与输入文件夹相同时，写出的输出文件也不会引起重新列举
+@lru_cache(maxsize=64)
+def sibling_stems(folder):
+    try:
+        names = listdir(folder or '.')
+    except OSError:
+        return {}
+    counts = {}
+    for name in names:
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            stem = path.splitext(name)[0].lower()
+            counts[stem] = counts.get(stem, 0) + 1
+    return counts
+
+
+# 批量处理图片，逐个产出 (index, result)
+# workers 大于 1 时使用进程池并行处理，同时在途的图片数不超过 max_in_flight
+# ordered 为 True 时按输入顺序产出结果，否则按完成顺序产出
+# wait_if_paused 在暂停时阻塞，is_running 返回 False 时停止提交新任务
+# 给出 manifest 时跳过上次运行后未改动的图片，并记录本次的处理结果
+# 给出 pipeline 时将读取、计算、写出拆成三个阶段并行处理，见 process_pipeline
+def process_batch(file_paths, output_path, is_alpha, workers=1, max_in_flight=None, ordered=False,
+                  wait_if_paused=None, is_running=None, manifest=None, output_options=None, tolerance=None, pipeline=None,
+                  memory_budget=None, cache=None):
+
+    wait_if_paused = wait_if_paused or (lambda: None)
+    is_running = is_running or (lambda: True)
+    # memory_budget 为在途图片估计内存之和的上限（字节），超出时暂缓提交新的图片
+    budget = MemoryBudget(memory_budget) if memory_budget else None
 
-    cropped_img = img[bottom:top+1, left:right+1]
-    return cropped_img, ini_size, cropped_img.shape
+    # 内容相同的图片只处理一次，其余从去重缓存复制结果
+    if cache:
+        try:
+            yield from process_deduplicated(file_paths, output_path, is_alpha, cache, workers, max_in_flight, ordered,
+                                            wait_if_paused, is_running, manifest, output_options, tolerance, pipeline, memory_budget)
+        finally:
+            cache.save()
+        return
+
+    try:
+        if pipeline:
+            yield from process_pipeline(file_paths, output_path, is_alpha, workers, max_in_flight, ordered,
+                                        wait_if_paused, is_running, manifest, output_options, tolerance, pipeline, budget)
+            return
+
+        # 单进程时直接在当前线程中处理，省去进程池开销
+        if workers <= 1:
+            for index, file_path in enumerate(file_paths):
+                wait_if_paused()
+                if not is_running():
+                    break
+                result = manifest.lookup(file_path) if manifest else None
+                if result is None:
+                    result = run_safely(file_path, output_path, is_alpha, output_options, tolerance)
+                    if manifest:
+                        manifest.record(result)
+                yield index, result
+            return
+
+        max_in_flight = max(max_in_flight or 2 * workers, 1)
+        paths = enumerate(file_paths)
+        pending = {}
+        finished = {}
+        next_index = 0
+        exhausted = False
+        # 因内存预算暂缓提交的图片
+        held = None
+
+        # multiprocessing 导入较慢，用到时才导入
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # 补充任务直到在途图片数达到上限，等待输出的结果也计入其中
+                while not exhausted and len(pending) + len(finished) < max_in_flight:
+                    wait_if_paused()
+                    if not is_running():
+                        exhausted = True
+                        held = None
+                        # 终止时取消尚未开始的任务
+                        for future in pending:
+                            future.cancel()
+                        break
+                    if held is None:
+                        try:
+                            index, file_path = next(paths)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        result = manifest.lookup(file_path) if manifest else None
+                        if result is not None:
+                            finished[index] = result
+                            continue
+                        held = index, file_path, estimate_memory(file_path) if budget else 0
+                    index, file_path, size = held
+                    if budget and not budget.fits(size):
+                        break
+                    if budget:
+                        budget.acquire(index, size)
+                    pending[executor.submit(run_safely, file_path, output_path, is_alpha, output_options, tolerance)] = index
+                    held = None
+
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending.pop(future)
+                        if budget:
+                            budget.release(index)
+                        if future.cancelled():
+                            continue
+                        finished[index] = future.result()
+                        if manifest:
+                            manifest.record(finished[index])
+
+                if not ordered:
+                    for index in list(finished):
+                        yield index, finished.pop(index)
+                else:
+                    # 按输入顺序输出已完成的结果
+                    while next_index in finished:
+                        yield next_index, finished.pop(next_index)
+                        next_index += 1
+                    # 全部结束后（终止时被取消的任务不会完成）剩余结果直接按序输出
+                    if exhausted and not pending:
+                        for index in sorted(finished):
+                            yield index, finished.pop(index)
+
+                if exhausted and not pending and held is None:
+                    break
+    finally:
+        # 无论正常结束还是中途终止，都保存已完成部分的记录
+        if manifest:
+            manifest.save()
+
+
+# 流水线批量处理：读取线程池预读文件，计算进程池（workers 为 1 时为单个线程）解码、裁剪并编码，写出线程池写入文件
+# 计算在进程池中执行时，读取线程只预检查并把文件预读到系统缓存，由计算进程按路径读取，见 compute_file_stage
+# 各阶段之间的队列长度有上限，下游变慢时上游随之停下，内存占用有界
+# 暂停时停止读取新的图片，终止时丢弃已读入但未开始计算的图片，计算和写出中的图片处理完毕后退出
+def process_pipeline(file_paths, output_path, is_alpha, workers, max_in_flight, ordered,
+                     wait_if_paused, is_running, manifest, output_options, tolerance, pipeline, budget=None):
+
+    compute_limit = max(max_in_flight or 2 * workers, 1)
+    paths = enumerate(file_paths)
+    sources = {}
+    reading, computing, writing = {}, {}, {}
+    # 多帧图片与逐条带处理的大图自行读写文件，由读取线程判断后整个交给计算执行器处理
+    direct = {}
+    read_queue, write_queue = deque(), deque()
+    finished = {}
+    next_index = 0
+    exhausted = False
+    held = None
+
+    # 图片处理完毕或被丢弃时归还内存预算
+    def release(index):
+        sources.pop(index, None)
+        if budget:
+            budget.release(index)
+
+    def complete(index, result):
+        finished[index] = result
+        release(index)
+        if manifest:
+            manifest.record(result)
+
+    from concurrent.futures import ProcessPoolExecutor
+    compute_executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    with ThreadPoolExecutor(max_workers=pipeline.readers) as read_executor, compute_executor, \
+            ThreadPoolExecutor(max_workers=pipeline.writers) as write_executor:
+        while True:
+            # 读取阶段：读取中、已读入待计算和等待输出（如处理记录中未改动）的图片数不超过 read_ahead
+            while not exhausted and len(reading) + len(read_queue) + len(direct) + len(finished) < pipeline.read_ahead:
+                wait_if_paused()
+                if not is_running():
+                    exhausted = True
+                    held = None
+                    for future in list(reading) + list(direct):
+                        future.cancel()
+                    for index, _, _ in read_queue:
+                        release(index)
+                    read_queue.clear()
+                    break
+                if held is None:
+                    try:
+                        index, file_path = next(paths)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    result = manifest.lookup(file_path) if manifest else None
+                    if result is not None:
+                        finished[index] = result
+                        continue
+                    held = index, file_path, estimate_memory(file_path) if budget else 0
+                # 内存预算不足时等待在途图片完成
+                index, file_path, size = held
+                if budget and not budget.fits(size):
+                    break
+                if budget:
+                    budget.acquire(index, size)
+                sources[index] = file_path
+                reading[read_executor.submit(pipeline_read, file_path, is_alpha, output_options, workers <= 1)] = index
+                held = None
+
+            # 计算阶段：计算中和已编码待写出的图片数不超过 compute_limit
+            while read_queue and len(computing) + len(write_queue) < compute_limit:
+                index, result, img_data = read_queue.popleft()
+                if workers > 1:
+                    future = compute_executor.submit(compute_file_stage, result, is_alpha, tolerance, output_options)
+                else:
+                    future = compute_executor.submit(compute_stage, result, img_data, is_alpha, tolerance, output_options)
+                computing[future] = index
+
+            # 写出阶段：同时写出的图片数不超过 write_behind
+            while write_queue and len(writing) < pipeline.write_behind:
+                index, result, payload = write_queue.popleft()
+                writing[write_executor.submit(write_stage, result, payload, output_path)] = index
+
+            running = list(reading) + list(computing) + list(writing) + list(direct)
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = next(stage for stage in (reading, computing, writing, direct) if future in stage)
+                    index = stage.pop(future)
+                    if future.cancelled():
+                        release(index)
+                        continue
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        complete(index, error_result(sources[index], e))
+                        continue
+                    if stage is reading:
+                        if value is None:
+                            if is_running():
+                                direct[compute_executor.submit(run_safely, sources[index], output_path, is_alpha, output_options,
+                                                               tolerance)] = index
+                            else:
+                                release(index)
+                            continue
+                        result, img_data = value
+                        if img_data is None:
+                            complete(index, result)
+                        elif is_running():
+                            read_queue.append((index, result, img_data))
+                        else:
+                            release(index)
+                    elif stage is computing:
+                        result, payload = value
+                        if payload is not None:
+                            write_queue.append((index, result, payload))
+                        else:
+                            complete(index, result)
+                    else:
+                        complete(index, value)
+
+            idle = not (reading or computing or writing or direct or read_queue or write_queue or held)
+            if not ordered:
+                for index in list(finished):
+                    yield index, finished.pop(index)
+            else:
+                # 按输入顺序输出已完成的结果
+                while next_index in finished:
+                    yield next_index, finished.pop(next_index)
+                    next_index += 1
+                # 全部结束后（终止时被丢弃的图片不会完成）剩余结果直接按序输出
+                if exhausted and idle:
+                    for index in sorted(finished):
+                        yield index, finished.pop(index)
+
+            if exhausted and idle:
+                break
+
+
+# 流水线的读取阶段，在读取线程中执行：多帧图片与需逐条带处理的大图返回 None，交给计算执行器整个处理，
+# 判断时读取的文件头不占用调度线程；其余图片执行 read_stage
+# keep_data 为 False（计算在其他进程中执行）时丢弃映射的文件内容，以文件路径代替，文件仍已预读到系统缓存
+def pipeline_read(file_path, is_alpha, output_options=None, keep_data=True):
+    if may_have_frames(file_path) or use_strips(file_path, output_options):
+        return None
+    result, img_data = read_stage(file_path, is_alpha, True, output_options)
+    if img_data is None or keep_data:
+        return result, img_data
+    return result, file_path
+
+
+# 处理单张图片，出错时返回错误信息而不中断整批处理
+def run_safely(file_path, output_path, is_alpha, output_options=None, tolerance=None):
+    try:
+        return process_file(file_path, output_path, is_alpha, output_options, tolerance)
+    except Exception as e:
+        return error_result(file_path, e)
+
+
+# 去重处理：逐个计算源文件内容的哈希值，缓存命中时直接复制结果，
+# 与在途图片内容相同时等它处理完再复制，其余交给 process_batch 处理
+# 与在途图片内容相同的图片在其处理完后才产出，因此 ordered 对这些图片无效
+def process_deduplicated(file_paths, output_path, is_alpha, cache, workers, max_in_flight, ordered,
+                         wait_if_paused, is_running, manifest, output_options, tolerance, pipeline, memory_budget):
+
+    output_options = output_options or OutputOptions()
+    lookup = PrefetchedLookup(manifest)
+    # process_batch 中的序号 -> (原序号, 路径, 哈希值)，缓存命中及不参与去重的图片哈希值为 None
+    originals = []
+    # 哈希值 -> 等待在途图片处理完的 (原序号, 路径)
+    waiting = {}
+    # 缓存不保存输出文件时，等待在途图片也无法复制其输出，内容相同的图片直接交给 process_batch
+    hold_duplicates = cache.options.store_outputs or output_options.format in ('sidecar', 'index')
+
+    # 在哈希线程中执行，返回 (哈希值, 耗时)，读取失败时哈希值为 None
+    # 多帧图片的结果不进入缓存，不计算哈希值，内容相同的图片也各自交给 process_batch 并行处理
+    def content_key(file_path):
+        t = perf_counter()
+        key = None if may_have_frames(file_path) else cache.key(file_path)
+        return key, perf_counter() - t
+
+    # 缓存命中的图片也交给 process_batch，由其像处理记录中未改动的图片一样逐个产出，并检查暂停与终止
+    # 哈希值由哈希线程提前计算至多 look_ahead 张，调度线程只按顺序取用结果
+    def sources():
+        paths = enumerate(file_paths)
+        hashing = deque()
+        look_ahead = max(max_in_flight or 2 * workers, HASH_THREADS)
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as hash_executor:
+            try:
+                while True:
+                    for index, file_path in islice(paths, look_ahead - len(hashing)):
+                        hashing.append((index, file_path, hash_executor.submit(content_key, file_path)))
+                    if not hashing:
+                        return
+                    wait_if_paused()
+                    if not is_running():
+                        return
+                    index, file_path, future = hashing.popleft()
+                    key, hash_seconds = future.result()
+                    if key is not None:
+                        if key in waiting:
+                            waiting[key].append((index, file_path))
+                            continue
+                        lookup.result = cache.fetch(key, file_path, output_path, output_options, {'read': hash_seconds})
+                        if lookup.result is not None:
+                            originals.append((index, file_path, None))
+                            yield file_path
+                            continue
+                        if hold_duplicates:
+                            waiting[key] = []
+                    originals.append((index, file_path, key))
+                    yield file_path
+            finally:
+                for _, _, future in hashing:
+                    future.cancel()
+
+    results = process_batch(sources(), output_path, is_alpha, workers, max_in_flight, ordered, wait_if_paused, is_running,
+                            lookup, output_options, tolerance, pipeline, memory_budget)
+    for batch_index, result in results:
+        index, file_path, key = originals[batch_index]
+        yield index, result
+        if key is None:
+            continue
+        cache.store(key, result)
+        for duplicate_index, duplicate_path in waiting.pop(key, []):
+            if not is_running():
+                return
+            duplicate = cache.fetch(key, duplicate_path, output_path, output_options, {})
+            # 首张图片出错或缓存中没有输出时单独处理
+            if duplicate is None:
+                duplicate = run_safely(duplicate_path, output_path, is_alpha, output_options, tolerance)
+            yield duplicate_index, duplicate
+
+
+# 在 process_batch 取出下一张图片时返回 sources 刚从去重缓存取得的结果，没有时再查询处理记录
+class PrefetchedLookup:
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest
+        self.result = None
+
+
+    def lookup(self, file_path):
+        result, self.result = self.result, None
+        if result is None and self.manifest:
+            return self.manifest.lookup(file_path)
+        return result
+
+
+    def record(self, result):
+        if self.manifest:
+            self.manifest.record(result)
+
+
+    def save(self):
+        if self.manifest:
+            self.manifest.save()
+
+
+def error_result(file_path, e):
+    return CropResult(file_path, get_temp_name(file_path), STATUS_ERROR, error=repr(e))
+
+
+# 批量裁剪任务的参数，output_path 为空时输出到 input_path 下的 output 文件夹
+CropJob = namedtuple('CropJob', ['input_path', 'output_path', 'is_alpha', 'output_options', 'tolerance', 'workers',
+                                 'max_in_flight', 'ordered', 'pipeline', 'memory_budget', 'incremental', 'use_hash', 'dedup'],
+                     defaults=('', '', True, None, None, 1, None, False, None, None, False, False, None))
+
+
+# 可在其他线程中暂停、继续或取消批量处理
+class CancelToken:
+
+    def __init__(self):
+        self.condition = Condition()
+        self.cancelled = False
+        self.paused = False
+
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.paused = False
+            self.condition.notify_all()
+
+
+    def pause(self):
+        with self.condition:
+            self.paused = True
+
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+
+    def is_running(self):
+        return not self.cancelled
+
+
+    # 暂停时阻塞，直到继续或取消
+    def wait_if_paused(self):
+        with self.condition:
+            while self.paused and not self.cancelled:
+                self.condition.wait()
+
+
+# 与界面无关的批量处理入口：创建输出文件夹、按需跳过未改动的图片，逐个产出 CropResult
+# 结果中带有状态、尺寸、边界框及各阶段耗时，累计统计见 metrics
+class BatchRunner:
+
+    def __init__(self, job, token=None, total=None):
+        self.job = job
+        self.token = token or CancelToken()
+        self.metrics = BatchMetrics(total)
+        self.output_path = job.output_path or job.input_path + '/output'
+
+
+    def run(self, sources):
+        job = self.job
+        makedirs(self.output_path, exist_ok=True)
+        # 输入文件夹可能在两次处理之间有改动，重新统计同名图片
+        sibling_stems.cache_clear()
+        params = crop_params(job.is_alpha, job.output_options, job.tolerance)
+        manifest = Manifest(self.output_path, params, job.use_hash) if job.incremental else None
+        cache = DedupCache(job.dedup, params) if job.dedup else None
+        results = process_batch(sources, self.output_path, job.is_alpha, workers=job.workers,
+                                max_in_flight=job.max_in_flight, ordered=job.ordered,
+                                wait_if_paused=self.token.wait_if_paused, is_running=self.token.is_running,
+                                manifest=manifest, output_options=job.output_options, tolerance=job.tolerance,
+                                pipeline=job.pipeline, memory_budget=job.memory_budget, cache=cache)
+        sync = OutputSync() if durability == 'batch' else None
+        # index 输出格式不写单张图片的输出，所有边界框汇总到输出文件夹中的 bbox_index.csv
+        bbox_index = BboxIndex(self.output_path) if job.output_options and job.output_options.format == 'index' else None
+        try:
+            for _, result in results:
+                self.metrics.add(result)
+                if sync:
+                    sync.add(result)
+                if bbox_index:
+                    bbox_index.add(result)
+                yield result
+        finally:
+            if sync:
+                sync.flush()
+            if bbox_index:
+                bbox_index.close()
+
+
+    def cancel(self):
+        self.token.cancel()
+
+
+# 影响裁剪结果的参数，用于判断处理记录是否仍然有效
+def crop_params(is_alpha, output_options=None, tolerance=None):
+    return {'mode': 'alpha' if is_alpha else 'white', 'output': (output_options or OutputOptions())._asdict(),
+            'tolerance': (tolerance or Tolerance())._asdict()}
+
+
+# 输出文件夹中的处理记录，用于再次运行时跳过未改动的图片
+# 以源文件路径为键，记录文件大小、修改时间（及可选的内容哈希）、边界框和输出文件
+# params 为影响裁剪结果的参数（如裁剪模式），与上次记录不同时全部失效
+class Manifest:
+
+    file_name = '.crop_manifest.json'
+    version = 1
+
+    def __init__(self, output_path, params, use_hash=False, save_every=100):
+        self.manifest_path = output_path + '/' + self.file_name
+        # 与从 JSON 读出的记录保持相同的类型，以便比较
+        self.params = json.loads(json.dumps(params))
+        self.use_hash = use_hash
+        self.save_every = save_every
+        self.entries = {}
+        self.signatures = {}
+        self.unsaved = 0
+        self.load()
+
+
+    def load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.version and data.get('params') == self.params:
+            self.entries = data.get('entries', {})
+
+
+    # 原子地写入记录，中途终止也不会留下损坏的文件
+    def save(self):
+        if self.unsaved == 0 and path.exists(self.manifest_path):
+            return
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'params': self.params, 'entries': self.entries}, f, ensure_ascii=False)
+        replace(temp_path, self.manifest_path)
+        self.unsaved = 0
+
+
+    # 源文件未改动且输出仍然存在时返回上次的结果，否则返回 None
+    def lookup(self, file_path):
+        key = path.abspath(file_path)
+        try:
+            stat_result = stat(file_path)
+        except OSError:
+            return None
+        signature = {'size': stat_result.st_size, 'mtime': stat_result.st_mtime_ns}
+        self.signatures[key] = signature
+
+        entry = self.entries.get(key)
+        if entry is None or entry['size'] != signature['size']:
+            return None
+        if entry['mtime'] != signature['mtime']:
+            # 修改时间变化但内容相同（如被复制或 touch）时仍可跳过
+            if not self.use_hash:
+                return None
+            signature['hash'] = file_hash(file_path)
+            if entry.get('hash') != signature['hash']:
+                return None
+        if entry['output'] and not path.exists(entry['output']):
+            return None
+        return CropResult(file_path, entry['name'], entry['status'], entry['ini_size'], entry['cropped_size'],
+                          bbox=entry['bbox'], output=entry['output'], cached=True)
+
+
+    # 记录刚处理完的结果，找不到或出错的图片下次重新处理
+    def record(self, result):
+        key = path.abspath(result.path)
+        signature = self.signatures.pop(key, None)
+        if signature is None or result.status not in (STATUS_CROPPED, STATUS_NOT_CROPPED):
+            return
+        if self.use_hash and 'hash' not in signature:
+            signature['hash'] = file_hash(result.path)
+        self.entries[key] = dict(signature, name=result.name, status=result.status,
+                                 ini_size=list(result.ini_size), cropped_size=list(result.cropped_size),
+                                 bbox=list(result.bbox) if result.bbox else None, output=result.output)
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+
+# 计算文件内容的哈希值，seed 不为空时一并计入
+def file_hash(file_path, seed=b''):
+    digest = blake2b(seed, digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# 与 file_hash 相同的哈希值，由已读入（或映射）的文件内容计算
+def data_hash(data, seed=b''):
+    digest = blake2b(seed, digest_size=16)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+# 去重缓存记录引用的全部对象文件名
+def entry_objects(entry):
+    return ([entry['object']] if entry['object'] else []) + [name for _, name in entry.get('derived', [])]
+
+
+# 以内容哈希为键的去重缓存，记录边界框及（可选的）编码后的输出文件，按最近使用顺序淘汰
+# 键同时包含裁剪参数，同一缓存文件夹可供参数不同的多次运行共用
+class DedupCache:
+
+    file_name = 'index.json'
+    version = 1
+
+    def __init__(self, options, params):
+        self.options = options
+        self.cache_path = options.path
+        self.objects_path = options.path + '/objects'
+        self.index_path = options.path + '/' + self.file_name
+        self.seed = json.dumps(params, sort_keys=True).encode('utf-8')
+        # 按最近使用的先后排列，最久未用的在前
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        makedirs(self.objects_path, exist_ok=True)
+        self.load()
+
+
+    def load(self):
+        for key, entry in self.read_index().items():
+            self.entries[key] = entry
+            self.total_bytes += entry['size']
+
+
+    def read_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != self.version:
+            return {}
+        return dict(sorted(data.get('entries', {}).items(), key=lambda item: item[1]['used']))
+
+
+    # 保存前合并其他运行在此期间写入的记录，再按大小上限淘汰
+    def save(self):
+        for key, entry in self.read_index().items():
+            if key not in self.entries and all(path.exists(self.objects_path + '/' + name) for name in entry_objects(entry)):
+                self.entries[key] = entry
+                self.entries.move_to_end(key, last=False)
+                self.total_bytes += entry['size']
+        self.evict()
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'entries': self.entries}, f, ensure_ascii=False)
+        replace(temp_path, self.index_path)
+
+
+    def evict(self):
+        while self.total_bytes > self.options.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry['size']
+            for name in entry_objects(entry):
+                try:
+                    remove(self.objects_path + '/' + name)
+                except OSError:
+                    pass
+
+
+    # 文件内容与裁剪参数的哈希值，读取失败时返回 None
+    # 大文件以映射方式读取并提示预读，随后解码时映射同一文件直接使用页缓存，不再从磁盘读取
+    def key(self, file_path):
+        try:
+            data = file_bytes(file_path, prefetch=True)
+        except OSError:
+            return None
+        if data is None:
+            return None
+        return data_hash(data, self.seed)
+
+
+    # 缓存命中时把结果写入输出文件夹并返回 CropResult，否则返回 None
+    def fetch(self, key, file_path, output_path, output_options, metrics):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        name = get_temp_name(file_path)
+        result = CropResult(file_path, name, entry['status'], entry['ini_size'], entry['cropped_size'],
+                            bbox=tuple(entry['bbox']), metrics=metrics, deduplicated=True)
+
+        if entry['status'] == STATUS_CROPPED and output_options.format != 'index':
+            t = perf_counter()
+            # 边界框文件直接重新生成
+            if output_options.format == 'sidecar':
+                ext, data, _ = encode_output(file_path, None, entry['bbox'], entry['ini_size'], output_options)
+                output = write_output(data, output_path, name, ext, metrics)
+            else:
+                if entry['object'] is None:
+                    return None
+                output = output_path + '/' + name + entry['ext']
+                makedirs(path.dirname(output), exist_ok=True)
+                try:
+                    self.link_or_copy(self.objects_path + '/' + entry['object'], output)
+                except FileNotFoundError:
+                    return None
+                metrics['write'] = perf_counter() - t
+                metrics['bytes_out'] = entry['size']
+            result = result._replace(output=output)
+
+        # 派生输出的文件名为输出文件名加上记录的结尾
+        if entry.get('derived'):
+            t = perf_counter()
+            outputs = []
+            for ending, name in entry['derived']:
+                outputs.append(output_path + '/' + result.name + ending)
+                makedirs(path.dirname(outputs[-1]), exist_ok=True)
+                try:
+                    self.link_or_copy(self.objects_path + '/' + name, outputs[-1])
+                except FileNotFoundError:
+                    return None
+            metrics['write'] = metrics.get('write', 0) + perf_counter() - t
+            metrics['bytes_out'] = entry['size']
+            result = result._replace(derived=outputs)
+
+        self.entries.move_to_end(key)
+        entry['used'] = time()
+        self.hits += 1
+        return result
+
+
+    # 记录处理完的结果，裁剪后的输出文件复制（或硬链接）到缓存中
+    def store(self, key, result):
+        # 仅凭文件头判断无需裁剪的图片没有边界框，重新判断的开销很小，不必缓存
+        if result.cached or result.bbox is None or result.status not in (STATUS_CROPPED, STATUS_NOT_CROPPED) or key in self.entries:
+            return
+        # 多帧图片有多个输出文件，每次重新处理
+        if result.frames is not None:
+            return
+        entry = {'status': result.status, 'bbox': list(result.bbox), 'ini_size': list(result.ini_size),
+                 'cropped_size': list(result.cropped_size), 'ext': None, 'object': None, 'size': 0, 'used': time()}
+        # 边界框文件由 fetch 直接重新生成，无需缓存
+        if result.output and self.options.store_outputs and result.status == STATUS_CROPPED and not result.output.endswith('.json'):
+            entry['ext'] = path.splitext(result.output)[1]
+            entry['object'] = key + entry['ext']
+            try:
+                self.link_or_copy(result.output, self.objects_path + '/' + entry['object'])
+                entry['size'] = path.getsize(self.objects_path + '/' + entry['object'])
+            except OSError:
+                entry['ext'] = entry['object'] = None
+        # 派生输出按文件名中输出文件名之后的部分（如 _thumb.jpg）记录，不保存输出或复制失败时不记录这张图片
+        if result.derived:
+            if not self.options.store_outputs:
+                return
+            entry['derived'] = []
+            try:
+                for output in result.derived:
+                    ending = path.basename(output)[len(path.basename(result.name)):]
+                    entry['derived'].append([ending, key + ending])
+                    self.link_or_copy(output, self.objects_path + '/' + key + ending)
+                    entry['size'] += path.getsize(self.objects_path + '/' + key + ending)
+            except OSError:
+                for name in entry_objects(entry):
+                    try:
+                        remove(self.objects_path + '/' + name)
+                    except OSError:
+                        pass
+                return
+        self.entries[key] = entry
+        self.total_bytes += entry['size']
+        self.evict()
+
+
+    # 先写到临时文件再替换，目标已存在时也不会改动与之共用硬链接的文件
+    def link_or_copy(self, source, destination):
+        temp_path = destination + '.tmp'
+        if self.options.hardlink:
+            try:
+                link(source, temp_path)
+                replace(temp_path, destination)
+                return
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # 跨磁盘或文件系统不支持硬链接时改为复制
+                pass
+        from shutil import copyfile
+        copyfile(source, temp_path)
+        replace(temp_path, destination)
+
+
+# 批量处理的滚动统计：最近 window 张图片的吞吐量及各阶段耗时的 p50 / p95，total 已知时估算剩余时间
+class BatchMetrics:
+
+    def __init__(self, total=None, window=500):
+        self.total = total
+        self.recent = deque(maxlen=window)
+        self.start_time = perf_counter()
+        self.count = 0
+        self.cached = 0
+        self.deduplicated = 0
+        self.pixels = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_seconds = dict.fromkeys(METRIC_STAGES, 0.0)
+
+
+    def add(self, result):
+        metrics = result.metrics or {}
+        self.count += 1
+        self.cached += result.cached
+        self.deduplicated += result.deduplicated
+        self.pixels += metrics.get('pixels', 0)
+        self.bytes_in += metrics.get('bytes_in', 0)
+        self.bytes_out += metrics.get('bytes_out', 0)
+        for stage in METRIC_STAGES:
+            self.stage_seconds[stage] += metrics.get(stage, 0.0)
+        self.recent.append((perf_counter(), metrics))
+
+
+    def snapshot(self):
+        now = perf_counter()
+        elapsed = now - self.start_time
+        # 窗口内的速率，窗口未满时从开始计时
+        since = self.recent[0][0] if len(self.recent) == self.recent.maxlen else self.start_time
+        span = max(now - since, 1e-9)
+        recent_count = len(self.recent) - 1 if since != self.start_time else len(self.recent)
+        recent_bytes = sum(metrics.get('bytes_in', 0) for _, metrics in self.recent)
+        images_per_s = recent_count / span
+
+        latency = {}
+        for stage in METRIC_STAGES:
+            values = [metrics[stage] for _, metrics in self.recent if stage in metrics]
+            if values:
+                p50, p95 = np.percentile(values, [50, 95])
+                latency[stage] = {'p50': float(p50), 'p95': float(p95)}
+
+        busiest = max(self.stage_seconds, key=self.stage_seconds.get)
+        eta = None
+        if self.total is not None and images_per_s > 0:
+            eta = max(self.total - self.count, 0) / images_per_s
+        return {
+            'count': self.count,
+            'total': self.total,
+            'cached': self.cached,
+            'deduplicated': self.deduplicated,
+            'elapsed': elapsed,
+            'images_per_s': images_per_s,
+            'mb_per_s': recent_bytes / 2 ** 20 / span,
+            'megapixels': self.pixels / 1e6,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'stage_seconds': dict(self.stage_seconds),
+            'latency': latency,
+            'busiest_stage': busiest if self.stage_seconds[busiest] > 0 else None,
+            'eta': eta,
+        }
+
+
+# 将每张图片的处理记录及统计快照逐行写入 JSON Lines 文件
+class MetricsLog:
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'w', encoding='utf-8')
+
+
+    def write_result(self, result):
+        event = {'type': 'image', 'path': result.path, 'status': result.status, 'cached': result.cached}
+        event.update(result.metrics or {})
+        self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+    def write_snapshot(self, snapshot):
+        self.file.write(json.dumps(dict(snapshot, type='snapshot'), ensure_ascii=False) + '\n')
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
 
 
 # 读取图片
-def file_read(folder_path):
+def file_read(folder_path, recursive=False, include=None, exclude=None, skip_folders=None):
+    return list(scan_images(folder_path, recursive, include, exclude, skip_folders))
+
+
+# 逐个产出文件夹中的图片路径，无需等待整个文件夹列举完毕
+# recursive 为 True 时包含子文件夹，include / exclude 为通配符列表，匹配相对于输入文件夹的路径
+# skip_folders 中的文件夹（如位于输入文件夹内的输出文件夹）不会被遍历
+def scan_images(folder_path, recursive=False, include=None, exclude=None, skip_folders=None):
+
+    skip_folders = {path.normcase(path.abspath(folder)) for folder in skip_folders or []}
+    folders = [(folder_path, '')]
+    while folders:
+        current, relative = folders.pop()
+        sub_folders = []
+        with scandir(current) as entries:
+            for entry in entries:
+                # 不跟随指向文件夹的符号链接，避免循环遍历
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and path.normcase(path.abspath(entry.path)) not in skip_folders:
+                        sub_folders.append((path.join(current + '/', entry.name), relative + entry.name + '/'))
+                    continue
+                # 检查文件是否为图片文件
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                    continue
+                if not path_selected(relative + entry.name, include, exclude):
+                    continue
+                yield path.join(current + '/', entry.name)
+        # 按字母顺序倒序压栈，使子文件夹按顺序处理
+        folders.extend(sorted(sub_folders, reverse=True))
+
+
+# 相对路径是否符合 include（任一匹配）且不符合 exclude 的通配符
+def path_selected(relative_path, include=None, exclude=None):
+    if include and not any(fnmatch(relative_path, pattern) for pattern in include):
+        return False
+    return not (exclude and any(fnmatch(relative_path, pattern) for pattern in exclude))
+
+
+# 按输出方式编码裁剪结果，返回 (后缀, 数据)，index 方式没有单独的输出文件，返回 None
+def encode_output(file_path, cropped_img, bbox, ini_size, output_options, metrics=None):
+
+    metrics = {} if metrics is None else metrics
+    if output_options.format == 'index':
+        return None
+
+    t = perf_counter()
+    futures = []
+    # 只写出边界框，由下游程序在读取时自行裁剪，省去编码开销
+    if output_options.format == 'sidecar':
+        data = json.dumps({'source': file_path, 'bbox': list(bbox), 'ini_size': list(ini_size)}, ensure_ascii=False).encode('utf-8')
+        ext = '.json'
+
+    else:
+        # 派生输出交给编码线程池，与主输出同时编码
+        futures = submit_derived(cropped_img, output_options)
+        # JPEG 输入保持 JPEG 输出
+        ext = '.jpg' if output_options.format == 'keep' and file_path.lower().endswith(('.jpg', '.jpeg')) else '.png'
+        data = encode_image(cropped_img, ext, output_options)
+
+    derived = collect_derived(futures)
+    metrics['encode'] = perf_counter() - t
+    return ext, data, derived
+
+
+# 是否需要生成派生输出，只写边界框（sidecar、index）时没有派生输出
+def has_derived(output_options):
+    return bool(output_options and output_options.derived and output_options.format in ('png', 'keep'))
+
+
+# 把各个派生输出交给编码线程池，返回 [(DerivedOutput, Future)]
+def submit_derived(img, output_options):
+    if not has_derived(output_options):
+        return []
+    return [(derived, encode_pool().submit(encode_derived, img, derived, output_options)) for derived in output_options.derived]
+
 
-    image_paths = []
-    for filename in listdir(folder_path):
-        # 检查文件是否为图片文件
-        if filename.endswith(('.png', '.PNG', '.jpg', '.JPG', '.jpeg', '.JPEG')):
-            image_paths.append(path.join(folder_path + '/', filename))
-    return image_paths
+# 等待派生输出编码完成，返回 [(文件名后缀, 文件后缀, 数据)]
+def collect_derived(futures):
+    return [(derived.suffix, '.' + derived.format, future.result()) for derived, future in futures]
 
 
-# 保存图片
-def file_save(cropped_img, output_path, temp_name):
+# 当前进程的编码线程池，首次使用时创建；fork 出的工作进程中不能沿用父进程的线程，重新创建
+def encode_pool():
+    global encode_executor, encode_executor_pid
+    if encode_executor is None or encode_executor_pid != getpid():
+        encode_executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS)
+        encode_executor_pid = getpid()
+    return encode_executor
+
+
+# 缩放、补边并编码一个派生输出
+def encode_derived(cropped_img, derived, output_options):
+    return encode_image(derive_image(cropped_img, derived), '.' + derived.format, output_options._replace(jpeg_quality=derived.quality))
+
+
+# 先按最长边缩小，再补边成正方形，补边比先补边后缩放需要处理的像素少
+def derive_image(img, derived):
+
+    row, col = img.shape[:2]
+    if derived.max_size and max(row, col) > derived.max_size:
+        scale = derived.max_size / max(row, col)
+        img = cv2.resize(img, (max(round(col * scale), 1), max(round(row * scale), 1)), interpolation=cv2.INTER_AREA)
+        row, col = img.shape[:2]
+
+    has_alpha = img.ndim == 3 and img.shape[2] == 4
+    if derived.square and row != col:
+        side = max(row, col)
+        top, left = (side - row) // 2, (side - col) // 2
+        # JPEG 会丢弃 α 通道，补白色
+        value = (0, 0, 0, 0) if has_alpha and derived.format != 'jpg' else (np.iinfo(img.dtype).max,) * 4
+        img = cv2.copyMakeBorder(img, top, side - row - top, left, side - col - left, cv2.BORDER_CONSTANT, value=value)
+
+    # JPEG 与 WebP 只支持 8 位
+    if img.dtype == np.uint16 and derived.format != 'png':
+        img = (img >> 8).astype(np.uint8)
+    return img
+
+
+# 按输出参数把图片编码为 PNG、JPEG 或 WebP，返回编码后的 uint8 数组
+def encode_image(img, ext, output_options, metrics=None):
+
+    t = perf_counter()
+    if ext == '.jpg':
+        # JPEG 无透明信息，丢弃 α 通道
+        if img.ndim == 3 and img.shape[2] == 4:
+            img = img[:, :, :3]
+        params = [cv2.IMWRITE_JPEG_QUALITY, output_options.jpeg_quality]
+    elif ext == '.webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, output_options.jpeg_quality]
+    else:
+        params = []
+        if output_options.png_compression is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, output_options.png_compression]
+        if output_options.png_strategy is not None:
+            params += [cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[output_options.png_strategy]]
+    data = cv2.imencode(ext=ext, img=img, params=params)[1]
+    if metrics is not None:
+        metrics['encode'] = perf_counter() - t
+    return data
+
+
+# 写出编码好的内容，返回输出文件路径
+def write_output(data, output_path, temp_name, ext, metrics=None):
+
+    metrics = {} if metrics is None else metrics
+    output_file = output_path + '/' + temp_name + ext
+    t = perf_counter()
+    with AtomicFile(output_file) as f:
+        f.write(data)
+    metrics['write'] = perf_counter() - t
+    metrics['bytes_out'] = len(data)
+    return output_file
+
+
+# 先写入同一文件夹中的临时文件，关闭时再改名为目标文件，读者只会看到完整的旧文件或新文件，出错时删除临时文件
+# 改名不会改写原文件的内容，因此与去重缓存共用硬链接的旧输出也不受影响
+class AtomicFile:
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.temp_path = f'{output_file}.{getpid()}.tmp'
+        self.file = None
+
+
+    def __enter__(self):
+        makedirs(path.dirname(self.output_file) or '.', exist_ok=True)
+        self.file = open(self.temp_path, 'wb')
+        return self.file
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        committed = False
+        try:
+            if exc_type is None:
+                if durability == 'file':
+                    self.file.flush()
+                    fsync(self.file.fileno())
+                self.file.close()
+                replace(self.temp_path, self.output_file)
+                committed = True
+        finally:
+            if not committed:
+                self.file.close()
+                try:
+                    remove(self.temp_path)
+                except OSError:
+                    pass
+        # 改名本身也要写入文件夹才算持久
+        if durability == 'file':
+            sync_path(path.dirname(self.output_file))
+        return False
+
+
+# fsync 一个文件或文件夹；Windows 不能打开文件夹，此时跳过
+def sync_path(file_path):
+    try:
+        fd = os_open(file_path or '.', O_RDONLY)
+    except OSError:
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os_close(fd)
+
+
+# batch 持久化方式：在主进程中收集已写出的文件，每 batch 个文件统一 fsync 文件及其所在的文件夹
+class OutputSync:
+
+    def __init__(self, batch=FSYNC_BATCH):
+        self.batch = batch
+        self.files = []
+
+
+    def add(self, result):
+        self.files += [output for output in [result.output] + list(result.derived or []) if output]
+        if len(self.files) >= self.batch:
+            self.flush()
+
+
+    def flush(self):
+        folders = set()
+        for file_path in self.files:
+            sync_path(file_path)
+            folders.add(path.dirname(file_path))
+        for folder in folders:
+            sync_path(folder)
+        self.files = []
+
+
+# 将所有图片的边界框汇总到一个 CSV 索引文件中，逐行写入，不在内存中积累
+class BboxIndex:
+
+    file_name = 'bbox_index.csv'
+    header = ['source', 'name', 'status', 'top', 'bottom', 'left', 'right', 'ini_height', 'ini_width']
+
+    def __init__(self, output_path):
+        self.file = open(output_path + '/' + self.file_name, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.header)
+
+
+    def add(self, result):
+        if result.status not in (STATUS_CROPPED, STATUS_NOT_CROPPED):
+            return
+        bbox = list(result.bbox) if result.bbox else ['', '', '', '']
+        size = list(result.ini_size[:2]) if len(result.ini_size) else ['', '']
+        self.writer.writerow([result.path, result.name, result.status] + bbox + size)
+
+
+    def close(self):
+        self.file.close()
+
+
+# 保存图片，返回输出文件路径，给出 metrics 字典时记录编码与写入的耗时
+def file_save(cropped_img, output_path, temp_name, ext='.png', params=None, metrics=None):
     
-    imencode(ext='.png', img=cropped_img)[1].tofile(output_path + '/' + temp_name + '.png')
+    metrics = {} if metrics is None else metrics
+    t = perf_counter()
+    encoded = cv2.imencode(ext=ext, img=cropped_img, params=params or [])[1]
+    metrics['encode'] = perf_counter() - t
+    return write_output(encoded, output_path, temp_name, ext, metrics)
 
 
-# 检查处理图片是否存在
-def file_exist(img_path):
+# 读取文件内容，文件不存在时返回 None
+# 较大的文件映射到内存而不复制，解码时直接读取系统缓存；prefetch 为 True 时提示系统提前读入
+def file_bytes(img_path, prefetch=False):
     try:
-        img_data = np.fromfile(file=img_path, dtype=np.uint8)
-        img = imdecode(img_data, IMREAD_UNCHANGED)
-        return img
+        with open(img_path, 'rb') as f:
+            if fstat(f.fileno()).st_size < MMAP_MIN_BYTES:
+                return np.fromfile(f, dtype=np.uint8)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     except FileNotFoundError:
-        return np.zeros((0, 0, 3), dtype=np.uint8)
\ No newline at end of file
+        return None
+    if prefetch and hasattr(mmap, 'MADV_WILLNEED'):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return np.frombuffer(mapped, dtype=np.uint8)
+
+
+# 检查处理图片是否存在
+def file_exist(img_path):
+    img_data = file_bytes(img_path)
+    if img_data is None:
+        return np.zeros((0, 0, 3), dtype=np.uint8)
+    return cv2.imdecode(img_data, cv2.IMREAD_UNCHANGED)
\ No newline at end of file
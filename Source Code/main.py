@@ -1,10 +1,13 @@
 from PyQt5.QtWidgets import QApplication
 from sys import exit, argv
+from multiprocessing import freeze_support
 from GUI_window import MainWindow
 
 
 if __name__ == '__main__':
 
+    # 打包后的程序需要支持多进程处理
+    freeze_support()
     app = QApplication(argv)
     window = MainWindow()
     window.show()
@@ -0,0 +1,69 @@
+import numpy as np
+
+# 可选的编译扫描后端：从四条边缘逐像素向内扫描，遇到内容即停止，不计算整图掩码
+# 未安装 numba 时 available() 返回 False，由 img_cropper 改用 NumPy 后端
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def available():
+    return njit is not None
+
+
+# 像素任一通道超出 [lower, upper] 即为内容
+def is_content(img, y, x, lower, upper):
+    for c in range(img.shape[2]):
+        value = img[y, x, c]
+        if value < lower[c] or value > upper[c]:
+            return True
+    return False
+
+
+def row_has_content(img, y, lower, upper):
+    for x in range(img.shape[1]):
+        if is_content(img, y, x, lower, upper):
+            return True
+    return False
+
+
+# 按行优先顺序访问内存：先找首尾内容行，再在内容行中逐行收紧左右边界
+# 每行只检查当前左边界以左、右边界以右的像素，左右边界到达图片边缘时提前结束
+def scan_bbox(img, lower, upper):
+    row, col = img.shape[0], img.shape[1]
+    top = 0
+    while top < row and not row_has_content(img, top, lower, upper):
+        top += 1
+    # 整张图都没有内容时不裁剪
+    if top == row:
+        return 0, row, 0, col
+    bottom = row
+    while not row_has_content(img, bottom - 1, lower, upper):
+        bottom -= 1
+
+    left, right = col, 0
+    for y in range(top, bottom):
+        for x in range(left):
+            if is_content(img, y, x, lower, upper):
+                left = x
+                break
+        for x in range(col - 1, max(right, left) - 1, -1):
+            if is_content(img, y, x, lower, upper):
+                right = x + 1
+                break
+        if left == 0 and right == col:
+            break
+    return top, bottom, left, right
+
+
+if njit is not None:
+    is_content = njit(cache=True, nogil=True)(is_content)
+    row_has_content = njit(cache=True, nogil=True)(row_has_content)
+    scan_bbox = njit(cache=True, nogil=True)(scan_bbox)
+
+
+# 由各通道的内容判定范围计算边界框 (top, bottom, left, right)
+def find_bbox(img, lower, upper):
+    top, bottom, left, right = scan_bbox(img, np.asarray(lower, dtype=np.int64), np.asarray(upper, dtype=np.int64))
+    return int(top), int(bottom), int(left), int(right)
@@ -0,0 +1,314 @@
+import struct
+import zlib
+import numpy as np
+
+# 逐条带解码与编码 PNG，每次只在内存中保留若干行，用于解码后放不进内存的超大图片
+# 解码结果的通道顺序与 OpenCV 的 IMREAD_UNCHANGED 一致：灰度为 1 通道，彩色为 BGR，带透明信息时为 BGRA
+# 仅支持非隔行扫描的 8 / 16 位图片及 8 位调色板图片，其余格式（包括以 tRNS 指定透明色的灰度与 RGB 图片，OpenCV 将其解码为 BGRA）
+# 抛出 UnsupportedPng，由调用方改为整图解码
+# Average 与 Paeth 滤波需逐像素还原，安装 numba 时逐行编译执行，否则整个条带按反对角线向量化还原，见 unfilter_block
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 每次从文件读取的压缩数据上限（字节）
+READ_CHUNK = 1 << 20
+# 写出的 IDAT 数据块大小（字节）
+IDAT_SIZE = 1 << 16
+# 编码时每次滤波的行数，滤波的中间结果为这些行大小的若干倍
+FILTER_ROWS = 16
+# 颜色类型 -> 每像素的样本数
+SAMPLES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+class UnsupportedPng(ValueError):
+    pass
+
+
+# 逐字节还原 Average（3）与 Paeth（4）滤波，line 与 prior 为当前行与上一行（已还原）
+def unfilter_line(filter_type, line, prior, bpp):
+    for i in range(len(line)):
+        a = int(line[i - bpp]) if i >= bpp else 0
+        b = int(prior[i])
+        if filter_type == 3:
+            line[i] = (int(line[i]) + (a + b) // 2) & 0xFF
+            continue
+        c = int(prior[i - bpp]) if i >= bpp else 0
+        pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+        if pa <= pb and pa <= pc:
+            predictor = a
+        elif pb <= pc:
+            predictor = b
+        else:
+            predictor = c
+        line[i] = (int(line[i]) + predictor) & 0xFF
+
+
+if njit is not None:
+    unfilter_line = njit(cache=True, nogil=True)(unfilter_line)
+
+
+# 以 NumPy 还原一块连续行的滤波：像素 (y, x) 只依赖左、上、左上三个像素，同一反对角线上的像素互不依赖，可一次计算
+# 第 r 行错开 r 个像素存放，使每条反对角线成为一列，循环次数为行数与宽度之和，而不是字节数
+# filter_types 与 lines 为各行的滤波类型与滤波后的字节，prior 为上一行（已还原），返回还原后的 uint8 数组
+def unfilter_block(filter_types, lines, prior, bpp):
+    count, stride = lines.shape
+    width = stride // bpp
+    # skewed[r, r + x + 1] 为第 r 行（第 0 行为 prior）的第 x 个像素，其余位置为 0，即图片以外的像素
+    skewed = np.zeros((count + 1, count + width + 1, bpp), dtype=np.int16)
+    raw = np.zeros((count + 1, count + width + 1, bpp), dtype=np.uint8)
+    skewed[0, 1:width + 1] = prior.reshape(width, bpp)
+    for r in range(1, count + 1):
+        raw[r, r + 1:r + width + 1] = lines[r - 1].reshape(width, bpp)
+    types = np.zeros((count + 1, 1), dtype=np.uint8)
+    types[1:, 0] = filter_types
+    # 整块只用一种滤波时（如 PngStripWriter 写出的全 Paeth 图片）不必逐类型选择
+    single = int(filter_types[0]) if (filter_types == filter_types[0]).all() else None
+
+    for k in range(2, count + width + 1):
+        lo, hi = max(1, k - width), min(count, k - 1) + 1
+        a = skewed[lo:hi, k - 1]
+        b = skewed[lo - 1:hi - 1, k - 1]
+        c = skewed[lo - 1:hi - 1, k - 2]
+        if single == 3:
+            predictor = (a + b) >> 1
+        else:
+            bc, ac = b - c, a - c
+            pa, pb, pc = np.abs(bc), np.abs(ac), np.abs(bc + ac)
+            predictor = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+            if single != 4:
+                f = types[lo:hi]
+                predictor = np.select([f == 1, f == 2, f == 3, f == 4], [a, b, (a + b) >> 1, predictor], 0)
+        raw_column = raw[lo:hi, k]
+        np.add(predictor, raw_column, out=predictor)
+        np.bitwise_and(predictor, 0xFF, out=skewed[lo:hi, k])
+
+    data = np.empty((count, stride), dtype=np.uint8)
+    for r in range(1, count + 1):
+        data[r - 1] = skewed[r, r + 1:r + width + 1].reshape(-1)
+    return data
+
+
+class PngStripReader:
+
+    # f 为从文件开头打开的二进制文件对象，读到第一个 IDAT 为止
+    def __init__(self, f):
+        self.f = f
+        if f.read(8) != PNG_SIGNATURE:
+            raise UnsupportedPng('not a PNG file')
+        self.palette = None
+        self.transparency = None
+        self.idat_left = 0
+        while True:
+            length, chunk_type = self.read_chunk_head()
+            if chunk_type == b'IDAT':
+                self.idat_left = length
+                break
+            data = f.read(length)
+            f.read(4)
+            if chunk_type == b'IHDR':
+                self.width, self.height, self.bit_depth, self.color_type, _, _, interlace = struct.unpack('>IIBBBBB', data)
+            elif chunk_type == b'PLTE':
+                self.palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            elif chunk_type == b'tRNS':
+                self.transparency = np.frombuffer(data, dtype=np.uint8)
+            elif chunk_type == b'IEND':
+                raise UnsupportedPng('PNG file without image data')
+
+        if interlace:
+            raise UnsupportedPng('interlaced PNG is not supported')
+        if self.color_type not in SAMPLES or self.bit_depth not in (8, 16) or (self.color_type == 3 and self.bit_depth != 8):
+            raise UnsupportedPng(f'PNG colour type {self.color_type} with bit depth {self.bit_depth} is not supported')
+        if self.color_type == 3 and self.palette is None:
+            raise UnsupportedPng('palette PNG without PLTE chunk')
+        if self.color_type in (0, 2) and self.transparency is not None:
+            raise UnsupportedPng('grey or RGB PNG with a tRNS colour key is not supported')
+
+        self.bpp = SAMPLES[self.color_type] * self.bit_depth // 8
+        self.stride = self.width * self.bpp
+        self.dtype = np.uint16 if self.bit_depth == 16 else np.uint8
+        if self.color_type == 0:
+            self.channels = 1
+        elif self.color_type == 2 or (self.color_type == 3 and self.transparency is None):
+            self.channels = 3
+        else:
+            self.channels = 4
+        # 调色板索引 -> BGR(A)
+        if self.color_type == 3:
+            table = np.full((256, 4), 255, dtype=np.uint8)
+            table[:len(self.palette), :3] = self.palette[:, ::-1]
+            if self.transparency is not None:
+                table[:len(self.transparency), 3] = self.transparency
+            self.table = table[:, :self.channels]
+        self.inflater = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.prior = np.zeros(self.stride, dtype=np.uint8)
+
+
+    def read_chunk_head(self):
+        head = self.f.read(8)
+        if len(head) < 8:
+            raise ValueError('truncated PNG file')
+        return struct.unpack('>I', head[:4])[0], head[4:]
+
+
+    @property
+    def shape(self):
+        return self.height, self.width, self.channels
+
+
+    # 读出 size 字节解压后的数据，每次解压的输出不超过所需的大小
+    def read_raw(self, size):
+        while len(self.buffer) < size:
+            wanted = size - len(self.buffer)
+            if self.inflater.unconsumed_tail:
+                self.buffer += self.inflater.decompress(self.inflater.unconsumed_tail, wanted)
+                continue
+            if self.inflater.eof:
+                raise ValueError('PNG image data ends early')
+            # 当前 IDAT 读完后跳过 CRC，读取下一个 IDAT
+            while self.idat_left == 0:
+                self.f.read(4)
+                length, chunk_type = self.read_chunk_head()
+                if chunk_type != b'IDAT':
+                    raise ValueError('PNG image data ends early')
+                self.idat_left = length
+            data = self.f.read(min(self.idat_left, READ_CHUNK))
+            if not data:
+                raise ValueError('truncated PNG file')
+            self.idat_left -= len(data)
+            self.buffer += self.inflater.decompress(data, wanted)
+        raw = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return raw
+
+
+    # 读出并还原 count 行；未安装 numba 且其中有 Average 或 Paeth 滤波时整块向量化还原，否则逐行还原
+    def read_lines(self, count):
+        raw = np.frombuffer(self.read_raw(count * (self.stride + 1)), dtype=np.uint8).reshape(count, self.stride + 1)
+        filter_types = raw[:, 0]
+        if filter_types.max() > 4:
+            raise ValueError(f'invalid PNG filter type {filter_types.max()}')
+        if njit is None and ((filter_types == 3) | (filter_types == 4)).any():
+            data = unfilter_block(filter_types, raw[:, 1:], self.prior, self.bpp)
+            self.prior = data[-1]
+            return data
+        data = np.empty((count, self.stride), dtype=np.uint8)
+        for i in range(count):
+            data[i] = self.unfilter(filter_types[i], raw[i, 1:])
+        return data
+
+
+    # 还原一行的滤波，返回该行的字节
+    def unfilter(self, filter_type, line):
+        if filter_type == 0:
+            line = line.copy()
+        elif filter_type == 1:
+            # Sub 滤波按像素累加，uint8 累加自动按 256 取模
+            line = np.cumsum(line.reshape(-1, self.bpp), axis=0, dtype=np.uint8).ravel()
+        elif filter_type == 2:
+            line = line + self.prior
+        else:
+            line = line.copy()
+            unfilter_line(filter_type, line, self.prior, self.bpp)
+        self.prior = line
+        return line
+
+
+    # 逐条带产出 (起始行, 条带)，条带形状为 (行数, 宽, 通道数)；stop 为读到的行数上限
+    def strips(self, rows, stop=None):
+        stop = self.height if stop is None else min(stop, self.height)
+        for y in range(0, stop, rows):
+            yield y, self.to_pixels(self.read_lines(min(rows, stop - y)))
+
+
+    # 把 PNG 的样本排列转换为 OpenCV 的通道顺序
+    def to_pixels(self, data):
+        count = data.shape[0]
+        if self.bit_depth == 16:
+            data = data.view('>u2').astype(np.uint16)
+        samples = data.reshape(count, self.width, -1)
+        if self.color_type == 3:
+            return self.table[samples[..., 0]]
+        if self.color_type == 0:
+            return samples
+        if self.color_type == 4:
+            return samples[..., [0, 0, 0, 1]]
+        if self.color_type == 2:
+            return samples[..., ::-1]
+        return samples[..., [2, 1, 0, 3]]
+
+
+class PngStripWriter:
+
+    # 写出 PNG 文件头，之后由 write_strip 逐条带写入 OpenCV 通道顺序的像素
+    # 压缩级别与策略的默认值与 OpenCV 相同
+    def __init__(self, f, width, height, channels, dtype, compression=None, strategy=None):
+        self.f = f
+        self.channels = channels
+        self.big_endian = np.dtype(dtype).itemsize == 2
+        bit_depth = 16 if self.big_endian else 8
+        color_type = {1: 0, 3: 2, 4: 6}[channels]
+        self.bpp = channels * bit_depth // 8
+        self.prior = np.zeros(width * self.bpp, dtype=np.int16)
+        self.deflater = zlib.compressobj(1 if compression is None else compression, zlib.DEFLATED, 15, 9,
+                                         zlib.Z_RLE if strategy is None else strategy)
+        self.pending = bytearray()
+        self.bytes_out = 0
+        f.write(PNG_SIGNATURE)
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0))
+
+
+    def write_chunk(self, chunk_type, data):
+        self.f.write(struct.pack('>I', len(data)))
+        self.f.write(chunk_type)
+        self.f.write(data)
+        self.f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+        self.bytes_out += len(data) + 12
+
+
+    def flush_idat(self, final=False):
+        while len(self.pending) >= IDAT_SIZE or (final and self.pending):
+            self.write_chunk(b'IDAT', bytes(self.pending[:IDAT_SIZE]))
+            del self.pending[:IDAT_SIZE]
+
+
+    def write_strip(self, strip):
+        for start in range(0, strip.shape[0], FILTER_ROWS):
+            self.write_lines(strip[start:start + FILTER_ROWS])
+        self.flush_idat()
+
+
+    # 每行使用 Paeth 滤波，若干行一次向量化计算
+    def write_lines(self, strip):
+        if self.channels == 3:
+            strip = strip[..., ::-1]
+        elif self.channels == 4:
+            strip = strip[..., [2, 1, 0, 3]]
+        if self.big_endian:
+            strip = strip.astype('>u2')
+        lines = np.ascontiguousarray(strip).view(np.uint8).reshape(strip.shape[0], -1).astype(np.int16)
+
+        up = np.vstack([self.prior[np.newaxis], lines[:-1]])
+        left = np.zeros_like(lines)
+        left[:, self.bpp:] = lines[:, :-self.bpp]
+        up_left = np.zeros_like(lines)
+        up_left[:, self.bpp:] = up[:, :-self.bpp]
+        pa = np.abs(up - up_left)
+        pb = np.abs(left - up_left)
+        pc = np.abs(left + up - 2 * up_left)
+        predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+        filtered = np.empty((lines.shape[0], lines.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 4
+        filtered[:, 1:] = (lines - predictor) & 0xFF
+        self.prior = lines[-1]
+
+        self.pending += self.deflater.compress(filtered.tobytes())
+
+
+    def close(self):
+        self.pending += self.deflater.flush()
+        self.flush_idat(final=True)
+        self.write_chunk(b'IEND', b'')
@@ -0,0 +1,438 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, quote
+import numpy as np
+import cv2
+import img_cropper
+
+
+# 常驻服务：通过本地 HTTP 端口或 Unix 套接字接收图片内容或路径，返回裁剪后的 PNG 或边界框
+# POST /crop?mode=alpha|white&reply=png|bbox[&path=...]，不给 path 时请求体即为图片文件内容
+# GET /health 返回服务状态
+DEFAULT_PORT = 8765
+# 请求体大小上限（字节）
+MAX_BODY = 512 * 2 ** 20
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+# 解析命令行参数
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Keep the cropper loaded and crop images sent over a local socket.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='run the service until interrupted')
+    add_address_args(serve)
+    serve.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    serve.add_argument('--batch-size', type=int, default=8, help='maximum number of requests sent to a worker at once')
+    serve.add_argument('--batch-delay', type=float, default=0, metavar='MS', help='time to wait for more requests before sending a batch')
+    serve.add_argument('--max-pending', type=int, default=256, help='requests queued or in progress beyond which new ones are refused with 503')
+    serve.add_argument('--no-paths', action='store_true', help='refuse requests that name a file instead of sending its content')
+
+    crop = commands.add_parser('crop', help='send one image to a running service')
+    add_address_args(crop)
+    crop.add_argument('image', help='image file to crop')
+    crop.add_argument('-m', '--mode', choices=['alpha', 'white'], default='alpha', help='crop transparent (alpha) or white edges')
+    crop.add_argument('--bbox', action='store_true', help='only ask for the bounding box')
+    crop.add_argument('--send-path', action='store_true', help='send the file path instead of the file content')
+    crop.add_argument('-o', '--output', default='', help='file to save the cropped PNG to')
+
+    selftest = commands.add_parser('selftest', help='start a service in-process and check it against img_cropper over loopback')
+    selftest.add_argument('folder', help='folder of images to send')
+    selftest.add_argument('--socket', default='', help='test over this Unix socket instead of a TCP port')
+    selftest.add_argument('-w', '--workers', type=int, default=2, help='number of worker processes')
+    selftest.add_argument('-c', '--clients', type=int, default=8, help='number of concurrent client connections')
+    return parser.parse_args(argv)
+
+
+def add_address_args(parser):
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on or connect to')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port')
+    parser.add_argument('--socket', default='', help='Unix socket path, used instead of the TCP port')
+
+
+# 在工作进程中处理一批请求，每项为 (source, is_path, is_alpha, reply)，逐项返回 (状态码, 内容类型, 内容, 附加响应头)
+def crop_requests(items):
+    return [crop_request(*item) for item in items]
+
+
+def crop_request(source, is_path, is_alpha, reply):
+    try:
+        img_data = img_cropper.file_bytes(source) if is_path else source
+        if img_data is None:
+            return json_reply(404, {'error': 'file not found'})
+        if len(img_data) == 0:
+            return json_reply(422, {'error': 'empty image'})
+        if reply == 'bbox':
+            _, ini_size, cropped_size, bbox = img_cropper.crop_buffer(img_data, is_alpha)
+        else:
+            data, _, bbox, ini_size, cropped_size = img_cropper.crop_bytes(img_data, is_alpha)
+    except img_cropper.DecodeError as e:
+        return json_reply(422, {'error': str(e)})
+    except Exception as e:
+        return json_reply(500, {'error': repr(e)})
+
+    status = img_cropper.STATUS_NOT_CROPPED if cropped_size == ini_size else img_cropper.STATUS_CROPPED
+    headers = {'X-Crop-Status': status, 'X-Crop-Bbox': ','.join(str(value) for value in bbox)}
+    if reply == 'bbox':
+        return json_reply(200, {'status': status, 'bbox': list(bbox), 'ini_size': list(ini_size), 'cropped_size': list(cropped_size)}, headers)
+    # 未裁剪的 PNG 由 crop_bytes 原样返回，不重新编码
+    return 200, 'image/png', bytes(data), headers
+
+
+def json_reply(code, content, headers=None):
+    return code, 'application/json', json.dumps(content, ensure_ascii=False).encode('utf-8'), headers or {}
+
+
+class CropService:
+
+    def __init__(self, workers=1, batch_size=8, batch_delay=0, max_pending=256, allow_paths=True):
+        self.workers = workers
+        self.batch_size = max(batch_size, 1)
+        self.batch_delay = batch_delay / 1000
+        self.max_pending = max_pending
+        self.allow_paths = allow_paths
+        self.pending = 0
+        self.served = 0
+        self.queue = None
+        self.slots = None
+        self.executor = None
+        self.dispatcher = None
+        self.connections = set()
+
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT, socket_path=''):
+        self.queue = asyncio.Queue()
+        # 同时交给工作进程的批次数上限，其余请求在队列中等待并合并成更大的批次
+        self.slots = asyncio.Semaphore(self.workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else ThreadPoolExecutor(max_workers=1)
+        self.dispatcher = asyncio.ensure_future(self.dispatch())
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            return await asyncio.start_unix_server(self.handle, path=socket_path)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+    async def stop(self):
+        # 关闭空闲的长连接，等待其处理协程正常退出
+        for writer in list(self.connections):
+            writer.close()
+        for _ in range(100):
+            if not self.connections:
+                break
+            await asyncio.sleep(0.01)
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+
+    # 从队列中取出请求，凑成批次后交给工作进程
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await self.slots.acquire()
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.run_in_executor(self.executor, crop_requests, [item for item, _ in batch])
+            task.add_done_callback(lambda task, batch=batch: self.finish(batch, task))
+
+
+    def finish(self, batch, task):
+        self.slots.release()
+        try:
+            replies = task.result()
+        except Exception as e:
+            replies = [json_reply(500, {'error': repr(e)})] * len(batch)
+        for (_, future), reply in zip(batch, replies):
+            # 客户端已断开的请求直接丢弃结果
+            if not future.done():
+                future.set_result(reply)
+
+
+    async def submit(self, item):
+        if self.pending >= self.max_pending:
+            return json_reply(503, {'error': 'too many pending requests'})
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((item, future))
+            reply = await future
+            self.served += 1
+            return reply
+        finally:
+            self.pending -= 1
+
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/health':
+            return json_reply(200, {'status': 'ok', 'workers': self.workers, 'pending': self.pending, 'served': self.served})
+        if url.path != '/crop':
+            return json_reply(404, {'error': f'unknown path {url.path}'})
+        if method != 'POST':
+            return json_reply(405, {'error': 'use POST'})
+
+        mode = query.get('mode', 'alpha')
+        reply = query.get('reply', 'png')
+        if mode not in ('alpha', 'white') or reply not in ('png', 'bbox'):
+            return json_reply(400, {'error': 'mode must be alpha or white, reply must be png or bbox'})
+        if 'path' in query:
+            if not self.allow_paths:
+                return json_reply(400, {'error': 'paths are not accepted by this service'})
+            return await self.submit((query['path'], True, mode == 'alpha', reply))
+        if not body:
+            return json_reply(400, {'error': 'send the image as the request body or give a path'})
+        return await self.submit((body, False, mode == 'alpha', reply))
+
+
+    # 处理一个连接上的多个请求（HTTP/1.1 keep-alive）
+    async def handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as e:
+                    # 请求格式有误时无法确定下一个请求的起点，回复后关闭连接
+                    request, keep_alive = None, False
+                    code, content_type, content, headers = e.reply
+                else:
+                    if request is None:
+                        break
+                    method, target, request_headers, body = request
+                    code, content_type, content, headers = await self.route(method, target, body)
+                    keep_alive = request_headers.get('connection', '').lower() != 'close'
+                write_response(writer, code, content_type, content, headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+
+class BadRequest(Exception):
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.reply = json_reply(code, {'error': message})
+
+
+# 读取一个 HTTP 请求，连接关闭时返回 None，请求有误时抛出 BadRequest
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise BadRequest(400, 'malformed request line')
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest(400, 'invalid Content-Length')
+    if length > MAX_BODY:
+        raise BadRequest(413, f'request body larger than {MAX_BODY} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def write_response(writer, code, content_type, content, headers, keep_alive):
+    lines = [f'HTTP/1.1 {code} {REASONS.get(code, "")}', f'Content-Type: {content_type}', f'Content-Length: {len(content)}',
+             'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    writer.write(content)
+
+
+async def serve(args):
+    service = CropService(args.workers, args.batch_size, args.batch_delay, args.max_pending, not args.no_paths)
+    server = await service.start(args.host, args.port, args.socket)
+    address = args.socket or f'http://{args.host}:{args.port}'
+    print(f'- Serving on {address} with {args.workers} workers', file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+# 通过 Unix 套接字发送 HTTP 请求
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def connect(host='127.0.0.1', port=DEFAULT_PORT, socket_path='', timeout=60):
+    if socket_path:
+        return UnixHTTPConnection(socket_path, timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+# 客户端：发送图片内容（data）或路径（img_path），返回 (状态码, 响应头, 内容)
+def request_crop(conn, data=None, img_path='', is_alpha=True, reply='png'):
+    query = f'mode={"alpha" if is_alpha else "white"}&reply={reply}'
+    if img_path:
+        query += '&path=' + quote(img_path, safe='')
+    conn.request('POST', '/crop?' + query, body=data or b'')
+    response = conn.getresponse()
+    return response.status, dict(response.getheaders()), response.read()
+
+
+def crop_command(args):
+    conn = connect(args.host, args.port, args.socket)
+    is_alpha = args.mode == 'alpha'
+    reply = 'bbox' if args.bbox else 'png'
+    if args.send_path:
+        code, headers, content = request_crop(conn, img_path=os.path.abspath(args.image), is_alpha=is_alpha, reply=reply)
+    else:
+        with open(args.image, 'rb') as f:
+            code, headers, content = request_crop(conn, f.read(), is_alpha=is_alpha, reply=reply)
+    conn.close()
+
+    if code != 200 or args.bbox or not args.output:
+        print(content.decode('utf-8') if headers.get('Content-Type') == 'application/json'
+              else json.dumps({'status': headers.get('X-Crop-Status'), 'bbox': headers.get('X-Crop-Bbox')}))
+    if code == 200 and args.output and not args.bbox:
+        with open(args.output, 'wb') as f:
+            f.write(content)
+    return 0 if code == 200 else 1
+
+
+# 在后台线程中启动服务，多个客户端并发发送文件夹中的图片，与直接调用 img_cropper 的结果比较
+def selftest(args):
+    file_paths = img_cropper.file_read(args.folder)
+    if not file_paths:
+        print(f'No images in [{args.folder}]', file=sys.stderr)
+        return 2
+
+    service = CropService(args.workers)
+    started = threading.Event()
+    address = {}
+
+    async def run_server():
+        server = await service.start('127.0.0.1', 0, args.socket)
+        if not args.socket:
+            address['port'] = server.sockets[0].getsockname()[1]
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        address['stop'] = lambda: loop.call_soon_threadsafe(stopping.set)
+        started.set()
+        await stopping.wait()
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+
+    server_thread = threading.Thread(target=asyncio.run, args=(run_server(),))
+    server_thread.start()
+    started.wait()
+
+    mismatches = []
+    lock = threading.Lock()
+    jobs = [(file_path, is_alpha, reply, send_path) for file_path in file_paths
+            for is_alpha in (True, False) for reply in ('png', 'bbox') for send_path in (False, True)]
+
+    def client(jobs):
+        conn = connect(port=address.get('port', 0), socket_path=args.socket)
+        for file_path, is_alpha, reply, send_path in jobs:
+            if send_path:
+                code, headers, content = request_crop(conn, img_path=os.path.abspath(file_path), is_alpha=is_alpha, reply=reply)
+            else:
+                with open(file_path, 'rb') as f:
+                    code, headers, content = request_crop(conn, f.read(), is_alpha=is_alpha, reply=reply)
+            cropped_img, ini_size, cropped_size, bbox = img_cropper.crop_image(file_path, is_alpha)
+            expected = ','.join(str(value) for value in bbox)
+            ok = code == 200 and headers.get('X-Crop-Bbox') == expected
+            if ok and reply == 'png':
+                decoded = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+                ok = decoded is not None and np.array_equal(decoded, cropped_img)
+            if not ok:
+                with lock:
+                    mismatches.append({'path': file_path, 'mode': 'alpha' if is_alpha else 'white', 'reply': reply,
+                                       'send_path': send_path, 'code': code, 'bbox': headers.get('X-Crop-Bbox'), 'expected': expected})
+        conn.close()
+
+    t = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(jobs[i::args.clients],)) for i in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - t
+
+    conn = connect(port=address.get('port', 0), socket_path=args.socket)
+    conn.request('GET', '/health')
+    health = json.loads(conn.getresponse().read())
+    conn.close()
+    address['stop']()
+    server_thread.join()
+
+    print(json.dumps({'requests': len(jobs), 'seconds': round(seconds, 3), 'requests_per_s': round(len(jobs) / seconds, 1),
+                      'served': health['served'], 'mismatches': mismatches}, ensure_ascii=False))
+    return 1 if mismatches else 0
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    if getattr(args, 'socket', '') and not hasattr(socket, 'AF_UNIX'):
+        print('Unix sockets are not supported on this platform', file=sys.stderr)
+        return 2
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.command == 'crop':
+        return crop_command(args)
+    return selftest(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,384 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import img_cropper
+import cli
+
+
+# 多机分片处理：待处理的图片记录在共享文件夹中的 SQLite 数据库里，各机器上的进程以租约方式领取
+# 租约到期仍未完成（进程崩溃或机器掉线）的图片可被其他进程重新领取，超过 max_attempts 次后记为失败
+# 数据库使用默认的回滚日志而非 WAL，WAL 需要共享内存，不能用于网络文件系统
+STATE_PENDING = 'pending'
+STATE_LEASED = 'leased'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+# 解析命令行参数
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Share a cropping batch between several processes or hosts through a queue on a shared folder.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init = commands.add_parser('init', help='add the images of a folder to a queue')
+    init.add_argument('queue', help='queue database file, on a folder every worker can reach')
+    init.add_argument('input', help='folder containing the images to process')
+    init.add_argument('-o', '--output', default='', help='output folder the workers will write to; skipped when scanning and used when work has no --output')
+    init.add_argument('-r', '--recursive', action='store_true', help='also add images in subfolders')
+    init.add_argument('--mirror', action='store_true', help='with --recursive, recreate the subfolders in the output folder instead of prefixing names with them')
+    init.add_argument('--include', action='append', default=None, metavar='PATTERN', help='only add paths matching this glob, can be repeated')
+    init.add_argument('--exclude', action='append', default=None, metavar='PATTERN', help='skip paths matching this glob, can be repeated')
+    # 裁剪模式、容差与输出选项随队列保存，所有工作进程使用同一组设置
+    cli.add_crop_arguments(init)
+
+    work = commands.add_parser('work', help='claim and process images until the queue is finished')
+    work.add_argument('queue', help='queue database file')
+    work.add_argument('-o', '--output', default='', help='output folder shared by all workers, defaults to the one given to init')
+    work.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes on this host')
+    work.add_argument('--lease', type=float, default=300, metavar='SECONDS', help='lease length; leases are renewed while the images are being processed')
+    work.add_argument('--max-attempts', type=int, default=3, help='times an image is handed out before it is marked failed')
+    work.add_argument('--no-wait', action='store_true', help='exit when nothing can be claimed instead of waiting for leases held by others')
+
+    report = commands.add_parser('report', help='print the aggregated results as JSON')
+    report.add_argument('queue', help='queue database file')
+    report.add_argument('--errors', type=int, default=100, help='maximum number of errors listed')
+
+    selftest = commands.add_parser('selftest', help='run several local workers plus a simulated crashed one and check the results')
+    selftest.add_argument('input', help='folder containing the images to process')
+    selftest.add_argument('-n', '--processes', type=int, default=3, help='number of worker processes')
+    return parser.parse_args(argv)
+
+
+class WorkQueue:
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # 其他进程持有写锁时最多等待 60 秒
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+
+    def close(self):
+        self.conn.close()
+
+
+    # 队列的设置，如输入文件夹，由 init 写入、各工作进程读取
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+
+    def set_meta(self, key, value):
+        self.transaction(lambda conn: conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value))))
+
+
+    # 写事务立即加锁，避免两个进程领取到同一批图片
+    def transaction(self, statements):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            value = statements(self.conn)
+            self.conn.execute('COMMIT')
+            return value
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+
+    def enqueue(self, file_paths, chunk=1000):
+        added = 0
+        batch = []
+        for file_path in file_paths:
+            batch.append((os.path.abspath(file_path), time.time()))
+            if len(batch) >= chunk:
+                added += self.transaction(lambda conn: conn.executemany(
+                    'INSERT OR IGNORE INTO items (path, updated) VALUES (?, ?)', batch).rowcount)
+                batch = []
+        if batch:
+            added += self.transaction(lambda conn: conn.executemany(
+                'INSERT OR IGNORE INTO items (path, updated) VALUES (?, ?)', batch).rowcount)
+        return added
+
+
+    # 领取至多 count 张待处理或租约已过期的图片，返回 [(id, 路径)]
+    def claim(self, owner, count):
+
+        def statements(conn):
+            now = time.time()
+            # 已被领取 max_attempts 次仍未完成的图片记为失败
+            conn.execute('UPDATE items SET state = ?, result = ?, updated = ? WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                         (STATE_FAILED, json.dumps({'error': 'lease expired too many times'}), now, STATE_LEASED, now, self.max_attempts))
+            rows = conn.execute('SELECT id, path FROM items WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY id LIMIT ?',
+                                (STATE_PENDING, STATE_LEASED, now, count)).fetchall()
+            conn.executemany('UPDATE items SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+                             [(STATE_LEASED, owner, now + self.lease_seconds, now, item_id) for item_id, _ in rows])
+            return rows
+
+        return self.transaction(statements)
+
+
+    # 延长本进程持有的全部租约
+    def renew(self, owner):
+        self.transaction(lambda conn: conn.execute('UPDATE items SET lease_until = ? WHERE state = ? AND owner = ?',
+                                                   (time.time() + self.lease_seconds, STATE_LEASED, owner)))
+
+
+    # 记录结果；租约已被其他进程接手时丢弃
+    def complete(self, owner, item_id, result):
+        state = STATE_FAILED if result.status == img_cropper.STATUS_ERROR else STATE_DONE
+        content = json.dumps({'name': result.name, 'status': result.status, 'ini_size': list(result.ini_size),
+                              'cropped_size': list(result.cropped_size), 'bbox': list(result.bbox) if result.bbox else None,
+                              'output': result.output, 'error': result.error, 'owner': owner,
+                              'seconds': sum(value for key, value in (result.metrics or {}).items() if key in img_cropper.METRIC_STAGES)},
+                             ensure_ascii=False)
+        self.transaction(lambda conn: conn.execute('UPDATE items SET state = ?, result = ?, updated = ? WHERE id = ? AND owner = ? AND state = ?',
+                                                   (state, content, time.time(), item_id, owner, STATE_LEASED)))
+
+
+    # 各状态的图片数，leased 中另计租约仍有效的数量
+    def counts(self):
+        now = time.time()
+        counts = dict.fromkeys((STATE_PENDING, STATE_LEASED, STATE_DONE, STATE_FAILED), 0)
+        for state, count in self.conn.execute('SELECT state, COUNT(*) FROM items GROUP BY state'):
+            counts[state] = count
+        counts['active_leases'] = self.conn.execute('SELECT COUNT(*) FROM items WHERE state = ? AND lease_until >= ?',
+                                                    (STATE_LEASED, now)).fetchone()[0]
+        return counts
+
+
+    # 汇总所有进程的结果
+    def report(self, max_errors=100):
+        report = {'queue': self.db_path, 'total': 0, 'states': self.counts(), 'statuses': {}, 'owners': {}, 'errors': [],
+                  'retried': 0, 'seconds': 0}
+        first, last = None, None
+        for path, state, attempts, result, updated in self.conn.execute('SELECT path, state, attempts, result, updated FROM items ORDER BY id'):
+            report['total'] += 1
+            report['retried'] += attempts > 1
+            if result is None:
+                continue
+            result = json.loads(result)
+            status = result.get('status') or state
+            report['statuses'][status] = report['statuses'].get(status, 0) + 1
+            owner = result.get('owner')
+            if owner:
+                report['owners'][owner] = report['owners'].get(owner, 0) + 1
+                report['seconds'] += result.get('seconds', 0)
+            if state == STATE_FAILED and len(report['errors']) < max_errors:
+                report['errors'].append({'path': path, 'error': result.get('error'), 'owner': owner, 'attempts': attempts})
+            first = updated if first is None else min(first, updated)
+            last = updated if last is None else max(last, updated)
+        report['seconds'] = round(report['seconds'], 3)
+        report['span'] = round(last - first, 3) if first is not None else 0
+        return report
+
+
+# 后台线程定期续租，图片处理时间超过租约长度也不会被其他进程抢走
+class LeaseKeeper(threading.Thread):
+
+    def __init__(self, db_path, owner, lease_seconds):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+
+    def run(self):
+        # SQLite 连接不能跨线程使用，单独打开一个
+        queue = WorkQueue(self.db_path, self.lease_seconds)
+        while not self.stopped.wait(self.lease_seconds / 3):
+            queue.renew(self.owner)
+        queue.close()
+
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# 由 init 时存入队列的 crop_params 还原裁剪模式、输出选项与容差，未存入时使用默认设置
+def read_crop_params(params):
+    params = params or img_cropper.crop_params(True)
+    output = dict(params['output'], derived=tuple(img_cropper.DerivedOutput(*derived) for derived in params['output']['derived']))
+    tolerance = dict(params['tolerance'], background=tuple(params['tolerance']['background']))
+    return params['mode'] == 'alpha', img_cropper.OutputOptions(**output), img_cropper.Tolerance(**tolerance)
+
+
+# 不断领取并处理图片，直到队列中没有待处理的图片且没有其他进程持有有效租约
+# 产出每张图片的 CropResult
+def run_worker(db_path, output_path, workers=1, lease_seconds=300, max_attempts=3, wait_for_others=True, owner=None):
+
+    owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+    queue = WorkQueue(db_path, lease_seconds, max_attempts)
+    # 与 init 时的输入文件夹一致地命名，不同子文件夹中的同名图片不会互相覆盖
+    input_root = queue.get_meta('input_root')
+    if input_root:
+        img_cropper.set_output_layout(input_root, queue.get_meta('mirror', False))
+    is_alpha, output_options, tolerance = read_crop_params(queue.get_meta('params'))
+    os.makedirs(output_path, exist_ok=True)
+    keeper = LeaseKeeper(db_path, owner, lease_seconds)
+    keeper.start()
+    try:
+        while True:
+            ids = []
+
+            # process_batch 需要新图片时才领取，每次领取的数量与进程数相同
+            def claimed_paths():
+                while True:
+                    rows = queue.claim(owner, max(workers, 1))
+                    if not rows:
+                        return
+                    for item_id, file_path in rows:
+                        ids.append(item_id)
+                        yield file_path
+
+            for index, result in img_cropper.process_batch(claimed_paths(), output_path, is_alpha, workers=workers,
+                                                               output_options=output_options, tolerance=tolerance):
+                queue.complete(owner, ids[index], result)
+                yield result
+
+            counts = queue.counts()
+            if counts[STATE_PENDING] == 0 and counts[STATE_LEASED] == 0:
+                break
+            if not wait_for_others:
+                break
+            # 其他进程仍持有租约，等待其完成或租约过期后接手
+            time.sleep(min(lease_seconds / 3, 5))
+    finally:
+        keeper.stop()
+        queue.close()
+
+
+# 本机启动多个工作进程，并模拟一个领取图片后崩溃的进程，检查结果是否完整且与单进程一致
+def selftest(args):
+
+    file_paths = img_cropper.file_read(args.input)
+    if not file_paths:
+        print(f'No images in [{args.input}]', file=sys.stderr)
+        return 2
+    work_path = tempfile.mkdtemp(prefix='cropper_shard_')
+    try:
+        db_path = work_path + '/queue.db'
+        output_path = work_path + '/output'
+        lease = 2
+        queue = WorkQueue(db_path, lease)
+        queue.enqueue(file_paths)
+        # 领取后不处理，租约过期后应由其他进程接手
+        crashed = queue.claim('crashed-host:0', max(len(file_paths) // 4, 1))
+
+        t = time.perf_counter()
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'work', db_path, '-o', output_path,
+                                       '-w', '1', '--lease', str(lease)], stdout=subprocess.DEVNULL)
+                     for _ in range(args.processes)]
+        codes = [process.wait() for process in processes]
+        seconds = time.perf_counter() - t
+
+        report = queue.report()
+        mismatches = []
+        for file_path in file_paths:
+            row = queue.conn.execute('SELECT state, result FROM items WHERE path = ?', (os.path.abspath(file_path),)).fetchone()
+            result = json.loads(row[1]) if row[1] else {}
+            _, ini_size, cropped_size, bbox = img_cropper.crop_image(file_path, True)
+            expected = list(bbox) if ini_size != cropped_size else None
+            got = result.get('bbox') if result.get('status') == img_cropper.STATUS_CROPPED else None
+            if row[0] != STATE_DONE or got != expected:
+                mismatches.append({'path': file_path, 'state': row[0], 'bbox': got, 'expected': expected})
+        queue.close()
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    print(json.dumps({'images': len(file_paths), 'processes': args.processes, 'crashed_claims': len(crashed), 'exit_codes': codes,
+                      'seconds': round(seconds, 3), 'owners': report['owners'], 'retried': report['retried'],
+                      'mismatches': mismatches}, ensure_ascii=False))
+    return 1 if mismatches or any(codes) else 0
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    if args.command == 'init':
+        if not os.path.isdir(args.input):
+            print(f'Input folder [{args.input}] does not exist', file=sys.stderr)
+            return 2
+        queue = WorkQueue(args.queue)
+        # 输出名由相对输入文件夹的路径决定，同一队列只能对应一个输入文件夹
+        input_root = os.path.abspath(args.input)
+        if queue.get_meta('input_root', input_root) != input_root:
+            print(f'Queue [{args.queue}] already holds images of [{queue.get_meta("input_root")}]', file=sys.stderr)
+            queue.close()
+            return 2
+        if args.format == 'index':
+            print('The queue already records every bbox, use --format sidecar or shard.py report instead of index', file=sys.stderr)
+            queue.close()
+            return 2
+        # 再次 init 向队列添加图片时设置须相同，否则已处理与新加入的图片结果不一致
+        params = json.loads(json.dumps(img_cropper.crop_params(*cli.crop_settings(args))))
+        if queue.get_meta('params', params) != params:
+            print(f'Queue [{args.queue}] was created with other crop settings: {json.dumps(queue.get_meta("params"))}', file=sys.stderr)
+            queue.close()
+            return 2
+        queue.set_meta('input_root', input_root)
+        queue.set_meta('mirror', args.mirror)
+        queue.set_meta('params', params)
+        if args.output:
+            queue.set_meta('output', os.path.abspath(args.output))
+        # 与命令行工具一致，输出文件夹位于输入文件夹中时不扫描它
+        skip = [queue.get_meta('output')] if queue.get_meta('output') else []
+        added = queue.enqueue(img_cropper.scan_images(args.input, args.recursive, args.include, args.exclude, skip))
+        print(json.dumps({'queue': args.queue, 'added': added, 'states': queue.counts()}))
+        queue.close()
+        return 0
+
+    if args.command == 'work':
+        if not args.output:
+            queue = WorkQueue(args.queue)
+            args.output = queue.get_meta('output', '')
+            queue.close()
+            if not args.output:
+                print('No output folder, give --output to work or init', file=sys.stderr)
+                return 2
+        counts = {}
+        for result in run_worker(args.queue, args.output, args.workers, args.lease, args.max_attempts, not args.no_wait):
+            counts[result.status] = counts.get(result.status, 0) + 1
+        print(json.dumps({'queue': args.queue, 'processed': counts}))
+        return 0
+
+    if args.command == 'report':
+        queue = WorkQueue(args.queue)
+        report = queue.report(args.errors)
+        queue.close()
+        print(json.dumps(report, ensure_ascii=False))
+        return 1 if report['errors'] else 0
+
+    return selftest(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import sys
+from os import path
+
+import pytest
+
+
+# 源代码不是安装的包，测试直接从 Source Code 文件夹导入
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'Source Code'))
+
+import img_cropper
+
+
+# 各测试互不影响：恢复模块级设置，并清空按文件夹缓存的同名图片统计
+@pytest.fixture(autouse=True)
+def reset_settings(monkeypatch):
+    for name in ('scan_backend', 'strip_min_bytes', 'strip_rows', 'input_root', 'output_mirror', 'durability'):
+        monkeypatch.setattr(img_cropper, name, getattr(img_cropper, name))
+    for name in ('CROPPER_SCAN_BACKEND', 'CROPPER_STRIP_MIN_BYTES', 'CROPPER_STRIP_ROWS', 'CROPPER_INPUT_ROOT', 'CROPPER_MIRROR',
+                 'CROPPER_FSYNC'):
+        monkeypatch.delenv(name, raising=False)
+    img_cropper.sibling_stems.cache_clear()
+    yield
+    img_cropper.sibling_stems.cache_clear()
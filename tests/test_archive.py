@@ -0,0 +1,74 @@
+import io
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+
+import archive
+import img_cropper
+
+cv2 = pytest.importorskip('cv2')
+
+
+# 白底上一块深色内容，filled 时整张图都是内容
+def encode(ext, offset, filled=False):
+    img = np.full((30, 40, 3), 0 if filled else 255, np.uint8)
+    img[5 + offset:15 + offset, 10:20] = 40
+    return cv2.imencode(ext, img)[1].tobytes()
+
+
+# 成员名 -> 内容；a.png 与 a.jpg 的输出同名，full.png 无需裁剪，notes.txt 不是图片
+MEMBERS = {
+    'a.png': encode('.png', 0),
+    'a.jpg': encode('.jpg', 1),
+    'sub/b.png': encode('.png', 2),
+    'full.png': encode('.png', 0, filled=True),
+    'notes.txt': b'not an image',
+}
+
+
+def write_archive(archive_path):
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'w') as f:
+            for name, data in MEMBERS.items():
+                f.writestr(name, data)
+        return
+    with tarfile.open(archive_path, 'w:gz') as f:
+        for name, data in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            f.addfile(info, io.BytesIO(data))
+
+
+def read_archive(archive_path):
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as f:
+            return {name: f.read(name) for name in f.namelist()}
+    with tarfile.open(archive_path) as f:
+        return {member.name: f.extractfile(member).read() for member in f.getmembers()}
+
+
+# 输出归档中每个成员与逐个裁剪的结果一致，重名的输出另加序号，未裁剪的成员原样写出
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('ext', ['.zip', '.tar.gz'])
+def test_archive_round_trip(tmp_path, ext, workers):
+    input_path, output_path = str(tmp_path / ('in' + ext)), str(tmp_path / ('out' + ext))
+    write_archive(input_path)
+    results = {result.path: result for _, result in archive.process_archive(input_path, output_path, False, workers)}
+    outputs = read_archive(output_path)
+
+    assert {input_path + '/' + name for name in MEMBERS if name != 'notes.txt'} == set(results)
+    assert {result.output for result in results.values()} == set(outputs) == {'a.png', 'a~2.png', 'sub/b.png', 'full.png'}
+    assert outputs['full.png'] == MEMBERS['full.png']
+    for name, result in results.items():
+        member = name[len(input_path) + 1:]
+        if member == 'full.png':
+            assert result.status == img_cropper.STATUS_NOT_CROPPED
+            continue
+        assert result.status == img_cropper.STATUS_CROPPED, result.error
+        img = cv2.imdecode(np.frombuffer(MEMBERS[member], np.uint8), cv2.IMREAD_UNCHANGED)
+        cropped, _, _, bbox = img_cropper.crop_buffer(np.frombuffer(MEMBERS[member], np.uint8), False)
+        top, bottom, left, right = bbox
+        assert tuple(result.bbox) == bbox
+        assert np.array_equal(cv2.imdecode(np.frombuffer(outputs[result.output], np.uint8), cv2.IMREAD_UNCHANGED), img[top:bottom, left:right])
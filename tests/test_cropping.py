@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+
+import img_cropper
+
+cv2 = pytest.importorskip('cv2')
+
+
+# 白底灰度图，(10:20, 5:30) 为内容
+def gray_image(dtype=np.uint8):
+    img = np.full((40, 50), np.iinfo(dtype).max, dtype)
+    img[10:20, 5:30] = np.iinfo(dtype).max // 8
+    return img
+
+
+@pytest.mark.parametrize('ext', ['.png', '.jpg'])
+def test_gray_white_mode(tmp_path, ext):
+    file_path = str(tmp_path / ('gray' + ext))
+    cv2.imwrite(file_path, gray_image(), [cv2.IMWRITE_JPEG_QUALITY, 100])
+
+    result = img_cropper.run_safely(file_path, str(tmp_path / 'output'), False)
+    assert result.status == img_cropper.STATUS_CROPPED, result.error
+    top, bottom, left, right = result.bbox
+    # JPEG 的压缩噪声只会让边界框略大
+    assert top <= 10 and bottom >= 20 and left <= 5 and right >= 30
+    assert (bottom - top, right - left) == cv2.imread(result.output, cv2.IMREAD_UNCHANGED).shape
+    assert img_cropper.crop_buffer(np.fromfile(file_path, np.uint8), False)[3] == result.bbox
+    if ext == '.png':
+        assert result.bbox == (10, 20, 5, 30)
+
+
+@pytest.mark.parametrize('ext', ['.png', '.jpg'])
+def test_gray_alpha_mode_is_not_cropped(tmp_path, ext):
+    file_path = str(tmp_path / ('gray' + ext))
+    cv2.imwrite(file_path, gray_image())
+    result = img_cropper.run_safely(file_path, str(tmp_path / 'output'), True)
+    assert result.status == img_cropper.STATUS_NOT_CROPPED, result.error
+    # 不经过文件头预检查时同样不裁剪
+    assert img_cropper.crop_buffer(cv2.imread(file_path, cv2.IMREAD_UNCHANGED), True)[3] == (0, 40, 0, 50)
+
+
+@pytest.mark.parametrize('backend', ['mask', 'edges'])
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_gray_backends(monkeypatch, backend, dtype):
+    monkeypatch.setattr(img_cropper, 'scan_backend', backend)
+    assert img_cropper.find_crop_bbox(gray_image(dtype), False) == (10, 20, 5, 30)
+    big = np.full((3000, 3000), 255, np.uint8)
+    big[100:200, 300:400] = 0
+    assert img_cropper.find_crop_bbox(big, False) == (100, 200, 300, 400)
+
+
+@pytest.mark.parametrize('is_alpha', [False, True])
+def test_gray_strip_mode_matches_whole_decode(tmp_path, monkeypatch, is_alpha):
+    file_path = str(tmp_path / 'gray.png')
+    cv2.imwrite(file_path, gray_image())
+    whole = img_cropper.process_file(file_path, str(tmp_path / 'whole'), is_alpha)
+    monkeypatch.setattr(img_cropper, 'strip_min_bytes', 1)
+    monkeypatch.setattr(img_cropper, 'strip_rows', 7)
+    strips = img_cropper.process_file(file_path, str(tmp_path / 'strips'), is_alpha)
+    assert (strips.status, strips.bbox) == (whole.status, whole.bbox)
+    if whole.output:
+        assert np.array_equal(cv2.imread(strips.output, cv2.IMREAD_UNCHANGED), cv2.imread(whole.output, cv2.IMREAD_UNCHANGED))
+
+
+# 未安装 numba 时，无论经 set_scan_backend 还是环境变量选中 numba，都应改用 mask 且只提示一次
+def test_numba_falls_back_to_mask(monkeypatch):
+    monkeypatch.setattr(img_cropper, 'numba_available', lambda: False)
+    monkeypatch.setattr(img_cropper, 'numba_fallback_warned', False)
+    with pytest.warns(RuntimeWarning, match='numba is not installed') as record:
+        img_cropper.set_scan_backend('numba')
+        assert img_cropper.find_crop_bbox(gray_image(), False) == (10, 20, 5, 30)
+        assert img_cropper.resolve_scan_backend() == 'mask'
+    assert len(record) == 1
+    assert img_cropper.scan_backend == 'numba'
+
+
+# 由内容像素的坐标直接求出的边界框，作为各后端的参照
+def reference_bbox(img, is_alpha, background=255):
+    content = img[..., 3] > 0 if is_alpha else (img != background).any(axis=2)
+    rows, cols = np.nonzero(content)
+    if not len(rows):
+        return 0, img.shape[0], 0, img.shape[1]
+    return rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+
+
+# 彩色与透明图片在各后端、整图与逐条带处理下的边界框一致
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('is_alpha', [False, True])
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_backends_and_strips_agree(tmp_path, monkeypatch, seed, is_alpha, dtype):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(1, 120, 2)
+    maximum = np.iinfo(dtype).max
+    img = np.zeros((height, width, 4), dtype) if is_alpha else np.full((height, width, 3), maximum, dtype)
+    # 最后一个种子为没有内容的图片
+    if seed < 5:
+        for _ in range(rng.integers(1, 4)):
+            y, x = rng.integers(0, height), rng.integers(0, width)
+            img[y, x] = rng.integers(0, maximum, img.shape[2])
+            img[y, x, -1] = maximum - 1 if not is_alpha else maximum
+    expected = tuple(int(value) for value in reference_bbox(img, is_alpha, maximum))
+
+    for backend in ('mask', 'edges'):
+        monkeypatch.setattr(img_cropper, 'scan_backend', backend)
+        assert img_cropper.find_crop_bbox(img, is_alpha) == expected
+
+    file_path = str(tmp_path / 'img.png')
+    cv2.imwrite(file_path, img)
+    whole = img_cropper.process_file(file_path, str(tmp_path / 'whole'), is_alpha)
+    monkeypatch.setattr(img_cropper, 'strip_min_bytes', 1)
+    monkeypatch.setattr(img_cropper, 'strip_rows', 7)
+    strips = img_cropper.process_file(file_path, str(tmp_path / 'strips'), is_alpha)
+    assert whole.bbox == strips.bbox == expected
+    if whole.output:
+        top, bottom, left, right = expected
+        assert np.array_equal(cv2.imread(whole.output, cv2.IMREAD_UNCHANGED), img[top:bottom, left:right])
+        assert np.array_equal(cv2.imread(strips.output, cv2.IMREAD_UNCHANGED), img[top:bottom, left:right])
+
+
+# 空文件报告为无法解码，而不是 OpenCV 的断言错误
+@pytest.mark.parametrize('name', ['empty.png', 'empty.jpg', 'empty.gif'])
+@pytest.mark.parametrize('strips', [False, True])
+def test_empty_file_is_a_decode_error(tmp_path, monkeypatch, name, strips):
+    file_path = tmp_path / name
+    file_path.write_bytes(b'')
+    if strips:
+        monkeypatch.setattr(img_cropper, 'strip_min_bytes', 1)
+    result = img_cropper.run_safely(str(file_path), str(tmp_path / 'output'), False)
+    assert (result.status, result.error) == (img_cropper.STATUS_ERROR, repr(img_cropper.DecodeError('empty file')))
+    with pytest.raises(img_cropper.DecodeError, match='empty file'):
+        img_cropper.crop_buffer(b'', True)
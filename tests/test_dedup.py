@@ -0,0 +1,56 @@
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+import img_cropper
+
+cv2 = pytest.importorskip('cv2')
+
+
+def make_duplicates(folder, copies=3):
+    paths = []
+    for i in range(4):
+        img = np.zeros((30, 40, 4), np.uint8)
+        img[5:15, 10 + i:20 + i] = 255
+        first = str(folder / f'im{i}_0.png')
+        cv2.imwrite(first, img)
+        paths.append(first)
+        for copy in range(1, copies):
+            paths.append(str(folder / f'im{i}_{copy}.png'))
+            shutil.copyfile(first, paths[-1])
+    return sorted(paths)
+
+
+@pytest.mark.parametrize('workers, pipeline', [(1, None), (2, None), (2, img_cropper.PipelineOptions())])
+def test_duplicates_are_hashed_off_the_coordinator(tmp_path, monkeypatch, workers, pipeline):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    paths = make_duplicates(folder)
+    hash_threads = []
+    data_hash = img_cropper.data_hash
+
+    def record(data, seed=b''):
+        hash_threads.append(threading.current_thread())
+        return data_hash(data, seed)
+
+    monkeypatch.setattr(img_cropper, 'data_hash', record)
+    dedup = img_cropper.DedupOptions(str(tmp_path / 'cache'))
+    for run in range(2):
+        output_path = tmp_path / f'output{run}'
+        runner = img_cropper.BatchRunner(img_cropper.CropJob(str(folder), str(output_path), workers=workers, pipeline=pipeline,
+                                                             dedup=dedup))
+        results = list(runner.run(paths))
+        assert sorted(result.path for result in results) == paths
+        assert all(result.status == img_cropper.STATUS_CROPPED for result in results)
+        assert sorted(path.name for path in output_path.iterdir()) == sorted(path.rsplit('/', 1)[1] for path in paths)
+        # 首次运行中每组内容相同的图片只处理一张，第二次全部取自缓存
+        assert sum(result.deduplicated for result in results) == (8 if run == 0 else 12)
+    assert hash_threads and threading.main_thread() not in hash_threads
+
+
+def test_data_hash_matches_file_hash(tmp_path):
+    file_path = tmp_path / 'data.bin'
+    file_path.write_bytes(bytes(range(256)) * 9000)
+    assert img_cropper.data_hash(img_cropper.file_bytes(str(file_path)), b'seed') == img_cropper.file_hash(str(file_path), b'seed')
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+import img_cropper
+
+cv2 = pytest.importorskip('cv2')
+
+
+# 透明底上一块不透明内容，offset 决定内容的位置
+def write_image(file_path, offset=0):
+    img = np.zeros((30, 40, 4), np.uint8)
+    img[5 + offset:15 + offset, 10:20] = 200
+    cv2.imwrite(str(file_path), img)
+
+
+def run(folder, **options):
+    job = img_cropper.CropJob(str(folder), str(folder / 'output'), incremental=True, **options)
+    paths = sorted(str(path) for path in folder.glob('*.png'))
+    return {os.path.basename(result.path): result for result in img_cropper.BatchRunner(job).run(paths)}
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for i in range(3):
+        write_image(tmp_path / f'{i}.png', i)
+    return tmp_path
+
+
+def test_unchanged_images_are_skipped(folder):
+    first = run(folder)
+    assert {result.status for result in first.values()} == {img_cropper.STATUS_CROPPED}
+    assert not any(result.cached for result in first.values())
+    assert (folder / 'output' / img_cropper.Manifest.file_name).exists()
+
+    second = run(folder)
+    assert all(result.cached for result in second.values())
+    assert {name: list(result.bbox) for name, result in second.items()} == {name: list(result.bbox) for name, result in first.items()}
+
+
+def test_changed_or_missing_outputs_are_reprocessed(folder):
+    run(folder)
+    write_image(folder / '1.png', 10)
+    stat_result = os.stat(folder / '1.png')
+    os.utime(folder / '1.png', ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+    os.remove(folder / 'output' / '2.png')
+
+    results = run(folder)
+    assert [name for name, result in sorted(results.items()) if not result.cached] == ['1.png', '2.png']
+    assert results['1.png'].bbox == (15, 25, 10, 20)
+    assert (folder / 'output' / '2.png').exists()
+
+
+# 只修改了时间而内容相同的图片，比较内容哈希时仍然跳过
+@pytest.mark.parametrize('use_hash', [False, True])
+def test_touched_images(folder, use_hash):
+    run(folder, use_hash=use_hash)
+    stat_result = os.stat(folder / '0.png')
+    os.utime(folder / '0.png', ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+    assert run(folder, use_hash=use_hash)['0.png'].cached == use_hash
+
+
+# 裁剪参数改变时上次的记录全部失效
+def test_changed_params_invalidate_manifest(folder):
+    run(folder)
+    results = run(folder, tolerance=img_cropper.Tolerance(alpha=10))
+    assert not any(result.cached for result in results.values())
+    assert all(result.cached for result in run(folder, tolerance=img_cropper.Tolerance(alpha=10)).values())
@@ -0,0 +1,40 @@
+import pytest
+
+import archive
+import img_cropper
+
+
+def touch(folder, *names):
+    for name in names:
+        file_path = folder / name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(b'')
+
+
+def test_sibling_extensions_and_escaping(tmp_path):
+    touch(tmp_path, 'a.png', 'c.jpg', 'c.png', 'c+jpg.png', 'd~e.png', '100%.png')
+    img_cropper.set_output_layout('', False)
+    names = {name: img_cropper.get_temp_name(str(tmp_path / name)) for name in ['a.png', 'c.jpg', 'c.png', 'c+jpg.png', 'd~e.png', '100%.png']}
+    assert names == {'a.png': 'a', 'c.jpg': 'c+jpg', 'c.png': 'c+png', 'c+jpg.png': 'c%2Bjpg', 'd~e.png': 'd%7Ee', '100%.png': '100%25'}
+
+
+# 子文件夹中的图片以 ~ 连接文件夹名（--mirror 时重建子文件夹），各种组合得到的输出名互不相同
+@pytest.mark.parametrize('mirror', [False, True])
+def test_recursive_names_are_distinct(tmp_path, mirror):
+    inputs = ['sub/a.png', 'sub_a.png', 'x_y/b.png', 'x/y_b.png', 'c.jpg', 'c.png', 'c_jpg.png', 'c+jpg.png', 'd~e.png', 'sub~a.png']
+    touch(tmp_path, *inputs)
+    img_cropper.set_output_layout(str(tmp_path), mirror)
+    names = [img_cropper.get_temp_name(str(tmp_path / name)) for name in inputs]
+    assert len({name.lower() for name in names}) == len(inputs)
+    assert names[0] == ('sub/a' if mirror else 'sub~a')
+    assert names[-1] == 'sub%7Ea'
+
+
+# 归档中重名的输出另加序号，序号加在后缀之前
+def test_archive_writer_suffixes_clashes(tmp_path):
+    writer = archive.ArchiveWriter(str(tmp_path / 'out'))
+    written = [writer.write(name, b'x') for name in ['a.png', 'A.png', 'a.png', '../a.png', 'b/a.png', 'a~2.png']]
+    writer.close()
+    assert written == ['a.png', 'A~2.png', 'a~3.png', 'a~4.png', 'b/a.png', 'a~2~2.png']
+    assert sorted(path.name for path in (tmp_path / 'out').iterdir() if path.is_file()) == sorted(
+        ['a.png', 'A~2.png', 'a~3.png', 'a~4.png', 'a~2~2.png'])
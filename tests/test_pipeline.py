@@ -0,0 +1,87 @@
+import concurrent.futures
+import threading
+
+import numpy as np
+import pytest
+
+import img_cropper
+
+cv2 = pytest.importorskip('cv2')
+
+
+def write_images(folder, count):
+    img = np.zeros((30, 40, 4), np.uint8)
+    img[5:15, 10:20] = 255
+    paths = []
+    for i in range(count):
+        paths.append(str(folder / f'im{i}.png'))
+        cv2.imwrite(paths[-1], img)
+    return paths
+
+
+def write_animation(file_path):
+    animation = cv2.Animation()
+    frames = []
+    for i in range(3):
+        frame = np.zeros((40, 50, 4), np.uint8)
+        frame[5 + i:20 + i, 10:30] = 255
+        frames.append(frame)
+    animation.frames = frames
+    animation.durations = [100] * 3
+    ok, data = cv2.imencodeanimation('.gif', animation)
+    assert ok
+    data.tofile(file_path)
+
+
+# 多帧图片的判断在读取线程中进行，调度线程不读取文件头
+def test_frame_probe_runs_in_reader_threads(tmp_path, monkeypatch):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    paths = write_images(folder, 6)
+    write_animation(str(folder / 'anim.gif'))
+    paths.append(str(folder / 'anim.gif'))
+
+    probe_threads = []
+    may_have_frames = img_cropper.may_have_frames
+
+    def record(file_path):
+        probe_threads.append(threading.current_thread())
+        return may_have_frames(file_path)
+
+    monkeypatch.setattr(img_cropper, 'may_have_frames', record)
+    results = dict(img_cropper.process_batch(paths, str(tmp_path / 'output'), True, ordered=True,
+                                             pipeline=img_cropper.PipelineOptions()))
+    assert sorted(results) == list(range(len(paths)))
+    assert all(result.status == img_cropper.STATUS_CROPPED for result in results.values())
+    assert results[len(paths) - 1].frames is not None
+    assert probe_threads and threading.main_thread() not in probe_threads
+
+
+def test_pipeline_matches_plain_batch(tmp_path):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    paths = write_images(folder, 5)
+    plain = dict(img_cropper.process_batch(paths, str(tmp_path / 'plain'), True))
+    piped = dict(img_cropper.process_batch(paths, str(tmp_path / 'piped'), True, pipeline=img_cropper.PipelineOptions()))
+    assert {i: r.bbox for i, r in plain.items()} == {i: r.bbox for i, r in piped.items()}
+
+
+# 计算在进程池中执行时只传文件路径，读取线程映射的文件内容不经序列化复制到计算进程
+def test_process_workers_read_by_path(tmp_path, monkeypatch):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    paths = write_images(folder, 6)
+    submitted = []
+
+    class RecordingExecutor(concurrent.futures.ProcessPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append((fn, args))
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', RecordingExecutor)
+    piped = dict(img_cropper.process_batch(paths, str(tmp_path / 'piped'), True, workers=2, pipeline=img_cropper.PipelineOptions()))
+    plain = dict(img_cropper.process_batch(paths, str(tmp_path / 'plain'), True))
+    assert {i: r.bbox for i, r in piped.items()} == {i: r.bbox for i, r in plain.items()}
+    assert all(result.status == img_cropper.STATUS_CROPPED for result in piped.values())
+    assert {fn for fn, _ in submitted} == {img_cropper.compute_file_stage}
+    assert not any(isinstance(arg, (bytes, bytearray, memoryview, np.ndarray)) for _, args in submitted for arg in args)
@@ -0,0 +1,154 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+import img_cropper
+import png_stream
+
+cv2 = pytest.importorskip('cv2')
+
+# (颜色类型, 位深)：逐条带解码支持的组合
+SUPPORTED = [(0, 8), (0, 16), (2, 8), (2, 16), (3, 8), (4, 8), (4, 16), (6, 8), (6, 16)]
+# 不支持的组合由调用方改为整图解码
+UNSUPPORTED = [(0, 1), (0, 2), (0, 4), (3, 1), (3, 2), (3, 4)]
+# 各行使用同一种滤波，或按行轮流使用全部滤波
+FILTERS = [0, 1, 2, 3, 4, 'mixed']
+
+
+def chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+# 按 PNG 规范对一行字节滤波，prior 为上一行（未滤波）
+def filter_line(filter_type, line, prior, bpp):
+    line, prior = line.astype(np.int32), prior.astype(np.int32)
+    a = np.concatenate([np.zeros(bpp, np.int32), line[:-bpp]])
+    b = prior
+    c = np.concatenate([np.zeros(bpp, np.int32), prior[:-bpp]])
+    if filter_type == 0:
+        predictor = 0
+    elif filter_type == 1:
+        predictor = a
+    elif filter_type == 2:
+        predictor = b
+    elif filter_type == 3:
+        predictor = (a + b) // 2
+    else:
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        predictor = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    return ((line - predictor) & 0xFF).astype(np.uint8)
+
+
+# 由各行的样本字节手工编码 PNG，OpenCV 写不出低位深、指定滤波或带 tRNS 的图片
+def encode_png(rows, width, bit_depth, color_type, filters, palette=None, transparency=None, interlace=0):
+    bpp = max(png_stream.SAMPLES[color_type] * bit_depth // 8, 1)
+    prior = np.zeros(rows.shape[1], np.uint8)
+    raw = bytearray()
+    for y, line in enumerate(rows):
+        filter_type = y % 5 if filters == 'mixed' else filters
+        raw.append(filter_type)
+        raw += filter_line(filter_type, line, prior, bpp).tobytes()
+        prior = line
+    png = png_stream.PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, len(rows), bit_depth, color_type, 0, 0, interlace))
+    if palette is not None:
+        png += chunk(b'PLTE', palette.tobytes())
+    if transparency is not None:
+        png += chunk(b'tRNS', transparency)
+    # 拆成多个 IDAT，检查跨数据块读取
+    data = zlib.compress(bytes(raw))
+    for i in range(0, len(data), 97):
+        png += chunk(b'IDAT', data[i:i + 97])
+    return png + chunk(b'IEND', b'')
+
+
+# 随机内容的测试图片，返回 PNG 文件的字节
+def random_png(color_type, bit_depth, filters, width=13, height=11, transparency=None, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = png_stream.SAMPLES[color_type]
+    if bit_depth == 16:
+        values = rng.integers(0, 1 << 16, (height, width * samples)).astype('>u2')
+        rows = values.view(np.uint8).reshape(height, -1)
+    elif bit_depth == 8:
+        rows = rng.integers(0, 256, (height, width * samples), dtype=np.uint8)
+    else:
+        values = rng.integers(0, 1 << bit_depth, (height, width))
+        bits = ((values[..., np.newaxis] >> np.arange(bit_depth)[::-1]) & 1).reshape(height, -1)
+        rows = np.packbits(bits, axis=1)
+    palette = rng.integers(0, 256, (1 << min(bit_depth, 8), 3), dtype=np.uint8) if color_type == 3 else None
+    if color_type == 3 and transparency is None and seed % 2:
+        transparency = rng.integers(0, 256, 7, dtype=np.uint8).tobytes()
+    return encode_png(rows, width, bit_depth, color_type, filters, palette, transparency)
+
+
+def decode_strips(data, rows):
+    reader = png_stream.PngStripReader(io.BytesIO(data))
+    strips = [strip for _, strip in reader.strips(rows)]
+    return reader, np.concatenate(strips)
+
+
+# 逐条带解码与 cv2.imdecode 一致；line 为安装 numba 时逐行还原的路径（此处以未编译的同一函数执行）
+@pytest.mark.parametrize('path', ['block', 'line'])
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('color_type, bit_depth', SUPPORTED)
+def test_strips_match_imdecode(monkeypatch, color_type, bit_depth, filters, path):
+    if path == 'line':
+        monkeypatch.setattr(png_stream, 'njit', object())
+    for seed in (0, 1):
+        data = random_png(color_type, bit_depth, filters, seed=seed)
+        expected = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        if expected.ndim == 2:
+            expected = expected[..., np.newaxis]
+        for rows in (1, 4, 11):
+            reader, decoded = decode_strips(data, rows)
+            assert reader.shape == expected.shape
+            assert decoded.dtype == expected.dtype
+            assert np.array_equal(decoded, expected)
+
+
+# 一块中只有一行、宽度只有一个像素时也能正确还原
+@pytest.mark.parametrize('filters', [3, 4, 'mixed'])
+def test_narrow_images(filters):
+    for width, height in ((1, 9), (9, 1), (1, 1)):
+        data = random_png(6, 8, filters, width, height)
+        expected = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        assert np.array_equal(decode_strips(data, 3)[1], expected)
+
+
+# 不支持的格式抛出 UnsupportedPng，逐条带处理时改为整图解码，结果与整图处理相同
+@pytest.mark.parametrize('kind', ['low_depth', 'trns', 'interlace'])
+def test_unsupported_falls_back_to_whole_decode(tmp_path, monkeypatch, kind):
+    cases = {
+        'low_depth': [random_png(color_type, bit_depth, 'mixed') for color_type, bit_depth in UNSUPPORTED],
+        'trns': [random_png(0, 8, 4, transparency=b'\x00\x10'), random_png(2, 8, 4, transparency=b'\x00\x10\x00\x20\x00\x30'),
+                 random_png(0, 16, 4, transparency=b'\x12\x34')],
+        # 1x1 的图片 Adam7 隔行扫描只有第一遍，图像数据与非隔行扫描相同
+        'interlace': [encode_png(np.array([[10, 20, 30, 255]], np.uint8), 1, 8, 6, 0, interlace=1)],
+    }
+    for i, data in enumerate(cases[kind]):
+        with pytest.raises(png_stream.UnsupportedPng):
+            png_stream.PngStripReader(io.BytesIO(data))
+        file_path = tmp_path / f'{kind}{i}.png'
+        file_path.write_bytes(data)
+        whole = img_cropper.process_file(str(file_path), str(tmp_path / 'whole'), True)
+        monkeypatch.setattr(img_cropper, 'strip_min_bytes', 1)
+        strips = img_cropper.process_file(str(file_path), str(tmp_path / 'strips'), True)
+        monkeypatch.setattr(img_cropper, 'strip_min_bytes', 0)
+        assert (strips.status, strips.bbox, strips.error) == (whole.status, whole.bbox, whole.error)
+
+
+# 逐条带写出的 PNG 与原数组一致
+@pytest.mark.parametrize('channels, dtype', [(1, np.uint8), (3, np.uint8), (4, np.uint8), (1, np.uint16), (4, np.uint16)])
+def test_writer_round_trip(channels, dtype):
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, np.iinfo(dtype).max + 1, (37, 21, channels)).astype(dtype)
+    f = io.BytesIO()
+    writer = png_stream.PngStripWriter(f, 21, 37, channels, dtype)
+    for y in range(0, 37, 10):
+        writer.write_strip(img[y:y + 10])
+    writer.close()
+    decoded = cv2.imdecode(np.frombuffer(f.getvalue(), np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decoded.reshape(img.shape), img)
+    assert np.array_equal(decode_strips(f.getvalue(), 8)[1], img)
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+import img_cropper
+import shard
+
+cv2 = pytest.importorskip('cv2')
+
+
+# 浅灰底（245）的图片，只有容差足够时才裁掉底色
+def write_images(folder):
+    folder.mkdir()
+    for i in range(3):
+        img = np.full((30, 40, 3), 245, np.uint8)
+        img[5 + i:15, 10:20] = 0
+        cv2.imwrite(str(folder / f'{i}.png'), img)
+
+
+# 裁剪模式、容差与输出选项由 init 存入队列，work 不再各自决定
+def test_work_uses_settings_from_init(tmp_path, capsys):
+    write_images(tmp_path / 'in')
+    queue = str(tmp_path / 'queue.db')
+    output = tmp_path / 'out'
+    args = ['init', queue, str(tmp_path / 'in'), '-o', str(output), '-m', 'white', '--background', '245,245,245', '--tolerance', '2',
+            '-f', 'sidecar']
+    assert shard.main(args) == 0
+    assert shard.main(['work', queue, '-w', '1', '--no-wait']) == 0
+    assert json.loads(capsys.readouterr().out.splitlines()[-1])['processed'] == {img_cropper.STATUS_CROPPED: 3}
+    for i in range(3):
+        with open(output / f'{i}.json') as f:
+            assert json.load(f)['bbox'] == [5 + i, 15, 10, 20]
+
+    # 设置不同的再次 init 被拒绝，相同设置可继续添加图片
+    assert shard.main(args[:5] + ['-m', 'alpha']) == 2
+    assert shard.main(args) == 0
+
+
+def test_index_format_is_rejected(tmp_path):
+    write_images(tmp_path / 'in')
+    assert shard.main(['init', str(tmp_path / 'queue.db'), str(tmp_path / 'in'), '-f', 'index']) == 2
+
+
+def test_crop_params_round_trip():
+    output_options = img_cropper.OutputOptions('keep', 3, 'rle', 80, 'independent', (img_cropper.DerivedOutput('_t', 64, True, 'jpg', 70),))
+    tolerance = img_cropper.Tolerance(10, (1, 2, 3), 4)
+    params = json.loads(json.dumps(img_cropper.crop_params(False, output_options, tolerance)))
+    assert shard.read_crop_params(params) == (False, output_options, tolerance)
+    assert shard.read_crop_params(None) == (True, img_cropper.OutputOptions(), img_cropper.Tolerance())